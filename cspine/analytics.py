@@ -0,0 +1,404 @@
+"""
+Rater agreement and re-click drift from every click in ``cspine.db``.
+
+``python -m cspine analytics`` prints, per label (and per dataset with
+``--by-dataset``):
+
+  * distance between raters' current points on the same image (all rater pairs)
+  * ICC(1) of x, y and z across raters
+  * points far from the other raters' (robust z score of the leave-one-out distance)
+  * how often a label was clicked again, and how far the final point moved from the first
+
+Distances are in voxels. The ``point`` table is read in chunks into numpy
+arrays and grouped with sorting/``bincount``, not per row python. Each
+rater's clicks are reduced to one row per (image, user, label) and kept in
+a state file keyed on the last db rowid, so the next run only rereads
+images with new clicks.
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+import tempfile
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from cspine import db
+from cspine.labels import LABELS
+
+#: reduced per rater tables are remembered here between runs
+STATE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                         "cspine", "analytics")
+#: (regex, dataset) tried in order on the image path. group 1 is used if dataset is None
+DATASETS = ((re.compile('NCANDA'), 'ncanda'),
+            (re.compile(r'/Projects/([^/]+)/'), None))
+#: robust z score above which a point is an outlier
+DEFAULT_THRESHOLD = 3.5
+
+#: columns of a rater table, see :py:func:`rater_points`
+RATER_COLUMNS = ('image', 'user', 'label', 'x', 'y', 'z', 'n_clicks', 'drift', 'spread', 'rowid')
+
+
+class PointColumns(NamedTuple):
+    "point rows as arrays. image, user, label are codes into ``names``"
+    image: np.ndarray
+    user: np.ndarray
+    label: np.ndarray
+    xyz: np.ndarray  #: (n, 3) float
+    rowid: np.ndarray
+    names: dict  #: 'image'/'user'/'label' -> array of names, indexed by code
+
+
+def dataset_of(image: str) -> str:
+    """
+    >>> dataset_of('/Volumes/Hera/Projects/Habit/mr/BIDS/sub-1/ses-1/anat/sub-1_ses-1_T1w.nii.gz')
+    'habit'
+    >>> dataset_of('/d/NCANDA_S00033/t1.nii.gz')
+    'ncanda'
+    >>> dataset_of('mprage.nii.gz')
+    ''
+    """
+    for regex, name in DATASETS:
+        if m := regex.search(image):
+            return name or m.group(1).lower()
+    return ''
+
+
+def read_points(db_fname: os.PathLike, images: Optional[Iterable[str]] = None,
+                chunk_size: int = 100_000) -> PointColumns:
+    """
+    every click (or only clicks on images) as columns, chunk_size rows at a time.
+    rows without a position are dropped.
+    """
+    sql = "SELECT point.rowid, image, ifnull(user,''), label, x, y, z FROM point"
+    conn = db.connect_ro(db_fname)
+    if images is not None:  # temp tables are fine on a read-only connection
+        conn.execute("CREATE TEMP TABLE touched (image text primary key)")
+        conn.executemany("INSERT OR IGNORE INTO touched VALUES (?)", ((i,) for i in images))
+        sql += " JOIN touched USING (image)"
+    vocab: dict[str, dict[str, int]] = {'image': {}, 'user': {}, 'label': {}}
+    chunks = []
+    cur = conn.execute(sql)
+    while chunk := cur.fetchmany(chunk_size):
+        rowid, *text, x, y, z = zip(*chunk)
+        codes = [np.fromiter((v.setdefault(s, len(v)) for s in col), np.int32, len(col))
+                 for v, col in zip(vocab.values(), text)]
+        xyz = np.array([x, y, z], dtype=float).T
+        chunks.append((np.array(rowid, dtype=np.int64), *codes, xyz))
+    conn.close()
+    if not chunks:
+        return _no_points()
+    names = {k: np.array(list(v), dtype=str) for k, v in vocab.items()}
+    rowid, image, user, label, xyz = (np.concatenate(c) for c in zip(*chunks))
+    keep = ~np.isnan(xyz).any(axis=1)
+    return PointColumns(image[keep], user[keep], label[keep], xyz[keep], rowid[keep], names)
+
+
+def _no_points() -> PointColumns:
+    codes = np.zeros(0, np.int32)
+    return PointColumns(codes, codes, codes, np.zeros((0, 3)), np.zeros(0, np.int64),
+                        {k: np.zeros(0, str) for k in ('image', 'user', 'label')})
+
+
+def _group_starts(*keys: np.ndarray) -> np.ndarray:
+    "start index of each run of equal keys (already sorted)"
+    if not len(keys[0]):
+        return np.zeros(0, dtype=int)
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0] = True
+    for k in keys:
+        change[1:] |= k[1:] != k[:-1]
+    return np.flatnonzero(change)
+
+
+def rater_points(points: PointColumns) -> dict[str, np.ndarray]:
+    """
+    one row per (image, user, label): the last click (by insert order), and
+      n_clicks: times the label was placed
+      drift: distance from the first click to the last
+      spread: mean distance of all clicks to the last
+    """
+    order = np.lexsort((points.rowid, points.label, points.user, points.image))
+    image, user, label = points.image[order], points.user[order], points.label[order]
+    xyz, rowid = points.xyz[order], points.rowid[order]
+    starts = _group_starts(image, user, label)
+    n_clicks = np.diff(np.append(starts, len(order)))
+    last = starts + n_clicks - 1
+    to_last = np.linalg.norm(xyz - np.repeat(xyz[last], n_clicks, axis=0), axis=1)
+    spread = np.add.reduceat(to_last, starts) / n_clicks if len(starts) else np.zeros(0)
+    names = points.names
+    return {'image': names['image'][image[last]], 'user': names['user'][user[last]],
+            'label': names['label'][label[last]],
+            'x': xyz[last, 0], 'y': xyz[last, 1], 'z': xyz[last, 2],
+            'n_clicks': n_clicks, 'drift': to_last[starts], 'spread': spread, 'rowid': rowid[last]}
+
+
+def _take(table: dict[str, np.ndarray], idx) -> dict[str, np.ndarray]:
+    return {k: v[idx] for k, v in table.items()}
+
+
+class Groups(NamedTuple):
+    "rater table sorted by (label, image, user), grouped by (label, image)"
+    table: dict
+    group: np.ndarray   #: group of each row
+    sizes: np.ndarray   #: raters in each group
+    label: np.ndarray   #: label code of each group, into labels
+    image: np.ndarray   #: image code of each group, into images
+    labels: np.ndarray
+    images: np.ndarray
+
+
+def group_raters(raters: dict[str, np.ndarray]) -> Groups:
+    "sort once (on integer codes) for :py:func:`pairwise`, :py:func:`outliers` and :py:func:`summarize`"
+    labels, label = np.unique(raters['label'], return_inverse=True)
+    images, image = np.unique(raters['image'], return_inverse=True)
+    order = np.lexsort((raters['rowid'], image, label))
+    table = _take(raters, order)
+    label, image = label[order], image[order]
+    starts = _group_starts(label, image)
+    sizes = np.diff(np.append(starts, len(order)))
+    group = np.repeat(np.arange(len(sizes)), sizes)
+    return Groups(table, group, sizes, label[starts], image[starts], labels, images)
+
+
+def _xyz(table: dict[str, np.ndarray]) -> np.ndarray:
+    return np.stack([table['x'], table['y'], table['z']], axis=1)
+
+
+def pairwise(raters: dict[str, np.ndarray], groups: Optional[Groups] = None) -> dict[str, np.ndarray]:
+    """
+    distance between every two users' points for the same image and label.
+    :return: columns image, label, user_a, user_b, distance, group
+    """
+    table, group, sizes = (groups or group_raters(raters))[:3]
+    xyz = _xyz(table)
+    a, b = [np.zeros(0, int)], [np.zeros(0, int)]
+    # compare each row with the row `offset` after it, while still in the same group
+    for offset in range(1, int(sizes.max(initial=1))):
+        first = np.flatnonzero(group[:-offset] == group[offset:])
+        a.append(first)
+        b.append(first + offset)
+    a, b = np.concatenate(a), np.concatenate(b)
+    return {'image': table['image'][a], 'label': table['label'][a],
+            'user_a': table['user'][a], 'user_b': table['user'][b],
+            'distance': np.linalg.norm(xyz[a] - xyz[b], axis=1), 'group': group[a]}
+
+
+def icc1(values: np.ndarray, group: np.ndarray) -> float:
+    """
+    one-way random effects ICC(1) of values rated by different raters in each group
+    (image). groups may have different numbers of raters.
+
+    >>> round(icc1(np.array([1., 1.1, 5., 5.2, 9., 8.9]), np.array([0, 0, 1, 1, 2, 2])), 3)
+    0.999
+    """
+    _, group = np.unique(group, return_inverse=True)
+    n_groups = group.max(initial=-1) + 1
+    n = len(values)
+    if n_groups < 2 or n <= n_groups:
+        return float('nan')
+    counts = np.bincount(group).astype(float)
+    means = np.bincount(group, values) / counts
+    ms_between = np.sum(counts * (means - values.mean()) ** 2) / (n_groups - 1)
+    ms_within = np.sum((values - means[group]) ** 2) / (n - n_groups)
+    k0 = (n - np.sum(counts ** 2) / n) / (n_groups - 1)
+    denom = ms_between + (k0 - 1) * ms_within
+    return float((ms_between - ms_within) / denom) if denom else float('nan')
+
+
+def _group_median(values: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """
+    median of values in each group (group ids sorted, 0..n-1 without gaps)
+
+    >>> _group_median(np.array([3., 1, 2, 10, 20]), np.array([0, 0, 0, 1, 1]))
+    array([ 2., 15.])
+    """
+    order = np.lexsort((values, group))
+    starts = _group_starts(group[order])
+    sizes = np.diff(np.append(starts, len(order)))
+    ordered = values[order]
+    return (ordered[starts + (sizes - 1) // 2] + ordered[starts + sizes // 2]) / 2
+
+
+def outliers(raters: dict[str, np.ndarray], threshold: float = DEFAULT_THRESHOLD,
+             groups: Optional[Groups] = None) -> dict[str, np.ndarray]:
+    """
+    each user's distance to the median of all users' points (same image and label),
+    as a robust z score (median/MAD) within the label. only images with >1 rater.
+    with 2 raters both are equally far from the median: a disagreement flags both.
+    :return: columns image, user, label, x, y, z, distance, z_score, outlier, group
+    """
+    groups = groups or group_raters(raters)
+    all_xyz = _xyz(groups.table)
+    center = np.stack([_group_median(all_xyz[:, i], groups.group) for i in range(3)], axis=1)
+    multi = groups.sizes[groups.group] > 1
+    table, group, xyz = _take(groups.table, multi), groups.group[multi], all_xyz[multi]
+    distance = np.linalg.norm(xyz - center[group], axis=1)
+    z_score = np.zeros(len(distance))
+    label = groups.label[group]
+    for code in np.unique(label):
+        idx = label == code
+        med = np.median(distance[idx])
+        mad = 1.4826 * np.median(np.abs(distance[idx] - med))
+        z_score[idx] = (distance[idx] - med) / mad if mad else 0
+    return {'image': table['image'], 'user': table['user'], 'label': table['label'],
+            'x': table['x'], 'y': table['y'], 'z': table['z'],
+            'distance': distance, 'z_score': z_score, 'outlier': z_score > threshold, 'group': group}
+
+
+def _label_order(label: str) -> tuple:
+    return (LABELS.index(label) if label in LABELS else len(LABELS), label)
+
+
+def summarize(raters: dict[str, np.ndarray], by_dataset: bool = False,
+              threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """
+    one row per label (or dataset and label): agreement between raters and re-click drift.
+    """
+    groups = group_raters(raters)
+    pairs = pairwise(raters, groups)
+    flagged = outliers(raters, threshold, groups)
+    # (dataset, label) of each group, as one code
+    datasets = np.array([dataset_of(i) for i in groups.images] if by_dataset else [''] * len(groups.images))
+    dataset_names, dataset = np.unique(datasets, return_inverse=True)
+    key = dataset[groups.image] * len(groups.labels) + groups.label
+    row_key = key[groups.group]
+    table = groups.table
+    reclicked = table['n_clicks'] > 1
+
+    rows = []
+    for k in sorted(np.unique(key), key=lambda k: (_label_order(groups.labels[k % len(groups.labels)]), k)):
+        in_key = row_key == k
+        multi = in_key & (groups.sizes[groups.group] > 1)
+        dist = pairs['distance'][key[pairs['group']] == k]
+        drift = table['drift'][in_key & reclicked]
+        row = {'dataset': str(dataset_names[k // len(groups.labels)])} if by_dataset else {}
+        row.update({
+            'label': str(groups.labels[k % len(groups.labels)]),
+            'images': int(np.sum(key == k)),
+            'multi_rater_images': int(np.sum((key == k) & (groups.sizes > 1))),
+            'pairs': len(dist),
+            'mean_dist': float(dist.mean()) if len(dist) else float('nan'),
+            'median_dist': float(np.median(dist)) if len(dist) else float('nan'),
+            'p95_dist': float(np.percentile(dist, 95)) if len(dist) else float('nan'),
+            **{f'icc_{c}': icc1(table[c][multi], groups.group[multi]) for c in ('x', 'y', 'z')},
+            'outliers': int(flagged['outlier'][key[flagged['group']] == k].sum()),
+            'reclicked': float(reclicked[in_key].mean()),
+            'mean_drift': float(drift.mean()) if len(drift) else 0.0})
+        rows.append(row)
+    return rows
+
+
+def write_tsv(rows: Iterable[dict], out=sys.stdout, header: Optional[list[str]] = None):
+    """
+    rows (dicts with the same keys) as a tab separated table. floats to 3 decimals
+    :param header: columns, written even if there are no rows. default keys of the first row
+    """
+    if header is not None:
+        out.write("\t".join(header) + "\n")
+    for row in rows:
+        if header is None:
+            header = list(row)
+            out.write("\t".join(header) + "\n")
+        out.write("\t".join("%.3f" % v if isinstance(v, (float, np.floating)) else str(v)
+                            for v in row.values()) + "\n")
+
+
+def _rows(table: dict[str, np.ndarray]) -> Iterable[dict]:
+    for i in range(len(next(iter(table.values())))):
+        yield {k: v[i].item() if hasattr(v[i], 'item') else v[i] for k, v in table.items()}
+
+
+class Analysis:
+    """
+    per rater table (:py:func:`rater_points`) of every image, kept up to date
+    by :py:meth:`update` rereading only images clicked since ``last_rowid``.
+    """
+    def __init__(self, raters: Optional[dict[str, np.ndarray]] = None, last_rowid: int = 0):
+        self.raters = raters if raters is not None else rater_points(_no_points())
+        self.last_rowid = last_rowid
+
+    def update(self, db_fname: os.PathLike, chunk_size: int = 100_000) -> set[str]:
+        """
+        reread images with clicks after last_rowid. everything on the first run,
+        or if the db has fewer rows than last time (replaced).
+        :return: images reread. empty set if nothing changed
+        """
+        with db.connect_ro(db_fname) as conn:
+            max_rowid = conn.execute("SELECT ifnull(max(rowid), 0) FROM point").fetchone()[0]
+        conn.close()
+        if max_rowid < self.last_rowid:
+            logging.warning("%s has fewer rows than when last analyzed. starting over", db_fname)
+            self.last_rowid = 0
+        if self.last_rowid == 0:
+            points = read_points(db_fname, chunk_size=chunk_size)
+            touched = set(points.names['image'])
+            self.raters = rater_points(points)
+        else:
+            touched, _ = db.annotated_images(db_fname, self.last_rowid)
+            if not touched:
+                return set()
+            fresh = rater_points(read_points(db_fname, touched, chunk_size))
+            keep = ~np.isin(self.raters['image'], list(touched))
+            self.raters = {k: np.concatenate([self.raters[k][keep], fresh[k]]) for k in RATER_COLUMNS}
+        self.last_rowid = max_rowid
+        return touched
+
+    def save(self, fname: os.PathLike):
+        os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)), suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, last_rowid=self.last_rowid, **self.raters)
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname: os.PathLike) -> 'Analysis':
+        "saved state, or empty (full rerun) if missing or unreadable"
+        if not os.path.exists(fname):
+            return cls()
+        try:
+            with np.load(fname) as saved:
+                return cls({k: saved[k] for k in RATER_COLUMNS}, int(saved['last_rowid']))
+        except (OSError, ValueError, KeyError) as err:
+            logging.warning("ignoring unreadable analytics state %s: %s", fname, err)
+            return cls()
+
+
+def state_file(db_fname: os.PathLike) -> str:
+    "where :py:class:`Analysis` of db_fname is saved, by default"
+    key = hashlib.sha1(os.path.abspath(db_fname).encode()).hexdigest()[:16]
+    return os.path.join(STATE_DIR, f"{key}.npz")
+
+
+def main(argv=None):
+    "print rater agreement per label"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine analytics', description='rater agreement and re-click drift')
+    parser.add_argument('--db', default=db.DEFAULT_DB, help='sqlite database (default: %(default)s)')
+    parser.add_argument('--state', help='remembered per rater table (default: in %s)' % STATE_DIR)
+    parser.add_argument('--full', action='store_true', help='reread the whole db, ignore saved state')
+    parser.add_argument('--by-dataset', action='store_true', help='summarize each dataset separately')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='robust z score of an outlier (default: %(default)s)')
+    parser.add_argument('--out', help='write the summary here instead of printing it')
+    parser.add_argument('--outliers', help='write flagged points (image, user, label, ...) here')
+    args = parser.parse_args(argv)
+
+    state = args.state or state_file(args.db)
+    analysis = Analysis() if args.full else Analysis.load(state)
+    touched = analysis.update(args.db)
+    logging.info("reread %d images, %d rater points", len(touched), len(analysis.raters['image']))
+    analysis.save(state)
+
+    summary = summarize(analysis.raters, args.by_dataset, args.threshold)
+    if args.out:
+        with open(args.out, 'w') as f:
+            write_tsv(summary, f)
+    else:
+        write_tsv(summary)
+    if args.outliers:
+        flagged = outliers(analysis.raters, args.threshold)
+        with open(args.outliers, 'w') as f:
+            write_tsv(_rows(_take(flagged, flagged['outlier'])), f, header=list(flagged))
@@ -0,0 +1,177 @@
+"""
+Points for one image stored as columns indexed by position in ``LABELS``.
+
+:py:class:`AnnotationSet` replaces a dict of :py:class:`cspine.CSpinePoint`.
+Coordinates are one ``(n, 3)`` float array (NaN when not placed), so
+centering, mapping to the zoom window and handing rows to the db or an
+export are array operations. Indexing by label gives a :py:class:`PointRef`
+with the same attributes as ``CSpinePoint`` for code that works point by point.
+"""
+import datetime
+import os
+from collections.abc import Mapping
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from cspine.labels import LABELS, LABEL_COLOR
+from cspine.transform import apply
+
+
+class PointRef:
+    "one label's view into an :py:class:`AnnotationSet`. acts like a ``CSpinePoint``"
+    __slots__ = ('_set', '_i')
+
+    def __init__(self, aset: "AnnotationSet", i: int):
+        self._set = aset
+        self._i = i
+
+    def _coord(self, axis):
+        v = self._set.xyz[self._i, axis]
+        return None if np.isnan(v) else float(v)
+
+    def _set_coord(self, axis, v):
+        self._set.xyz[self._i, axis] = np.nan if v is None else v
+
+    label = property(lambda self: self._set.labels[self._i])
+    color = property(lambda self: self._set.colors[self._i])
+    x = property(lambda self: self._coord(0), lambda self, v: self._set_coord(0, v))
+    y = property(lambda self: self._coord(1), lambda self, v: self._set_coord(1, v))
+
+    @property
+    def z(self):
+        "slice index. int like the idx_sag it was placed on"
+        v = self._coord(2)
+        return None if v is None else int(v)
+
+    @z.setter
+    def z(self, v):
+        self._set_coord(2, v)
+
+    def _column(name):
+        return property(lambda self: getattr(self._set, name)[self._i],
+                        lambda self, v: getattr(self._set, name).__setitem__(self._i, v))
+    rot = _column('rot')
+    timestamp = _column('timestamp')
+    rating = _column('rating')
+    note = _column('note')
+    user = _column('user')
+    del _column
+
+    def update(self, x, y, z, rot=0):
+        """update position and change timestamp"""
+        self._set.update_many([self._i], [(x, y, z)], rot=rot)
+
+    def rotate(self, M):
+        """Rotate points
+        @param M affinte transform
+        """
+        return apply(M, (self.x, self.y))
+
+    def todict(self) -> dict:
+        """ convert object to dict for easier seralization """
+        return {'label': self.label,
+                'x': self.x, 'y': self.y, 'sag_i': self.z, 'timestamp': self.timestamp,
+                'rating': self.rating, 'note': self.note,
+                'user': self.user}
+
+    def __repr__(self):
+        return f"<{self.label}: {self.x} {self.y} {self.z}>"
+
+
+class AnnotationSet(Mapping):
+    """
+    all labels for one image. ``aset['C2m']`` is a :py:class:`PointRef`.
+
+    >>> a = AnnotationSet(user='me')
+    >>> a['C2m'].update(10, 20, 5)
+    >>> int(a.placed().sum())
+    1
+    >>> a.mean_xyz().tolist()
+    [10.0, 20.0, 5.0]
+    """
+    def __init__(self, labels: Sequence[str] = LABELS, user: Optional[str] = None):
+        self.labels = list(labels)
+        self.pos = {label: i for i, label in enumerate(self.labels)}
+        self.colors = [LABEL_COLOR.get(label, "#ffffff") for label in self.labels]
+        n = len(self.labels)
+        self.xyz = np.full((n, 3), np.nan)
+        self.rot = np.full(n, None, dtype=object)
+        self.timestamp = np.full(n, None, dtype=object)
+        self.rating = np.full(n, "NA", dtype=object)
+        self.note = np.full(n, "", dtype=object)
+        self.user = np.full(n, user or os.environ.get("USER"), dtype=object)
+
+    # Mapping interface: label -> PointRef
+    def __getitem__(self, label: str) -> PointRef:
+        return PointRef(self, self.pos[label])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def index(self, labels: Iterable) -> np.ndarray:
+        "positions of labels (or pass through positions)"
+        return np.array([self.pos[l] if isinstance(l, str) else l for l in labels], dtype=int)
+
+    def update_many(self, labels: Iterable, xyz, rot=0, timestamp=None, **columns):
+        """
+        set several points at once.
+        :param labels: label names or positions
+        :param xyz: (n,3) coordinates
+        :param timestamp: default now
+        :param columns: rating, note, user: scalar or one per label
+        """
+        idx = self.index(labels)
+        self.xyz[idx] = np.asarray(xyz, dtype=float).reshape(len(idx), 3)
+        self.rot[idx] = rot
+        self.timestamp[idx] = timestamp or datetime.datetime.now()
+        for name, values in columns.items():
+            getattr(self, name)[idx] = values
+
+    def load_rows(self, rows: Iterable):
+        """
+        set points from db rows (mapping with label,x,y,z,created,rating,note,user).
+        labels not in this set are ignored
+        """
+        rows = [r for r in rows if r['label'] in self.pos]
+        if not rows:
+            return
+        idx = self.index(r['label'] for r in rows)
+        self.xyz[idx] = [[np.nan if r[c] is None else r[c] for c in ('x', 'y', 'z')] for r in rows]
+        self.timestamp[idx] = [r['created'] for r in rows]
+        self.rating[idx] = [r['rating'] or "NA" for r in rows]
+        self.note[idx] = [r['note'] or "" for r in rows]
+        self.user[idx] = [r['user'] for r in rows]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable, labels: Sequence[str] = LABELS) -> "AnnotationSet":
+        "new set from db rows, e.g. :py:func:`cspine.db.latest_points` values"
+        aset = cls(labels)
+        aset.load_rows(rows)
+        return aset
+
+    def placed(self) -> np.ndarray:
+        "bool mask of labels with a (nonzero) x and y, like the GUI's check before drawing"
+        xy = np.nan_to_num(self.xyz[:, :2])
+        return (xy != 0).all(axis=1)
+
+    def mean_xyz(self) -> np.ndarray:
+        "mean x,y,z over placed points (NaN if none)"
+        mask = ~np.isnan(self.xyz).any(axis=1)
+        if not mask.any():
+            return np.full(3, np.nan)
+        return self.xyz[mask].mean(axis=0)
+
+    def rows(self, image: str, only_placed: bool = True) -> list[tuple]:
+        "db rows ordered like :py:data:`cspine.db.POINT_COLUMNS`"
+        idx = np.flatnonzero(self.placed()) if only_placed else range(len(self))
+        points = [PointRef(self, i) for i in idx]
+        return [(image, p.user, p.label, p.timestamp, p.x, p.y, p.z, p.rating, p.note)
+                for p in points]
+
+    def todicts(self) -> list[dict]:
+        "every label as :py:meth:`PointRef.todict`, for a tsv"
+        return [self[label].todict() for label in self.labels]
@@ -0,0 +1,259 @@
+"""
+Time the load -> render -> click -> save hot path on synthetic data.
+
+Headless: no Tk window is opened. Images are generated with
+:py:func:`synthetic_nii` and databases with :py:func:`synthetic_db` in a
+temporary directory, so results only depend on the machine and the code::
+
+    python -m cspine bench --out bench.json                 # save results
+    python -m cspine bench --compare bench.json             # exits 1 on a regression
+    python -m cspine bench --rows 10000 100000 1000000 --only db
+    python -m cspine bench --only import                    # startup time of each layer
+
+Each case reports the median, min and max seconds over ``--repeat`` runs.
+"""
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Optional, Sequence
+
+import nibabel as nib
+import numpy as np
+
+from cspine import analytics, db
+from cspine.labels import LABELS
+
+#: (x, y, z) like a sagittal T1w
+DEFAULT_SHAPE = (192, 256, 256)
+DEFAULT_ROWS = (10_000, 100_000)
+#: slower than baseline by more than this ratio is a regression
+DEFAULT_THRESHOLD = 1.25
+#: entry points whose import time is measured. each in a fresh interpreter
+IMPORTS = ('cspine', 'cspine.db', 'cspine.export', 'cspine.image', 'cspine.gui')
+
+
+def synthetic_nii(fname: os.PathLike, shape: Sequence[int] = DEFAULT_SHAPE,
+                  dtype=np.int16, seed: int = 0) -> os.PathLike:
+    """
+    write a smooth ellipsoid 'head' with noise, RAS+ affine.
+    gzipped if fname ends in .gz
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.meshgrid(*[np.linspace(-1, 1, n, dtype=np.float32) for n in shape], indexing='ij')
+    r = np.sqrt(sum(g**2 for g in grid))
+    data = np.clip(1 - r, 0, None) * 1000 + rng.normal(0, 20, shape).astype(np.float32)
+    nib.save(nib.Nifti1Image(data.astype(dtype), np.eye(4)), fname)
+    return fname
+
+
+def synthetic_db(db_fname: os.PathLike, n_rows: int, per_image: int = 40, seed: int = 0) -> int:
+    """
+    fill db_fname with n_rows points over n_rows/per_image images.
+    :return: number of images
+    """
+    rng = np.random.default_rng(seed)
+    n_images = max(n_rows // per_image, 1)
+    start = datetime.datetime(2025, 1, 1)
+    xyz = rng.integers(0, 256, (n_rows, 3))
+    rows = ((f"/data/sub-{i % n_images:06d}/anat/T1w.nii.gz", 'bench', LABELS[i % len(LABELS)],
+             start + datetime.timedelta(seconds=i), int(x), int(y), int(z), 'NA', '')
+            for i, (x, y, z) in enumerate(xyz))
+    conn = db.connect(db_fname)
+    with conn:
+        conn.executemany(db.INSERT_POINT, rows)
+    conn.close()
+    return n_images
+
+
+def measure(func: Callable, repeat: int = 5, setup: Optional[Callable] = None) -> dict:
+    "seconds for each call of func. setup (untimed) runs before each call"
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'median': statistics.median(times), 'min': min(times), 'max': max(times),
+            'runs': repeat}
+
+
+def image_cases(tmpdir: str, shape: Sequence[int], repeat: int) -> dict[str, dict]:
+    "opening and rendering one synthetic image"
+    from cspine.image import StructImg
+    fname = synthetic_nii(os.path.join(tmpdir, "bench_T1w.nii.gz"), shape)
+    res = {}
+    # decode every time, even with CSPINE_CACHE set
+    res['load'] = measure(lambda: StructImg(fname, cache=False), repeat)
+    img = StructImg(fname, cache=False)
+    data = np.asanyarray(img.data)
+    res['percentile'] = measure(lambda: np.percentile(data, (2, 98)), repeat)
+
+    def uncached():
+        img.render_cache.clear()
+        img.slices.clear()
+    res['render_sag'] = measure(img.sag_entry, repeat, uncached)
+    res['render_cor'] = measure(img.cor_entry, repeat, uncached)
+    res['zoom_rot'] = measure(lambda: img.sag_zoom_matrix(rot=7.5), repeat, uncached)
+    full_slice = np.rot90(np.asanyarray(img.data[img.idx_sag]))
+    # pixel work of npimg, without making a tk PhotoImage
+    res['to_uint8'] = measure(lambda: img.to_uint8(full_slice), repeat)
+    return res
+
+
+def _analytics(db_fname: os.PathLike) -> list[dict]:
+    "full (not incremental) analytics run: read every click, reduce, summarize"
+    analysis = analytics.Analysis()
+    analysis.update(db_fname)
+    return analytics.summarize(analysis.raters)
+
+
+def _clients(db_fname: os.PathLike, address: Optional[str], n_clients: int = 8, n_rows: int = 200,
+             wal: bool = True):
+    "n_clients raters saving at once, each with its own writer: directly or through a server"
+    from cspine import server
+    def click(i):
+        writer = server.writer(db_fname, address) if address else db.DBWriter(db_fname, wal=wal)
+        for j in range(n_rows):
+            writer.put((f"/data/img{i}.nii.gz", f'rater{i}', LABELS[j % len(LABELS)],
+                        datetime.datetime.now(), j, j, j, 'NA', ''))
+            if j % 20 == 0:
+                writer.flush()  # like moving on to the next image
+        writer.close()
+    threads = [threading.Thread(target=click, args=(i,)) for i in range(n_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def db_cases(tmpdir: str, rows: Sequence[int], repeat: int) -> dict[str, dict]:
+    "inserting (like save_db) and reading (file list, load from db) at each db size"
+    res = {}
+    n_insert = 1000
+    def insert():
+        writer = db.DBWriter(os.path.join(tmpdir, "insert.db"))
+        for i in range(n_insert):
+            writer.put(("/data/img.nii.gz", 'bench', LABELS[i % len(LABELS)],
+                        datetime.datetime.now(), i, i, i, 'NA', ''))
+        writer.flush()
+        writer.close()
+    res['save_db'] = measure(insert, repeat)
+    res['save_db']['rows_per_s'] = n_insert / res['save_db']['median']
+
+    # many raters on one db: each locking the file, or one server owning it
+    from cspine import server
+    res['save_db_8_clients'] = measure(lambda: _clients(os.path.join(tmpdir, "clients.db"), None), repeat)
+    # no WAL, like a db shared over NFS
+    res['save_db_8_clients_nowal'] = measure(lambda: _clients(os.path.join(tmpdir, "nowal.db"), None,
+                                                              wal=False), repeat)
+    served = os.path.join(tmpdir, "served.db")
+    sock = os.path.join(tmpdir, "cspine.sock")
+    srv = server.AnnotationServer(served).start(sock)
+    res['save_server_8_clients'] = measure(lambda: _clients(served, sock), repeat)
+    srv.stop()
+
+    for n in rows:
+        db_fname = os.path.join(tmpdir, f"bench_{n}.db")
+        n_images = synthetic_db(db_fname, n)
+        image = f"/data/sub-{n_images // 2:06d}/anat/T1w.nii.gz"
+        res[f'fetch_full_db_{n}'] = measure(lambda: db.fetch_full_db(db_fname), repeat)
+        # color_files (whole db, then only new rows)
+        res[f'label_sets_{n}'] = measure(lambda: db.label_sets(db_fname), repeat)
+        res[f'latest_points_{n}'] = measure(lambda: db.latest_points(db_fname, image), repeat)
+        res[f'analytics_{n}'] = measure(lambda: _analytics(db_fname), repeat)
+    return res
+
+
+def import_time(module: str) -> float:
+    "seconds to import module in a new python, not counting interpreter startup"
+    code = ("import time; start = time.perf_counter(); import %s; "
+            "print(time.perf_counter() - start)" % module)
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return float(out.stdout.split()[-1])
+
+
+def import_cases(repeat: int) -> dict[str, dict]:
+    "cold import of each layer. scripts using only the db shouldn't wait for Tk or OpenCV"
+    res = {}
+    for module in IMPORTS:
+        times = [import_time(module) for _ in range(repeat)]
+        res[f'import_{module}'] = {'median': statistics.median(times), 'min': min(times),
+                                   'max': max(times), 'runs': repeat}
+    return res
+
+
+def run(shape: Sequence[int] = DEFAULT_SHAPE, rows: Sequence[int] = DEFAULT_ROWS,
+        repeat: int = 5, only: Sequence[str] = ('image', 'db', 'import')) -> dict:
+    "run cases. :return: {'meta': ..., 'results': {case: timing}}"
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="cspine-bench") as tmpdir:
+        if 'image' in only:
+            results.update(image_cases(tmpdir, shape, repeat))
+        if 'db' in only:
+            results.update(db_cases(tmpdir, rows, repeat))
+    if 'import' in only:
+        results.update(import_cases(repeat))
+    meta = {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.node(), 'shape': list(shape), 'rows': list(rows)}
+    return {'meta': meta, 'results': results}
+
+
+def compare(current: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """
+    median time ratio (current/baseline) for cases in both.
+    :return: [{'case', 'baseline', 'current', 'ratio', 'regressed'}]
+    """
+    report = []
+    for case, res in current['results'].items():
+        if case not in baseline['results']:
+            continue
+        before = baseline['results'][case]['median']
+        ratio = res['median'] / before if before else float('inf')
+        report.append({'case': case, 'baseline': before, 'current': res['median'],
+                       'ratio': ratio, 'regressed': ratio > threshold})
+    return report
+
+
+def main(argv=None):
+    "run the benchmarks, optionally save and compare to a baseline"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine bench', description='time the load/render/save hot path')
+    parser.add_argument('--out', help='write results json here')
+    parser.add_argument('--compare', help='baseline results json. exit 1 if any case regressed')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='slowdown ratio counted as a regression (default: %(default)s)')
+    parser.add_argument('--shape', type=int, nargs=3, default=DEFAULT_SHAPE, help='synthetic image size')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='synthetic db sizes')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', choices=['image', 'db', 'import'],
+                        default=['image', 'db', 'import'])
+    args = parser.parse_args(argv)
+
+    current = run(args.shape, args.rows, args.repeat, args.only)
+    print("\t".join(["case", "median_ms", "min_ms"]))
+    for case, res in current['results'].items():
+        print("\t".join([case, "%.2f" % (1000*res['median']), "%.2f" % (1000*res['min'])]))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report = compare(current, baseline, args.threshold)
+        print("\n" + "\t".join(["case", "baseline_ms", "current_ms", "ratio"]))
+        for r in report:
+            print("\t".join([r['case'], "%.2f" % (1000*r['baseline']), "%.2f" % (1000*r['current']),
+                             "%.2f%s" % (r['ratio'], " REGRESSED" if r['regressed'] else "")]))
+        if any(r['regressed'] for r in report):
+            sys.exit(1)
@@ -0,0 +1,482 @@
+"""
+SQLite storage of point placements (``cspine.db``, see ``schema.txt``).
+"""
+import atexit
+import errno
+import logging
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from cspine import profiling
+
+#: database of the GUI and every subcommand: ``cspine.db`` in the repo root, next to ``main.py``
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cspine.db')
+
+#: same as schema.txt, safe to run on an existing database
+SCHEMA = """
+create table if not exists point (
+ image text,
+ user text,
+ label text,
+ created timestamp,
+ x int,
+ y int,
+ z int,
+ rating int,
+ note text
+);
+-- per image lookups (file list coloring, loading an image's points)
+create index if not exists point_image_label_created on point(image, label, created);
+
+-- newest point per image, user, and label. maintained by trigger
+-- rows with no user are stored with user ''
+create table if not exists latest_point (
+ image text,
+ user text,
+ label text,
+ created timestamp,
+ x int,
+ y int,
+ z int,
+ rating int,
+ note text,
+ point_rowid int,
+ primary key (image, user, label)
+);
+create trigger if not exists point_latest after insert on point
+begin
+ insert into latest_point(image,user,label,created,x,y,z,rating,note,point_rowid)
+  values (new.image, ifnull(new.user,''), new.label, new.created,
+          new.x, new.y, new.z, new.rating, new.note, new.rowid)
+ on conflict(image,user,label) do update set
+   created=excluded.created, x=excluded.x, y=excluded.y, z=excluded.z,
+   rating=excluded.rating, note=excluded.note, point_rowid=excluded.point_rowid
+  where excluded.created > latest_point.created
+     or (excluded.created = latest_point.created and excluded.point_rowid > latest_point.point_rowid);
+end;
+
+-- precomputed guesses (see cspine/suggest.py), not clicks. one per image and label
+create table if not exists suggestion (
+ image text,
+ label text,
+ created timestamp,
+ x real,
+ y real,
+ z int,
+ score real,
+ source text,
+ primary key (image, label)
+);
+
+-- where an image opens (see cspine/position.py). zoom_fac null: image's default
+create table if not exists position (
+ image text primary key,
+ created timestamp,
+ sag int,
+ cor int,
+ zoom_fac int,
+ score real
+);
+"""
+
+#: fill latest_point from points inserted before the trigger existed
+BACKFILL_LATEST = """
+insert into latest_point(image,user,label,created,x,y,z,rating,note,point_rowid)
+ select image, ifnull(user,''), label, created, x, y, z, rating, note, rowid
+ from point where true
+on conflict(image,user,label) do update set
+   created=excluded.created, x=excluded.x, y=excluded.y, z=excluded.z,
+   rating=excluded.rating, note=excluded.note, point_rowid=excluded.point_rowid
+  where excluded.created > latest_point.created
+     or (excluded.created = latest_point.created and excluded.point_rowid > latest_point.point_rowid);
+"""
+#: bumped when an existing db needs a migration in :py:func:`connect`
+SCHEMA_VERSION = 1
+
+#: column order for rows given to :py:meth:`DBWriter.put`
+POINT_COLUMNS = ('image', 'user', 'label', 'created', 'x', 'y', 'z', 'rating', 'note')
+INSERT_POINT = f"""INSERT INTO point({','.join(POINT_COLUMNS)})
+                   VALUES({','.join('?' * len(POINT_COLUMNS))})"""
+#: column order for rows given to :py:func:`save_suggestions`
+SUGGESTION_COLUMNS = ('image', 'label', 'created', 'x', 'y', 'z', 'score', 'source')
+#: column order for rows given to :py:func:`save_positions`
+POSITION_COLUMNS = ('image', 'created', 'sag', 'cor', 'zoom_fac', 'score')
+
+
+def connect(db_fname: os.PathLike, wal: bool = False, timeout: float = 30) -> sqlite3.Connection:
+    """
+    open db_fname and make sure tables exist.
+    :param wal: use write-ahead logging. readers don't block the writer, commits are cheaper.
+                WAL needs shared memory between processes: does not work if the db is
+                used from multiple machines over NFS
+    :param timeout: seconds to wait on a lock held by another rater
+    """
+    conn = sqlite3.connect(db_fname, timeout=timeout)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+        # fsync on checkpoint, not every commit. a power loss can drop
+        # the last commits, but the db stays consistent
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        logging.info("filling latest_point table of %s", db_fname)
+        with conn:
+            conn.execute(BACKFILL_LATEST)
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    return conn
+
+
+def connect_ro(db_fname: os.PathLike, timeout: float = 30) -> sqlite3.Connection:
+    """
+    open db_fname read-only for lookups. doesn't create it, or create or migrate tables:
+    :py:func:`connect` (the GUI's :py:class:`DBWriter`, or a CLI) does that once
+    before the first read.
+    """
+    if not os.path.exists(db_fname):
+        # sqlite's "unable to open database file" doesn't say which
+        raise FileNotFoundError(errno.ENOENT, "no database", str(db_fname))
+    uri = pathlib.Path(os.path.abspath(db_fname)).as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, timeout=timeout)
+
+
+def fetch_full_db(db_fname: os.PathLike) -> list[dict[str,str]]:
+    """
+    >>> res = fetch_full_db("./cspine.db")
+    >>> len(res) > 100
+    True
+    >>> res[0]['x'] > 0
+    True
+    >>> os.path.isfile(res[0]['image'])
+    True
+    """
+    all_points_sql="""select * from point"""
+    with sqlite3.connect(db_fname) as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute(all_points_sql)
+        res = cur.fetchall()
+    return res
+
+
+def annotated_images(db_fname: os.PathLike, since_rowid: int = 0) -> tuple[set[str], int]:
+    """
+    images with any point, only looking at rows inserted after since_rowid.
+    :return: (images, last rowid seen). pass the rowid back in to get only newer images
+    """
+    with connect_ro(db_fname) as conn:
+        res = conn.execute("""SELECT image, max(rowid) FROM point
+                              WHERE rowid > ? GROUP BY image""", (since_rowid,)).fetchall()
+    conn.close()
+    images = {image for image, _ in res}
+    last = max((rowid for _, rowid in res), default=since_rowid)
+    return images, last
+
+
+def label_sets(db_fname: os.PathLike, since_rowid: int = 0) -> tuple[dict[str, set[str]], int]:
+    """
+    labels with a point for each image, only looking at rows inserted after since_rowid.
+    :return: ({image: labels}, last rowid seen). pass the rowid back in to get only newer rows
+    """
+    with connect_ro(db_fname) as conn:
+        res = conn.execute("""SELECT image, label, max(rowid) FROM point
+                              WHERE rowid > ? GROUP BY image, label""", (since_rowid,)).fetchall()
+    conn.close()
+    labels: dict[str, set[str]] = {}
+    for image, label, _ in res:
+        labels.setdefault(image, set()).add(label)
+    last = max((rowid for *_, rowid in res), default=since_rowid)
+    return labels, last
+
+
+def latest_points(db_fname: os.PathLike, image: str, user: Optional[str] = None) -> dict[str, sqlite3.Row]:
+    """
+    current annotation of an image: newest point for each label.
+    :param image: absolute path, as stored in the db
+    :param user: only this rater's points. default newest from any rater
+    :return: {label: row} with point columns (user is '' if unknown)
+    """
+    sql = "SELECT * FROM latest_point WHERE image = ?"
+    args: tuple = (image,)
+    if user is not None:
+        sql += " AND user = ?"
+        args += (user,)
+    # ties go to the most recently inserted
+    sql += " ORDER BY created DESC, point_rowid DESC"
+    with connect_ro(db_fname) as conn:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(sql, args).fetchall()
+    conn.close()
+    latest = {}
+    for row in rows:
+        latest.setdefault(row['label'], row)
+    return latest
+
+
+def suggestions(db_fname: os.PathLike, image: str) -> dict[str, sqlite3.Row]:
+    "precomputed points for image (:py:mod:`cspine.suggest`). :return: {label: row}"
+    with connect_ro(db_fname) as conn:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM suggestion WHERE image = ?", (image,)).fetchall()
+    conn.close()
+    return {row['label']: row for row in rows}
+
+
+def suggested_images(db_fname: os.PathLike) -> set[str]:
+    "images with any suggestion"
+    with connect_ro(db_fname) as conn:
+        images = {image for image, in conn.execute("SELECT DISTINCT image FROM suggestion")}
+    conn.close()
+    return images
+
+
+def save_suggestions(db_fname: os.PathLike, rows: list[tuple], wal: bool = True) -> int:
+    """
+    store rows ordered like :py:data:`SUGGESTION_COLUMNS`, replacing an image's older suggestion for a label.
+    :return: rows written
+    """
+    sql = f"""INSERT OR REPLACE INTO suggestion({','.join(SUGGESTION_COLUMNS)})
+              VALUES({','.join('?' * len(SUGGESTION_COLUMNS))})"""
+    conn = connect(db_fname, wal=wal)
+    with conn:
+        conn.executemany(sql, rows)
+    conn.close()
+    return len(rows)
+
+
+def position(db_fname: os.PathLike, image: str) -> Optional[sqlite3.Row]:
+    "precomputed slice and zoom for image (:py:mod:`cspine.position`). None if not estimated"
+    with connect_ro(db_fname) as conn:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM position WHERE image = ?", (image,)).fetchone()
+    conn.close()
+    return row
+
+
+def positioned_images(db_fname: os.PathLike) -> set[str]:
+    "images with a position"
+    with connect_ro(db_fname) as conn:
+        images = {image for image, in conn.execute("SELECT image FROM position")}
+    conn.close()
+    return images
+
+
+def save_positions(db_fname: os.PathLike, rows: list[tuple], wal: bool = True) -> int:
+    """
+    store rows ordered like :py:data:`POSITION_COLUMNS`, replacing older ones for the image.
+    :return: rows written
+    """
+    sql = f"""INSERT OR REPLACE INTO position({','.join(POSITION_COLUMNS)})
+              VALUES({','.join('?' * len(POSITION_COLUMNS))})"""
+    conn = connect(db_fname, wal=wal)
+    with conn:
+        conn.executemany(sql, rows)
+    conn.close()
+    return len(rows)
+
+
+class DBWriter:
+    """
+    insert points on a background thread with one long lived connection.
+
+    Rows are committed in groups: once ``batch_size`` rows are waiting or
+    ``flush_interval`` seconds after the first uncommitted row.
+    :py:meth:`flush` blocks until everything queued so far is committed.
+
+    Crash safety: a committed row is durable. Rows still queued (at most
+    ``flush_interval`` seconds of clicks) are lost if the process is killed.
+    A commit that failed on a lock (another rater's long write) is retried up
+    to ``max_retries`` times; after that, or on any other error, the rows are
+    dropped and the error kept in :py:attr:`error`. If the db can't be opened at all, :py:meth:`put` and :py:meth:`flush`
+    raise that error (see :py:attr:`open_error`).
+    :py:meth:`close` is also registered with :py:mod:`atexit`.
+    """
+    def __init__(self, db_fname: os.PathLike, flush_interval: float = .3,
+                 batch_size: int = 50, wal: bool = True, max_retries: int = 5):
+        self.db_fname = db_fname
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.wal = wal
+        self.max_retries = max_retries
+        self.dropped = 0  #: rows given up on. see :py:attr:`error`
+        self.queue: queue.Queue = queue.Queue()
+        #: commit latency (seconds) of each group commit. see :py:meth:`stats`
+        self.commit_times: list[float] = []
+        self.rows_written = 0
+        self.error: Optional[Exception] = None  #: last commit error, None once a commit succeeds
+        #: why the writer thread couldn't open the db (and stopped). None if it's running
+        self.open_error: Optional[Exception] = None
+        self.opened = threading.Event()  #: set once the thread tried to open the db
+        self.thread = threading.Thread(target=self._run, name="cspine-dbwriter", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        # open errors are known before the first put
+        self.opened.wait()
+
+    def _check(self):
+        "raise the error the writer thread stopped on"
+        if self.open_error is not None:
+            raise self.open_error
+
+    def put(self, row: tuple):
+        "queue a row (ordered like :py:data:`POINT_COLUMNS`). returns immediately"
+        self._check()
+        self.queue.put(row)
+
+    def put_many(self, rows: list[tuple]):
+        "queue several rows as one item, e.g. :py:meth:`cspine.annotations.AnnotationSet.rows`"
+        self._check()
+        if rows:
+            self.queue.put(list(rows))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        wait until all rows queued before this call are committed.
+        :return: False if timed out, the writer is stopped, or the last commit failed (see :py:attr:`error`)
+        """
+        self._check()
+        if not self.thread.is_alive():
+            return False
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout) and self.error is None
+
+    def close(self, timeout: Optional[float] = None):
+        "commit what's queued and stop the thread. safe to call more than once"
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+        atexit.unregister(self.close)
+
+    # reads. don't wait for queued rows: flush() first to include them
+    def latest_points(self, image: str, user: Optional[str] = None) -> dict:
+        "see :py:func:`latest_points`"
+        return latest_points(self.db_fname, image, user)
+
+    def label_sets(self, since_rowid: int = 0) -> tuple[dict[str, set[str]], int]:
+        "see :py:func:`label_sets`"
+        return label_sets(self.db_fname, since_rowid)
+
+    def annotated_images(self, since_rowid: int = 0) -> tuple[set[str], int]:
+        "see :py:func:`annotated_images`"
+        return annotated_images(self.db_fname, since_rowid)
+
+    def suggestions(self, image: str) -> dict:
+        "see :py:func:`suggestions`"
+        return suggestions(self.db_fname, image)
+
+    def position(self, image: str) -> Optional[sqlite3.Row]:
+        "see :py:func:`position`"
+        return position(self.db_fname, image)
+
+    def stats(self) -> dict:
+        "queue depth and commit latency (ms) for status display"
+        times = self.commit_times[-100:] or [0]
+        return {'queue_depth': self.queue.qsize(),
+                'rows': self.rows_written,
+                'commits': len(self.commit_times),
+                'last_commit_ms': 1000 * times[-1],
+                'mean_commit_ms': 1000 * sum(times) / len(times),
+                'max_commit_ms': 1000 * max(times)}
+
+    @staticmethod
+    def retryable(err: Exception) -> bool:
+        "worth committing again: another connection held the lock past the timeout"
+        return isinstance(err, sqlite3.OperationalError) and 'locked' in str(err)
+
+    def _commit(self, conn: sqlite3.Connection, rows: list[tuple]) -> bool:
+        "write rows. on failure, set :py:attr:`error` and return False"
+        start = time.perf_counter()
+        try:
+            with conn:  # commits, or rolls back on error
+                conn.executemany(INSERT_POINT, rows)
+        except sqlite3.Error as err:
+            logging.error("failed to save %d points to %s: %s", len(rows), self.db_fname, err)
+            self.error = err
+            return False
+        self.error = None
+        self.commit_times.append(time.perf_counter() - start)
+        if profiling.PROFILER.enabled:
+            profiling.PROFILER.record('db_commit', self.commit_times[-1])
+        self.rows_written += len(rows)
+        logging.debug("committed %d points in %.1fms", len(rows), 1000*self.commit_times[-1])
+        return True
+
+    def _open(self):
+        "connection used by _commit. called on the writer thread"
+        return connect(self.db_fname, wal=self.wal)
+
+    def _close(self, conn):
+        "called on the writer thread when stopping"
+        conn.close()
+
+    def _run(self):
+        try:
+            conn = self._open()
+        except Exception as err:
+            logging.error("can't open %s, points will not be saved: %s", self.db_fname, err)
+            self.open_error = err
+            return
+        finally:
+            self.opened.set()
+        pending: list[tuple] = []
+        waiting: list[threading.Event] = []  # flush() callers
+        deadline = None
+        retries = 0
+        stop = False
+        while not stop:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False  # deadline hit
+            if item is None:
+                stop = True
+            elif isinstance(item, threading.Event):
+                waiting.append(item)
+            elif item is not False:
+                if isinstance(item, list):  # put_many
+                    pending.extend(item)
+                else:
+                    pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            commit_now = stop or waiting or item is False or len(pending) >= self.batch_size
+            if not commit_now:
+                continue
+            if pending and not self._commit(conn, pending):
+                if not stop and retries < self.max_retries and self.retryable(self.error):
+                    # keep rows, back off, try again
+                    retries += 1
+                    time.sleep(min(self.flush_interval, 1))
+                    deadline = time.monotonic()
+                    continue
+                logging.error("dropping %d points not saved to %s: %s", len(pending), self.db_fname, self.error)
+                self.dropped += len(pending)
+            pending = []
+            retries = 0
+            deadline = None
+            for done in waiting:
+                done.set()
+            waiting = []
+        self._close(conn)
+
+
+def writer_from_env(db_fname: os.PathLike) -> DBWriter:
+    """
+    :py:class:`DBWriter` for db_fname.
+    ``CSPINE_DB_WAL=0`` turns off WAL (needed if the db is shared across machines over NFS)
+    ``CSPINE_SERVER`` sends points to a :py:mod:`cspine.server` instead, if it's running
+    """
+    wal = os.environ.get("CSPINE_DB_WAL", "1") != "0"
+    address = os.environ.get("CSPINE_SERVER", "0")
+    if address not in ("", "0"):
+        from cspine import server
+        return server.writer(db_fname, address, wal=wal)
+    return DBWriter(db_fname, wal=wal)
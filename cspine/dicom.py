@@ -0,0 +1,135 @@
+"""
+Read a DICOM series directory as a RAS+ volume, like a nifti.
+
+Needs the optional ``pydicom`` package (``pip install pydicom``; compressed
+transfer syntaxes also need a pixel data handler like ``pylibjpeg``).
+Every file is read and decoded on a thread pool, slices are sorted along
+the slice normal, and the LPS patient coordinates DICOM uses are turned
+into a RAS affine. The result is reoriented to RAS+ in memory.
+
+Decoding a series is slower than reading a nifti, so :py:class:`cspine.StructImg`
+keeps the assembled array in a volume cache (``CSPINE_CACHE``, or
+:py:func:`cspine.volcache.series_cache` when unset): later opens are a memory map.
+"""
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import nibabel as nib
+import numpy as np
+
+try:
+    import pydicom
+    from pydicom.errors import InvalidDicomError
+    HAVE_PYDICOM = True
+except ImportError:
+    HAVE_PYDICOM = False
+
+#: files in a series directory that are never slices
+SKIP_FILES = ('DICOMDIR',)
+
+
+class Slice(NamedTuple):
+    "one decoded file of a series"
+    series: str
+    position: np.ndarray     #: ImagePositionPatient (LPS, mm)
+    orientation: np.ndarray  #: ImageOrientationPatient: row then column direction cosines
+    spacing: tuple           #: PixelSpacing: (between rows, between columns)
+    instance: int
+    pixels: np.ndarray       #: (rows, columns)
+
+
+def is_series(path: os.PathLike) -> bool:
+    "inputs that are directories are read as DICOM series"
+    return os.path.isdir(path)
+
+
+def series_files(dirname: os.PathLike) -> list[str]:
+    "candidate slice files in dirname: not hidden, not DICOMDIR, not subdirectories"
+    return sorted(e.path for e in os.scandir(dirname)
+                  if e.is_file() and not e.name.startswith('.') and e.name not in SKIP_FILES)
+
+
+def read_slice(fname: str) -> Optional[Slice]:
+    "header and pixels of one file. None if it is not an image slice"
+    try:
+        ds = pydicom.dcmread(fname)
+    except (InvalidDicomError, OSError) as err:
+        logging.debug("skipping %s: %s", fname, err)
+        return None
+    if 'PixelData' not in ds or 'ImagePositionPatient' not in ds:
+        return None
+    if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1:
+        raise ValueError(f"{fname} is multi-frame (enhanced) DICOM, not supported")
+    pixels = ds.pixel_array
+    slope = float(getattr(ds, 'RescaleSlope', 1) or 1)
+    inter = float(getattr(ds, 'RescaleIntercept', 0) or 0)
+    if slope != 1 or inter != 0:
+        pixels = pixels.astype(np.float32) * slope + inter
+    return Slice(str(getattr(ds, 'SeriesInstanceUID', '')),
+                 np.array(ds.ImagePositionPatient, dtype=float),
+                 np.array(ds.ImageOrientationPatient, dtype=float),
+                 tuple(float(s) for s in ds.PixelSpacing),
+                 int(getattr(ds, 'InstanceNumber', 0) or 0),
+                 pixels)
+
+
+def series_affine(slices: list[Slice]) -> np.ndarray:
+    """
+    voxel (column, row, slice) to RAS mm for slices sorted along the normal.
+    DICOM positions are LPS: x and y are negated.
+    """
+    first = slices[0]
+    row_dir, col_dir = first.orientation[:3], first.orientation[3:]
+    if len(slices) > 1:
+        step = (slices[-1].position - first.position) / (len(slices) - 1)
+    else:
+        step = np.cross(row_dir, col_dir)
+    lps = np.eye(4)
+    # along a row (increasing column index) is row_dir, spaced by the column spacing
+    lps[:3, 0] = row_dir * first.spacing[1]
+    lps[:3, 1] = col_dir * first.spacing[0]
+    lps[:3, 2] = step
+    lps[:3, 3] = first.position
+    return np.diag([-1, -1, 1, 1]) @ lps
+
+
+def read_series(dirname: os.PathLike, workers: int = 8) -> tuple[np.ndarray, np.ndarray]:
+    """
+    decode every slice of the largest series in dirname on a thread pool.
+    :return: (volume indexed column, row, slice; affine to RAS)
+    """
+    if not HAVE_PYDICOM:
+        raise ImportError(f"{dirname} is a directory: reading DICOM needs pydicom (pip install pydicom)")
+    files = series_files(dirname)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cspine-dicom") as pool:
+        slices = [s for s in pool.map(read_slice, files) if s is not None]
+    if not slices:
+        raise ValueError(f"no DICOM image slices in {dirname}")
+
+    by_series = defaultdict(list)
+    for s in slices:
+        by_series[s.series].append(s)
+    if len(by_series) > 1:
+        logging.warning("%s has %d series, using the largest", dirname, len(by_series))
+    slices = max(by_series.values(), key=len)
+
+    normal = np.cross(slices[0].orientation[:3], slices[0].orientation[3:])
+    slices.sort(key=lambda s: (float(s.position @ normal), s.instance))
+    shapes = {s.pixels.shape for s in slices}
+    if len(shapes) > 1:
+        raise ValueError(f"slices in {dirname} have different sizes: {shapes}")
+    # (slice, row, column) -> (column, row, slice) to match the affine
+    volume = np.stack([s.pixels for s in slices]).transpose(2, 1, 0)
+    return volume, series_affine(slices)
+
+
+def open_series(dirname: os.PathLike, workers: int = 8) -> np.ndarray:
+    "RAS+ array of a series directory, like :py:func:`cspine.sliceio.open_volume` gives for a nifti"
+    volume, affine = read_series(dirname, workers)
+    ornt = nib.orientations.io_orientation(affine)
+    logging.debug("%s orientation %s, %d slices", dirname, nib.orientations.aff2axcodes(affine),
+                  volume.shape[2])
+    return np.ascontiguousarray(nib.orientations.apply_orientation(volume, ornt))
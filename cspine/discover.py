@@ -0,0 +1,169 @@
+"""
+Find input images from glob patterns and list files.
+
+Globbing ``/Volumes/Hera/.../sub-*/ses-*/anat/*_T1w.nii.gz`` lists thousands
+of directories over the network. :py:func:`discover` lists each level of the
+pattern on a thread pool and remembers directory listings in a manifest
+keyed by the directory's mtime. Adding or removing an entry changes the
+directory's mtime, so on the next launch only changed directories are listed again.
+
+Quote patterns so the shell doesn't expand them (and hit ARG_MAX)::
+
+    python -m cspine '/Volumes/Hera/Projects/Habit/mr/BIDS/sub-*/ses-*/anat/sub-*_ses-*_T1w.nii.gz'
+    python -m cspine --list habit/habit_filelist.txt
+"""
+import fnmatch
+import glob
+import json
+import logging
+import os
+import os.path
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+#: where listings are remembered between launches
+DEFAULT_MANIFEST = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                                "cspine", "discover-manifest.json")
+
+
+class Manifest:
+    "directory listings keyed by path, valid while the directory mtime is unchanged"
+    def __init__(self, fname: Optional[os.PathLike] = None):
+        self.fname = fname
+        self.dirs: dict[str, dict] = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        if fname and os.path.exists(fname):
+            try:
+                with open(fname) as f:
+                    self.dirs = json.load(f)
+            except (OSError, ValueError) as err:
+                logging.warning("ignoring unreadable manifest %s: %s", fname, err)
+
+    def listdir(self, path: str) -> list[tuple[str, bool]]:
+        "(name, is_dir) for entries in path. [] if path is missing"
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        with self.lock:
+            cached = self.dirs.get(path)
+        if cached and cached['mtime'] == mtime:
+            return [tuple(e) for e in cached['entries']]
+        try:
+            entries = sorted((e.name, e.is_dir()) for e in os.scandir(path))
+        except OSError:
+            return []
+        with self.lock:
+            self.dirs[path] = {'mtime': mtime, 'entries': entries}
+            self.changed = True
+        return entries
+
+    def save(self):
+        "write manifest if anything was relisted"
+        if not self.fname or not self.changed:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.fname)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.fname)))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.dirs, f)
+        os.replace(tmp, self.fname)
+        self.changed = False
+
+
+def _split_pattern(pattern: str) -> tuple[str, list[str]]:
+    """
+    literal leading directory and the remaining components.
+
+    >>> _split_pattern('/a/b/sub-*/anat/*.nii.gz')
+    ('/a/b', ['sub-*', 'anat', '*.nii.gz'])
+    """
+    parts = os.path.abspath(pattern).split(os.sep)
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            return os.sep.join(parts[:i]) or os.sep, parts[i:]
+    return os.sep.join(parts[:-1]) or os.sep, parts[-1:]
+
+
+def discover(pattern: str, manifest: Optional[Manifest] = None, workers: int = 16) -> Iterator[str]:
+    """
+    files matching a glob pattern, in sorted order, yielded as each directory level is listed.
+    ``**`` is not supported; each component matches one directory level.
+    a pattern ending in ``/`` matches directories (DICOM series) instead of files.
+    :param manifest: cached listings. updated in place, not saved
+    """
+    manifest = manifest or Manifest()
+    want_dirs = pattern.endswith(os.sep)
+    root, parts = _split_pattern(pattern)
+    dirs = [root]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cspine-discover") as pool:
+        for depth, part in enumerate(parts):
+            last = depth == len(parts) - 1
+            next_dirs = []
+            # map keeps dirs in order while listing them in parallel
+            for path, entries in zip(dirs, pool.map(manifest.listdir, dirs)):
+                for name, is_dir in entries:
+                    if not fnmatch.fnmatchcase(name, part):
+                        continue
+                    if last and is_dir == want_dirs:
+                        yield os.path.join(path, name)
+                    elif not last and is_dir:
+                        next_dirs.append(os.path.join(path, name))
+            dirs = next_dirs
+
+
+def read_list(fname: os.PathLike) -> list[str]:
+    "file names from a text file, one per line. blank lines and # comments skipped"
+    with open(fname) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def expand_inputs(inputs: Iterable[str], list_files: Iterable[str] = (),
+                  manifest: Optional[Manifest] = None) -> Iterator[str]:
+    """
+    input images from command line arguments: files as is, patterns through :py:func:`discover`,
+    and every line of list_files.
+    """
+    for fname in list_files:
+        yield from read_list(fname)
+    for arg in inputs:
+        if glob.has_magic(arg) and not os.path.exists(arg):
+            yield from discover(arg, manifest)
+        else:
+            yield arg
+
+
+def stream(inputs: Iterable[str], list_files: Iterable[str] = (),
+           manifest_fname: Optional[os.PathLike] = DEFAULT_MANIFEST) -> queue.Queue:
+    """
+    run :py:func:`expand_inputs` on a background thread.
+    :return: queue of file names, ending with None
+    """
+    found: queue.Queue = queue.Queue()
+    def run():
+        manifest = Manifest(manifest_fname)
+        try:
+            for fname in expand_inputs(inputs, list_files, manifest):
+                found.put(fname)
+        finally:
+            found.put(None)
+            manifest.save()
+    threading.Thread(target=run, name="cspine-discover", daemon=True).start()
+    return found
+
+
+def main(argv=None):
+    "print matching files. e.g. to save a list for --list"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine discover', description='list files matching glob patterns')
+    parser.add_argument('patterns', nargs='+', help='quoted glob patterns')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST,
+                        help='directory listing cache (default: %(default)s)')
+    args = parser.parse_args(argv)
+    manifest = Manifest(args.manifest)
+    for fname in expand_inputs(args.patterns, manifest=manifest):
+        print(fname)
+    manifest.save()
@@ -0,0 +1,258 @@
+"""
+Write annotations from ``cspine.db`` without the GUI.
+
+``python -m cspine export --out dir`` writes every image's current points
+(newest per label, see :py:func:`cspine.db.latest_points`) in the same
+tab separated format as the GUI's save button. ``--format long`` writes
+one table for all images instead, ``--format parquet`` the same as parquet (needs pandas).
+
+Rows are read from ``latest_point`` in chunks and per image files are written on a thread pool.
+Images whose file is newer than their newest point are skipped unless ``--force``.
+Like the save button, tsv files list every label: unplaced ones with empty (``None``, ``NA``) values.
+Files are named after the image (:py:func:`output_names`); images with the same file name in
+different directories (``*/anat/T1w.nii.gz``) also get their directories in the name.
+"""
+import collections
+import datetime
+import logging
+import os
+import os.path
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+from cspine import db
+from cspine.annotations import AnnotationSet
+from cspine.labels import LABELS
+
+#: columns of a saved tsv (CSpinePoint.todict)
+TSV_COLUMNS = ('label', 'x', 'y', 'sag_i', 'timestamp', 'rating', 'note', 'user')
+
+
+def write_points_tsv(fname: os.PathLike, rows: list[dict], image: str,
+                     sag, cor, crop, zoom, user: Optional[str] = None):
+    """
+    tab delimited file of rows with a provenance comment first.
+    :param rows: dicts with keys in the same order (:py:data:`TSV_COLUMNS`)
+    :param image: input image, for provenance
+    :param sag,cor,crop,zoom: view settings, for provenance
+    """
+    with open(fname, 'w') as f:
+        # provenance
+        f.write("# ")
+        f.write(f"timestamp={datetime.datetime.now()}; ")
+        f.write(f"input={image}; ")
+        f.write(f"user={user or os.environ.get('USER')}; ")
+        f.write(f"sag={sag}; cor={cor};")
+        f.write(f"crop={crop}; zoom={zoom};\n")
+        # data -- could use pandas but seems like over kill
+        # keys and values should always be in the same order
+        f.write("\t".join(rows[0].keys()) + "\n")
+        for row in rows:
+            f.write("\t".join(["%s"%x for x in row.values()]) + "\n")
+
+
+def output_name(image: str, out_dir: os.PathLike, parents: int = 0) -> str:
+    """
+    export file for image. ncanda images are all t1.nii.gz, so prefix with the subject id
+    :param parents: also prefix this many of the image's directories (see :py:func:`output_names`)
+
+    >>> output_name('/d/NCANDA_S00033/t1.nii.gz', 'out')
+    'out/NCANDA_S00033_t1_cspine-latest.tsv'
+    >>> output_name('/d/sub-1/anat/T1w.nii.gz', 'out', parents=2)
+    'out/sub-1_anat_T1w_cspine-latest.tsv'
+    """
+    base = re.sub(r'\.nii(\.gz)?$', '', os.path.basename(image))
+    dirs = os.path.dirname(image).strip(os.sep).split(os.sep)
+    if parents:
+        base = "_".join(dirs[-parents:] + [base])
+    if (m := re.search('NCANDA_S[0-9]+', image)) and m.group() not in base:
+        base = m.group() + "_" + base
+    return os.path.join(out_dir, base + "_cspine-latest.tsv")
+
+
+def output_names(images: Iterable[str], out_dir: os.PathLike) -> dict[str, str]:
+    """
+    :py:func:`output_name` of each image, with parent directories added where names collide
+    (e.g. ``*/anat/T1w.nii.gz``) until every image has its own file.
+
+    >>> names = output_names(['/d/sub-1/anat/T1w.nii.gz', '/d/sub-2/anat/T1w.nii.gz', '/d/x.nii'], 'out')
+    >>> [os.path.basename(name) for name in names.values()]
+    ['sub-1_anat_T1w_cspine-latest.tsv', 'sub-2_anat_T1w_cspine-latest.tsv', 'x_cspine-latest.tsv']
+    """
+    parents = dict.fromkeys(images, 0)
+    while True:
+        names = {image: output_name(image, out_dir, n) for image, n in parents.items()}
+        counts = collections.Counter(names.values())
+        clashes = [image for image, name in names.items() if counts[name] > 1]
+        if not clashes:
+            return names
+        longer = [image for image in clashes
+                  if parents[image] < len(os.path.dirname(image).strip(os.sep).split(os.sep))]
+        if not longer:
+            raise ValueError(f"can't give {', '.join(clashes)} separate export files")
+        for image in longer:
+            parents[image] += 1
+
+
+def _label_order(label: str) -> int:
+    return LABELS.index(label) if label in LABELS else len(LABELS)
+
+
+def iter_latest(db_fname: os.PathLike, chunk_size: int = 10000) -> Iterator[tuple[str, list[dict]]]:
+    """
+    (image, rows) for every image in the db, rows are the newest point per label
+    like the GUI's "Load from DB". Read chunk_size db rows at a time.
+    """
+    conn = db.connect_ro(db_fname)
+    conn.row_factory = sqlite3.Row
+    cur = conn.execute("""SELECT image, user, label, created, x, y, z, rating, note
+                          FROM latest_point
+                          ORDER BY image, label, created DESC, point_rowid DESC""")
+    image, latest = None, {}
+    while chunk := cur.fetchmany(chunk_size):
+        for row in chunk:
+            if row['image'] != image:
+                if latest:
+                    yield image, _as_tsv_rows(latest)
+                image, latest = row['image'], {}
+            # first seen for a label is newest (across raters)
+            latest.setdefault(row['label'], row)
+    if latest:
+        yield image, _as_tsv_rows(latest)
+    conn.close()
+
+
+def _as_tsv_rows(latest: dict[str, sqlite3.Row]) -> list[dict]:
+    "db rows to dicts with the GUI save's columns, ordered like LABELS"
+    rows = []
+    for label in sorted(latest, key=_label_order):
+        row = latest[label]
+        rows.append({'label': label, 'x': row['x'], 'y': row['y'], 'sag_i': row['z'],
+                     'timestamp': row['created'], 'rating': row['rating'] or "NA",
+                     'note': row['note'] or "", 'user': row['user']})
+    return rows
+
+
+def with_unplaced(rows: list[dict]) -> list[dict]:
+    "rows plus the GUI save's empty row (:py:meth:`AnnotationSet.todicts`) for labels without one"
+    placed = {row['label'] for row in rows}
+    blank = AnnotationSet(user="cspine-export")
+    missing = [blank[label].todict() for label in LABELS if label not in placed]
+    return sorted(rows + missing, key=lambda row: _label_order(row['label']))
+
+
+def _newest(rows: list[dict]) -> datetime.datetime:
+    return max(datetime.datetime.fromisoformat(str(r['timestamp'])) for r in rows)
+
+
+def up_to_date(fname: os.PathLike, rows: list[dict]) -> bool:
+    "fname exists and was written after the newest point in rows"
+    if not os.path.exists(fname):
+        return False
+    try:
+        newest = _newest(rows)
+    except ValueError:
+        # unparsable timestamp. can't tell, so rewrite
+        return False
+    return datetime.datetime.fromtimestamp(os.path.getmtime(fname)) > newest
+
+
+def _view_settings(rows: list[dict]) -> tuple:
+    "sag/cor center line like load_from_db: mean of points"
+    zs = [r['sag_i'] for r in rows if r['sag_i'] is not None]
+    xs = [r['x'] for r in rows if r['x'] is not None]
+    sag = int(sum(zs) / len(zs)) if zs else "NA"
+    cor = int(sum(xs) / len(xs)) if xs else "NA"
+    return sag, cor
+
+
+def export_image(image: str, rows: list[dict], out_dir: os.PathLike, force: bool = False,
+                 fname: Optional[str] = None) -> Optional[str]:
+    """
+    write one image's tsv.
+    :param fname: output file. default :py:func:`output_name`
+    :return: file written, None if skipped (already up to date)
+    """
+    fname = fname or output_name(image, out_dir)
+    if not force and up_to_date(fname, rows):
+        return None
+    sag, cor = _view_settings(rows)
+    write_points_tsv(fname, with_unplaced(rows), image, sag=sag, cor=cor, crop="NA", zoom="NA",
+                     user="cspine-export")
+    return fname
+
+
+def export_tsvs(db_fname: os.PathLike, out_dir: os.PathLike, jobs: int = 8,
+                force: bool = False) -> dict[str, int]:
+    """
+    one tsv per image in out_dir.
+    :return: counts of 'written' and 'skipped' images
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {'written': 0, 'skipped': 0}
+    # all names up front: images sharing a file name get unique ones.
+    # an image annotated after this gets the plain output_name
+    names = output_names(sorted(db.annotated_images(db_fname)[0]), out_dir)
+
+    def finish(job):
+        counts['written' if job.result() else 'skipped'] += 1
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        # at most 2 per writer queued: rows of the whole db aren't held in memory
+        running = collections.deque()
+        for image, rows in iter_latest(db_fname):
+            if len(running) >= 2 * jobs:
+                finish(running.popleft())
+            running.append(pool.submit(export_image, image, rows, out_dir, force, names.get(image)))
+        while running:
+            finish(running.popleft())
+    return counts
+
+
+def export_long(db_fname: os.PathLike, fname: os.PathLike) -> int:
+    """
+    all images in one tab separated table with an image column.
+    :return: number of rows written
+    """
+    n = 0
+    with open(fname, 'w') as f:
+        f.write("\t".join(('image',) + TSV_COLUMNS) + "\n")
+        for image, rows in iter_latest(db_fname):
+            for row in rows:
+                f.write("\t".join([image] + ["%s" % x for x in row.values()]) + "\n")
+                n += 1
+    return n
+
+
+def export_parquet(db_fname: os.PathLike, fname: os.PathLike) -> int:
+    "like :py:func:`export_long` but parquet. needs pandas and pyarrow"
+    try:
+        import pandas as pd
+    except ImportError as err:
+        raise ImportError("parquet export needs pandas (and pyarrow): pip install pandas pyarrow") from err
+    records = [{'image': image, **row} for image, rows in iter_latest(db_fname) for row in rows]
+    pd.DataFrame.from_records(records, columns=('image',) + TSV_COLUMNS).to_parquet(fname)
+    return len(records)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine export', description='write current annotations from the db')
+    parser.add_argument('--db', default=db.DEFAULT_DB, help='sqlite database (default: %(default)s)')
+    parser.add_argument('--out', required=True,
+                        help='output directory (tsv) or file (long, parquet)')
+    parser.add_argument('--format', choices=['tsv', 'long', 'parquet'], default='tsv',
+                        help='tsv: one file per image like the save button. long/parquet: one table')
+    parser.add_argument('--jobs', type=int, default=8, help='parallel writers for tsv')
+    parser.add_argument('--force', action='store_true', help='rewrite up to date tsv files')
+    args = parser.parse_args(argv)
+
+    if args.format == 'tsv':
+        counts = export_tsvs(args.db, args.out, jobs=args.jobs, force=args.force)
+        logging.info("wrote %(written)d, %(skipped)d already up to date", counts)
+    elif args.format == 'long':
+        logging.info("wrote %d rows to %s", export_long(args.db, args.out), args.out)
+    else:
+        logging.info("wrote %d rows to %s", export_parquet(args.db, args.out), args.out)
@@ -0,0 +1,98 @@
+"""
+Backing data for the file list window: every input image, its annotation
+status from the db, and the currently filtered view.
+
+Kept apart from Tk so filtering a study of tens of thousands of images is a
+list operation; the window only draws the rows that are visible.
+"""
+import os.path
+import re
+from typing import Optional
+
+from cspine.labels import LABELS
+
+STATUSES = ('untouched', 'partial', 'annotated')
+#: shown before the file name in the list
+STATUS_MARK = {'untouched': ' ', 'partial': '~', 'annotated': '*'}
+#: subject identifiers in BIDS and NCANDA paths
+SUBJECT_RE = re.compile(r'sub-[A-Za-z0-9]+|NCANDA_S[0-9]+')
+
+
+def subject_id(fname: str) -> str:
+    """
+    >>> subject_id('/BIDS/sub-11882/ses-1/anat/sub-11882_ses-1_T1w.nii.gz')
+    'sub-11882'
+    >>> subject_id('mprage.nii.gz')
+    ''
+    """
+    m = SUBJECT_RE.search(fname)
+    return m.group() if m else ''
+
+
+class FileIndex:
+    """
+    file names, their db status, and the indices matching the current filter (``view``).
+    Indices are positions in ``fnames``, which is extended in place by :py:meth:`add`.
+    """
+    def __init__(self, fnames: Optional[list[str]] = None):
+        self.fnames: list[str] = fnames if fnames is not None else []
+        self.abs_fnames: list[str] = []  #: matches image column in db
+        self.search: list[str] = []      #: lower case name for searching
+        self.labels: dict[str, set[str]] = {}  #: labels in db for each image
+        self.visited: set[int] = set()   #: opened this session
+        self.query = ''
+        self.status: Optional[str] = None
+        self.view: list[int] = []
+        self._index(self.fnames)
+
+    def __len__(self):
+        return len(self.fnames)
+
+    def _index(self, fnames):
+        start = len(self.abs_fnames)
+        self.abs_fnames.extend(os.path.abspath(f) for f in fnames)
+        self.search.extend(f.lower() for f in fnames)
+        self.view.extend(i for i in range(start, len(self.abs_fnames)) if self._match(i))
+
+    def add(self, fnames: list[str]):
+        "append files. added to the view if they pass the current filter"
+        self.fnames.extend(fnames)
+        self._index(fnames)
+
+    def status_of(self, i: int) -> str:
+        "one of :py:data:`STATUSES` for fnames[i]"
+        labels = self.labels.get(self.abs_fnames[i])
+        if not labels:
+            return 'untouched'
+        if labels.issuperset(LABELS):
+            return 'annotated'
+        return 'partial'
+
+    def update_labels(self, new: dict[str, set[str]]):
+        "merge labels found in the db (e.g. from :py:func:`cspine.db.label_sets`)"
+        for image, labels in new.items():
+            self.labels.setdefault(image, set()).update(labels)
+        if self.status is not None:
+            # status changes can add or remove rows
+            self.filter(self.query, self.status, _force=True)
+
+    def _match(self, i: int) -> bool:
+        if self.query and self.query not in self.search[i]:
+            return False
+        return self.status is None or self.status_of(i) == self.status
+
+    def filter(self, query: str = '', status: Optional[str] = None, _force=False) -> list[int]:
+        """
+        restrict view to names containing query (case insensitive; e.g. a subject id)
+        and with status. typing more of the same query only rechecks the current view.
+        """
+        query = query.lower().strip()
+        narrowing = (not _force and status == self.status and query.startswith(self.query))
+        candidates = self.view if narrowing else range(len(self.fnames))
+        self.query, self.status = query, status
+        self.view = [i for i in candidates if self._match(i)]
+        return self.view
+
+    def row_text(self, i: int) -> str:
+        "display text for fnames[i]"
+        return f"{STATUS_MARK[self.status_of(i)]} {self.fnames[i]}"
@@ -0,0 +1,1026 @@
+"""
+Tk windows: the annotation :py:class:`App` and the :py:class:`FileLister`.
+
+Everything that needs a display is here. ``import cspine`` doesn't load this
+(or tkinter) until ``cspine.App`` or the GUI itself is used.
+"""
+import datetime
+import functools
+import logging
+import os
+import os.path
+import queue
+import re
+import tkinter as tk
+from tkinter import font as tkfont
+from tkinter import ttk
+from tkinter.filedialog import asksaveasfilename
+from tkinter.messagebox import showerror
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image, ImageTk
+
+from cspine import (db, discover, export, filelist, position, prefetch, profiling, scheduler,
+                    transform)
+from cspine.annotations import AnnotationSet, PointRef
+from cspine.image import StructImg
+from cspine.labels import LABELS, LABELS_GUIDE, LINE_COLOR, LINE_WIDTH
+
+#: seconds the GUI waits for queued points to be saved before telling the rater
+FLUSH_TIMEOUT = 5
+#: picture of the labels, left of the images
+GUIDE_IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "guide-image-small.png")
+
+
+class VirtualList(tk.Frame):
+    """
+    listbox that only holds the visible rows of a :py:class:`cspine.filelist.FileIndex` view.
+    scrolling swaps the text of those rows, so size of the list doesn't matter.
+    Up/Down, PageUp/PageDown, Home/End move the selection through the whole view, not just the visible rows.
+    """
+    #: row background by status. visited (opened this session) wins
+    COLORS = {'annotated': "gray", 'partial': "lightyellow", 'untouched': "", 'visited': "lightblue"}
+
+    def __init__(self, master, index: filelist.FileIndex, on_select):
+        """
+        :param index: backing data
+        :param on_select: called with index into ``index.fnames`` when a row is clicked or selected by key
+        """
+        super().__init__(master)
+        self.index = index
+        self.on_select = on_select
+        self.top = 0 #: position in index.view of first visible row
+        self.rows = 10 #: visible rows, updated on resize
+        self.current: Optional[int] = None #: selected index into index.fnames
+        self.listbox = tk.Listbox(self, activestyle="none", exportselection=False)
+        self.scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.listbox.bind("<<ListboxSelect>>", self.selected)
+        self.listbox.bind("<Configure>", self.resize)
+        self.listbox.bind("<MouseWheel>", lambda e: self.yview("scroll", -e.delta//120, "units"))
+        self.listbox.bind("<Button-4>", lambda e: self.yview("scroll", -3, "units"))
+        self.listbox.bind("<Button-5>", lambda e: self.yview("scroll", 3, "units"))
+        # instead of the listbox's own, which stop at the visible rows
+        self.listbox.bind("<Up>", lambda e: self.move(-1))
+        self.listbox.bind("<Down>", lambda e: self.move(1))
+        self.listbox.bind("<Prior>", lambda e: self.move(-self.rows))
+        self.listbox.bind("<Next>", lambda e: self.move(self.rows))
+        self.listbox.bind("<Home>", lambda e: self.select(0))
+        self.listbox.bind("<End>", lambda e: self.select(len(self.index.view) - 1))
+
+    def resize(self, event):
+        line = tkfont.nametofont(self.listbox.cget("font")).metrics("linespace") + 1
+        self.rows = max(event.height // line, 1)
+        self.refresh()
+
+    def yview(self, *args):
+        "scrollbar and mouse wheel: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"
+        n = len(self.index.view)
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * n)
+        elif args[0] == "scroll":
+            step = self.rows if args[2] == "pages" else 1
+            self.top += int(args[1]) * step
+        self.refresh()
+        return "break"
+
+    def see(self, i: int):
+        "scroll as little as needed so view position i is visible"
+        if i < self.top:
+            self.top = i
+        elif i >= self.top + self.rows:
+            self.top = i - self.rows + 1
+        self.refresh()
+
+    def move(self, change: int):
+        "select the row change rows from the current one (first row if none is selected)"
+        view = self.index.view
+        pos = view.index(self.current) + change if self.current in view else 0
+        return self.select(pos)
+
+    def select(self, pos: int):
+        "select view position pos (clamped to the view), scroll to it, and open it like a click"
+        view = self.index.view
+        if view:
+            pos = max(min(pos, len(view) - 1), 0)
+            self.current = view[pos]
+            self.see(pos)
+            self.on_select(self.current)
+        return "break"
+
+    def refresh(self):
+        "redraw visible rows from the index"
+        view = self.index.view
+        self.top = max(min(self.top, len(view) - self.rows), 0)
+        visible = view[self.top:self.top + self.rows]
+        self.listbox.delete(0, tk.END)
+        if visible:
+            self.listbox.insert(tk.END, *[self.index.row_text(i) for i in visible])
+        for row, i in enumerate(visible):
+            key = 'visited' if i in self.index.visited else self.index.status_of(i)
+            if color := self.COLORS[key]:
+                self.listbox.itemconfig(row, {"bg": color})
+            if i == self.current:
+                self.listbox.selection_set(row)
+        n = max(len(view), 1)
+        self.scroll.set(self.top / n, min(self.top + self.rows, n) / n)
+
+    def selected(self, e):
+        selected = self.listbox.curselection()
+        # selecon cleared on refresh
+        if not selected:
+            return
+        pos = self.top + selected[0]
+        if pos < len(self.index.view):
+            self.current = self.index.view[pos]
+            self.on_select(self.current)
+
+
+class FileLister(tk.Frame):
+    def __init__(self, master, mainwindow, fnames):
+        super().__init__(master)
+        self.main = mainwindow
+        self.master = master
+        self.master.title("Spine Image List")
+        self.master.geometry("750x250")
+        #: shared with App.fnames. extended as files are found
+        self.fnames = fnames
+        self.index = filelist.FileIndex(fnames)
+        self.last_rowid = 0 #: newest db row already in index.labels
+        self.pack(fill=tk.BOTH, expand=True)
+
+        bar = tk.Frame(self)
+        bar.pack(side=tk.TOP, fill=tk.X)
+        self.recolorbtn = ttk.Button(bar, text="recolor")
+        self.recolorbtn.bind("<Button-1>", self.color_files)
+        self.recolorbtn.pack(side=tk.LEFT)
+        self.search_text = tk.StringVar(self)
+        self.search_text.trace("w", self.apply_filter)
+        ttk.Entry(bar, textvariable=self.search_text).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.status_filter = ttk.Combobox(bar, values=("all",) + filelist.STATUSES, width=10, state="readonly")
+        self.status_filter.set("all")
+        self.status_filter.bind("<<ComboboxSelected>>", self.apply_filter)
+        self.status_filter.pack(side=tk.LEFT)
+        self.count = ttk.Label(bar)
+        self.count.pack(side=tk.LEFT)
+
+        self.file_list = VirtualList(self, self.index, self.update_file)
+        self.file_list.pack(fill=tk.BOTH, expand=True)
+
+        # does this take too long?
+        self.color_files()
+
+    def refresh(self):
+        self.count.configure(text=f"{len(self.index.view)}/{len(self.index)}")
+        self.file_list.refresh()
+
+    def apply_filter(self, *args):
+        "search box or status change. search matches anywhere in the path, e.g. subject id"
+        status = self.status_filter.get()
+        self.index.filter(self.search_text.get(), None if status == "all" else status)
+        self.file_list.top = 0
+        self.refresh()
+
+    def add_files(self, fnames):
+        """
+        show more files. colored if already in the db
+        :param fnames: new files
+        """
+        self.index.add(fnames)
+        self.refresh()
+
+    def follow(self, found: queue.Queue, interval=250):
+        """
+        keep adding files from a discovery queue (:py:func:`cspine.discover.stream`) until it ends (None)
+        :param interval: ms between checks
+        """
+        new = []
+        done = False
+        while True:
+            try:
+                fname = found.get_nowait()
+            except queue.Empty:
+                break
+            if fname is None:
+                done = True
+                break
+            new.append(fname)
+        if new:
+            self.add_files(new)
+        if done:
+            logging.info("found %d files", len(self.fnames))
+        else:
+            self.after(interval, self.follow, found, interval)
+
+    def update_file(self, idx):
+        """
+        change file
+        :param idx: position in self.fnames of the clicked row
+        """
+        logging.debug("file selected %s", idx)
+
+        # color selected
+        self.index.visited.add(idx)
+        self.file_list.refresh()
+
+        self.main.load_image(self.fnames[idx])
+        # start reading neighbors while this one is annotated
+        if self.main.prefetch:
+            self.main.prefetch.around(self.fnames, idx)
+
+    def color_files(self, e=None):
+        """
+        color files by if they've been seen in the db.
+        only db rows added since the last call are read
+        :param e: triggering widget/event. ignored
+        """
+        db_fname = self.main.db_fname
+        if not os.path.exists(db_fname) and not getattr(self.main.db_writer, 'remote', False):
+            print(f"WARNING: no DB (yet) at {db_fname}. can't color")
+            return
+        logging.debug("opening %s to color", db_fname)
+        self.main.flush_db()
+        # from the annotation server, if there is one
+        new_labels, self.last_rowid = self.main.db_writer.label_sets(self.last_rowid)
+        self.index.update_labels(new_labels)
+        self.refresh()
+
+
+class CanvasItems:
+    """
+    canvas item ids by name. redraws move or recolor what is already on the
+    canvas (``coords``/``itemconfig``) instead of deleting and recreating every item.
+    """
+    def __init__(self, canvas: tk.Canvas):
+        self.canvas = canvas
+        self.ids : Dict[str, int] = {}
+        self.opts : Dict[str, dict] = {} #: last options given to each item, to skip no-op itemconfig
+
+    def _place(self, name, kind, coords, **opts):
+        "create item name if new, otherwise move it and change only options that differ"
+        if (item := self.ids.get(name)) is None:
+            create = getattr(self.canvas, f"create_{kind}")
+            self.ids[name] = item = create(*coords, **opts)
+            self.opts[name] = dict(opts, state="normal")
+            return item
+        self.canvas.coords(item, *coords)
+        opts['state'] = "normal"
+        changed = {k: v for k, v in opts.items() if self.opts[name].get(k) != v}
+        if changed:
+            self.canvas.itemconfig(item, **changed)
+            self.opts[name].update(changed)
+        return item
+
+    def image(self, name, photo):
+        "show photo anchored to the bottom right, below all other items"
+        item = self._place(name, "image", (photo.width(), photo.height()), anchor="se", image=photo)
+        self.canvas.tag_lower(item)
+        return item
+
+    def oval(self, name, x, y, r, **opts):
+        "circle of radius r centered on x,y"
+        return self._place(name, "oval", (x-r, y-r, x+r, y+r), **opts)
+
+    def line(self, name, *coords, **opts):
+        return self._place(name, "line", coords, **opts)
+
+    def hide(self, name):
+        "hide item if it exists. shown again by the next placement"
+        if (item := self.ids.get(name)) is not None and self.opts[name].get('state') != "hidden":
+            self.canvas.itemconfig(item, state="hidden")
+            self.opts[name]['state'] = "hidden"
+
+    def at(self, x, y, halo=3) -> list[str]:
+        "names of shown items within halo pixels of x,y, topmost first"
+        names = {item: name for name, item in self.ids.items() if self.opts[name].get('state') != "hidden"}
+        hits = self.canvas.find_overlapping(x - halo, y - halo, x + halo, y + halo)
+        return [names[item] for item in reversed(hits) if item in names]
+
+
+class App(tk.Frame):
+    #: spans shown in the status bar when profiling
+    STATUS_SPANS = ('load_image', 'open_volume', 'window', 'frame', 'draw:zoom', 'db_commit')
+
+    @profiling.timed()
+    def load_image(self, fname):
+        """
+        load new image.
+        TODO: will break if image dims change?
+        """
+        if self.prefetch:
+            # may be the same object shown earlier: start from its defaults again
+            self.img = self.prefetch.get(fname)
+            self.img.reset_view()
+        else:
+            self.img = StructImg(fname)
+        self.img.slice_window = self.slice_window.get()
+
+        self.reset_points()
+        self.open_at_estimate()
+        self.scale_zoom.set(self.img.zoom_fac)
+        self.scheduler.request('labels')
+        self.draw_images()
+
+    def reset_points(self):
+        self.point_locs = AnnotationSet(LABELS)
+
+    def open_at_estimate(self):
+        "open where :py:mod:`cspine.position` estimated the spine is, centered on any suggestions"
+        self.load_suggestions()
+        position.open_at(self.img, self.db_writer.position(self.img.fname), self.suggested.values())
+
+    def load_suggestions(self):
+        "precomputed points (see :py:mod:`cspine.suggest`) for this image, drawn as markers until accepted"
+        self.suggested = dict(self.db_writer.suggestions(self.img.fname))
+
+    def on_destroy(self, event):
+        """
+        cleanup on close: close the file list too
+        :param event: widge event calling close. used to restrict to toplevel destroy
+        """
+        if event.widget == event.widget.winfo_toplevel():
+            if self.prefetch:
+                self.prefetch.shutdown()
+            self.scheduler.shutdown()
+            self.db_writer.close()
+            self.file_window.master.destroy()
+
+    def __init__(self, master, savedir, fnames, db_fname: Optional[os.PathLike] = None):
+        """
+        :param db_fname: where points are saved. default :py:data:`cspine.db.DEFAULT_DB`
+        """
+        super().__init__(master)
+        self.master = master
+        self.master.title("CSpine Placement")
+        self.db_fname = os.path.abspath(db_fname or db.DEFAULT_DB)
+        #: clicks are committed in batches off the UI thread. to the db, or an annotation
+        #: server (CSPINE_SERVER) that reads also go to
+        self.db_writer = db.writer_from_env(self.db_fname)
+        #: background loader for files near the FileLister selection. None if disabled
+        self.prefetch = prefetch.from_env(functools.partial(StructImg, preload=True))
+        self.file_window = FileLister(tk.Tk(), self, fnames)
+        self.master.bind("<Destroy>", self.on_destroy)
+
+        menubar = tk.Menu(self.master)
+        self.master.config(menu=menubar)
+
+        file_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="File", menu=file_menu)
+        file_menu.add_command(label="Load from DB", command=self.load_current_from_db)
+        file_menu.add_command(label="Accept suggestions", command=self.accept_suggestions)
+
+        view_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="View", menu=view_menu)
+        self.slice_window = tk.BooleanVar(self.master, value=False)
+        view_menu.add_checkbutton(label="Contrast per slice", variable=self.slice_window,
+                                  command=self.toggle_slice_window)
+
+        self.savedir : Optional[os.PathLike]  = savedir
+
+        #: all labels' points. ``self.point_locs[label]`` acts like a CSpinePoint
+        self.point_locs : AnnotationSet = AnnotationSet(LABELS)
+        #: suggested points (db rows) by label, for labels not placed yet. see load_suggestions
+        self.suggested : Dict[str, dict] = {}
+        #: label of the suggestion being dragged, and where the drag started
+        self.dragging : Optional[tuple[str, int, int]] = None
+
+        # protect from garbage collection
+        self.slice_cor = None
+        self.slice_sag = None
+
+        if os.path.exists(GUIDE_IMAGE):
+            self.guide_img = ImageTk.PhotoImage(file=GUIDE_IMAGE)
+        else:
+            self.guide_img = ImageTk.PhotoImage(image=Image.fromarray(np.zeros((183,389))))
+        # need to pack root before anything else will show
+        self.pack()
+
+        self.user_text = tk.StringVar()
+        self.user_text.set(os.environ.get("USER") or "")
+        self.user = ttk.Entry(self, textvariable=self.user_text)
+        self.user.pack(side=tk.TOP)
+
+        self.fnames = fnames
+        fname = fnames[0]
+        self.img = StructImg(fname)
+        if self.prefetch:
+            self.prefetch.around(fnames, 0)
+        self.open_at_estimate()
+
+        cor = self.img.slice_sag()
+        sag = self.img.slice_cor()
+
+        self.frame = tk.Frame(self)
+
+        # this defined early so sag_zoom can look into it
+        self.point_idx = tk.IntVar(self)
+        self.zoom_rot = tk.StringVar()
+        self.zoom_rot.set("0")
+        self.rot_label = ttk.Entry(self.frame,textvariable=self.zoom_rot, width=4)
+
+        zoom_data = self.img.sag_zoom()
+        self.zoom = tk.Canvas(self.frame,width=zoom_data.width(), height=zoom_data.height(), background="red")
+        self.c_cor= tk.Canvas(self, width=sag.width(), height=sag.height(), background="black")
+        self.c_sag= tk.Canvas(self, width=cor.width(), height=cor.height(), background="black")
+        self.c_guide =tk.Canvas(self, width=self.guide_img.width(), height=self.guide_img.height(), background="black")
+        #: canvas items reused across redraws
+        self.items = {'zoom': CanvasItems(self.zoom), 'cor': CanvasItems(self.c_cor),
+                      'sag': CanvasItems(self.c_sag), 'guide': CanvasItems(self.c_guide)}
+
+        #: handlers mark regions dirty; drawn once when idle. see :py:mod:`cspine.scheduler`
+        self.scheduler = scheduler.from_env(self, capture=lambda: (self.img, self.current_rot()))
+        self.scheduler.add('cor', self.show_cor, lambda state: state[0].cor_entry())
+        self.scheduler.add('sag', self.show_sag, lambda state: state[0].sag_entry())
+        self.scheduler.add('zoom', self.show_zoom, lambda state: state[0].zoom_entry(state[1]))
+        self.scheduler.add('guide', self.redraw_guide)
+        self.scheduler.add('labels', self.update_labels)
+        self.zoom_rot.trace_add("write", lambda *_: self.redraw_zoom_window())
+
+        self.rot_left = ttk.Button(self.frame,text="⮌")
+        self.rot_right = ttk.Button(self.frame,text="⮎")
+        self.rot_left.bind("<Button-1>", self.rot_btn_click)
+        self.rot_right.bind("<Button-1>", self.rot_btn_click)
+
+        self.scale_zoom = ttk.Scale(self.frame, from_=1, to=6,
+                                    orient=tk.HORIZONTAL,
+                                    command=self.update_zoom)
+        self.scale_zoom.set(self.img.zoom_fac)
+
+        # manage frame
+        self.scale_zoom.grid(row=0,column=0,columnspan=3)
+        self.zoom.grid(row=1,column=0,columnspan=3)
+        self.rot_left.grid(row=2,column=0)
+        self.rot_right.grid(row=2,column=1)
+        self.rot_label.grid(row=2,column=2)
+
+        # Bind the mouse click event
+        self.zoom.bind("<Button-1>", self.place_point)
+        # suggestions are dragged into place
+        self.zoom.bind("<B1-Motion>", self.drag_suggestion)
+        self.zoom.bind("<ButtonRelease-1>", self.drop_suggestion)
+        # right click to go forward, middle click to go back
+        self.zoom.bind("<Button-3>", lambda _: self.next_label(1))
+        self.zoom.bind("<Button-2>", lambda _: self.next_label(-1))
+
+        self.c_cor.bind("<Button-1>", self.place_line)
+
+        self.c_sag.bind("<Button-1>", self.place_line)
+
+        self.c_guide.pack(side=tk.LEFT)
+        self.c_cor.pack(side=tk.LEFT)
+        self.c_sag.pack(side=tk.LEFT)
+        self.frame.pack(side=tk.LEFT)
+
+
+
+
+        #self.zoom.pack(side=tk.LEFT)
+        self.frame.pack(side=tk.LEFT)
+
+        self.point_labels = tk.Listbox(self)
+        self.point_labels.bind("<<ListboxSelect>>", self.label_select_change)
+
+        ## initialize labels
+        # TODO: read from db or file
+        for i,_ in enumerate(LABELS):
+            self.update_label(i)
+        self.point_labels.selection_set(0)
+
+
+        self.point_labels.pack(side=tk.TOP, expand=1)
+
+        self.save_btn = ttk.Button(text="save")
+        self.save_btn.bind("<Button-1>", lambda _: self.save_full())
+        self.save_btn.pack(side=tk.BOTTOM)
+
+        rate_options = [str(x) if x!=0 else "NA" for x in range(5)]
+        self.combo = ttk.Combobox(self, values=rate_options, width=2)
+        self.combo.set("NA")
+        self.combo.bind("<<ComboboxSelected>>", self.update_rate)
+        self.combo.pack(side=tk.RIGHT)
+        self.note_text = tk.StringVar()
+        self.note = ttk.Entry(self, textvariable=self.note_text)
+        self.note_text.trace("w", self.update_note)
+        self.note.pack(side=tk.RIGHT)
+
+        if profiling.PROFILER.enabled:
+            self.status = ttk.Label(self.master, anchor=tk.W, font=("TkFixedFont", 8))
+            self.status.pack(side=tk.BOTTOM, fill=tk.X)
+            self.update_status()
+
+        self.draw_images()
+
+    def update_status(self, interval=500):
+        "show latest profiling times in the status bar, every interval ms"
+        self.status.config(text=profiling.PROFILER.status(self.STATUS_SPANS))
+        self.after(interval, self.update_status)
+
+
+    def label_select_change(self, e):
+        "list box cspine point label change"
+        selected = e.widget.curselection()
+        # selecon cleared; no selection on window refreshes
+        if not selected:
+            return
+        self.point_idx.set(selected[0])
+        self.redraw_guide()
+        self.match_rating()
+
+    def current_point(self) -> Optional[PointRef]:
+        "find the current point"
+        i = self.point_idx.get()
+        if i is None:
+            return None
+        label = LABELS[i]
+        point = self.point_locs[label]
+        return point
+
+    def update_zoom(self, event):
+        fac = int(self.scale_zoom.get())
+        if fac == self.img.zoom_fac:
+            return  # scale calls this for every pixel dragged
+        self.img.update_zoom(fac)
+        self.draw_images()
+
+    def match_rating(self):
+        "after changing to set a label, update raiting and note display"
+        point = self.current_point()
+        if point is None:
+            return
+        self.combo.set(point.rating)
+        self.note_text.set(point.note)
+
+    def update_rate(self, e):
+        "update rating annotation for selected point. expect to be run from button push"
+        rating = e.widget.get()
+        point = self.current_point()
+        i = self.point_idx.get()
+        label = LABELS[i]
+        point = self.point_locs[label]
+        point.rating = rating
+        self.update_label(i)
+
+    def update_note(self, *args):
+        "watching note changes and adding them to point"
+        point = self.current_point()
+        if not point:
+            return
+        point.note = self.note_text.get()
+
+
+    def update_label(self, i=None):
+        """set given or current listbox item display
+        expect to be called after a point placement click
+        or during box
+        will update text to label: x,y and background color
+        """
+        lb = self.point_labels
+        if i is None:
+            i = self.point_idx.get()
+            #i = lb.curselection()
+            #i = i[0] # listbox curselection is (index, None)
+
+        # update might happen before listbox has any selection
+        if i is None:
+            print("WARN: update update_label but no i!")
+            return
+        label = LABELS[i]
+        point = self.point_locs[label]
+        title = f"{label}: {point.x} {point.y} {point.z} ({point.rating})"
+
+        # no way to change label? rm and add back
+        # color is cleared with delete, need to restore
+        if lb.size() >= i:
+            lb.delete(i)
+        lb.insert(i, title)
+        lb.itemconfig(i, {"bg": point.color})
+
+    def next_label(self, step=1):
+        """move the current list box selection with a wrap around.
+        change current selection so it is not colored
+        """
+        n = self.point_labels.size()
+        self.select_label((self.point_idx.get() + step) % n)
+
+        # change rating
+        #point = self.point_locs[LABELS[next_label]]
+        #self.combo.set(point.rating)
+        self.match_rating()
+        # todo: set note
+        self.redraw_guide()
+        # redraw all the points incaes we are going back to an already defined one
+        self.draw_images()
+
+
+    def select_label(self, i):
+        "make LABELS[i] the current label in the list box"
+        n = self.point_labels.size()
+        self.point_idx.set(i)
+        self.point_labels.selection_clear(0, n)
+        self.point_labels.selection_set(i)
+        self.point_labels.see(i)
+
+    def move(self, change):
+        self.img.idx_sag += change
+        self.draw_images()
+
+    def view_transform(self) -> transform.ViewTransform:
+        "current zoom window view. valid after the zoom image is rendered (sets crop_size)"
+        return transform.ViewTransform.from_img(self.img, self.current_rot())
+
+    def current_rot(self) -> float:
+        "rotation entry as a number. last good value while it's being typed (e.g. '-')"
+        try:
+            self._rot = float(self.zoom_rot.get() or 0)
+        except ValueError:
+            pass
+        return getattr(self, '_rot', 0.0)
+
+    def point_to_image(self, point: PointRef) -> tuple[2]:
+        """Move from point on brain to where it's displayed on the image"""
+        x, y = self.view_transform().to_view((point.x, point.y))
+        return x, y
+
+
+    def redraw_point(self, i, xy=None):
+        """using stored 'real' x,y to redraw cspine label locations.
+        @param xy position on zoom image, if already computed (see redraw_zoom_window)"""
+        label = LABELS[i]
+        point = self.point_locs[label]
+        if not point.x or not point.y:
+            for canvas in ('zoom', 'sag', 'cor'):
+                self.items[canvas].hide(label)
+            return
+        x, y = xy if xy is not None else self.point_to_image(point)
+
+        r = 10//2
+        self.items['zoom'].oval(label, x, y, r, fill=point.color, outline='white')
+        self.items['sag'].oval(label, point.x, point.y, 1, fill=point.color)
+        self.items['cor'].oval(label, self.img.idx_sag, point.y, 1, fill="red")
+
+    def rot_btn_click(self, event):
+        """
+        update rotation
+        """
+        try:
+            val = float(self.zoom_rot.get())
+        except e:
+            val = 0
+        if event.widget == self.rot_left:
+            val += .5
+        elif event.widget == self.rot_right:
+            val -= .5
+        else:
+            print("ERROR: unknown widget %s", event.widget)
+            return
+        self.zoom_rot.set(str(val))
+        self.redraw_zoom_window()
+
+    def cursor_to_brain(self, x, y):
+        """
+        translate positoin of cursor click on zoomed and rotated image
+        to coordnate.
+        Use img.zoom_left, img.zoom_fac, image.pixim[2], image.crop_size
+        @param x
+        @param y
+        """
+        real_x, real_y = self.view_transform().to_brain((x, y))
+        return real_x, real_y
+
+
+    def place_point(self, event):
+        """
+        place colored circle on spine when image is clicked.
+        clicking a suggestion picks it up instead (see drop_suggestion)
+        """
+        if hits := [n for n in self.items['zoom'].at(event.x, event.y) if n.startswith('suggest:')]:
+            label = hits[0].split(':', 1)[1]
+            self.dragging = (label, event.x, event.y)
+            self.select_label(LABELS.index(label))
+            return
+
+        real_x, real_y = self.cursor_to_brain(event.x, event.y)
+
+        #import ipdb;ipdb.set_trace()
+
+        i = self.point_idx.get()
+        label = LABELS[i]
+        point = self.point_locs[label]
+        point.update(real_x, real_y, self.img.idx_sag, self.zoom_rot.get())
+        self.suggested.pop(label, None)
+        # when user is not empty
+        if this_user := self.user_text.get():
+            point.user = this_user
+            logging.debug("updated user of point: %s",point)
+
+        self.update_label()
+        self.save_db()
+        # 20241021: don't auto advance. might have note or score
+        #   need to redraw if second click though
+        #self.next_label()
+        self.redraw_zoom_window()
+
+
+    def drag_suggestion(self, event):
+        "move the picked up suggestion marker with the cursor"
+        if self.dragging:
+            self.draw_suggestion(self.dragging[0], event.x, event.y)
+
+    def drop_suggestion(self, event):
+        """
+        place the picked up suggestion where it's let go. saved like a click.
+        when not moved, the suggested position is used as is and noted as 'suggested'
+        """
+        if not self.dragging:
+            return
+        label, start_x, start_y = self.dragging
+        self.dragging = None
+        suggestion = self.suggested.pop(label)
+        point = self.point_locs[label]
+        if abs(event.x - start_x) + abs(event.y - start_y) < 3:
+            point.update(suggestion['x'], suggestion['y'], suggestion['z'], self.zoom_rot.get())
+            point.note = "suggested"
+        else:
+            real_x, real_y = self.cursor_to_brain(event.x, event.y)
+            point.update(real_x, real_y, self.img.idx_sag, self.zoom_rot.get())
+        if this_user := self.user_text.get():
+            point.user = this_user
+        self.match_rating()
+        self.update_label()
+        self.save_db()
+        self.redraw_guide()
+        self.redraw_zoom_window()
+
+    def accept_suggestions(self):
+        "File menu: place every remaining suggestion as is, noted as 'suggested'"
+        labels = [l for l in LABELS if l in self.suggested]
+        if not labels:
+            return
+        rows = [self.suggested.pop(l) for l in labels]
+        self.point_locs.update_many(labels, [(r['x'], r['y'], r['z']) for r in rows],
+                                    rot=self.zoom_rot.get(), note="suggested")
+        if this_user := self.user_text.get():
+            self.point_locs.user[self.point_locs.index(labels)] = this_user
+        self.queue_rows([r for r in self.point_locs.rows(self.img.fname) if r[2] in labels])
+        self.match_rating()
+        self.scheduler.request('labels')
+        self.redraw_zoom_window()
+
+    def draw_suggestion(self, label, x, y):
+        "hollow marker in the label's color on the zoom window"
+        color = self.point_locs[label].color
+        self.items['zoom'].oval(f"suggest:{label}", x, y, 6, outline=color, width=2, dash=(3, 2))
+
+    def place_line(self, event):
+        x, y, canvas = event.x, event.y, event.widget
+        #print(f"x={x} y={y}")
+        #import ipdb;ipdb.set_trace()
+        if canvas == self.c_cor:
+            self.img.idx_sag = x
+        else:
+            self.img.idx_cor = x
+        self.draw_images()
+
+    def redraw_guide(self):
+        "Update the far left guide image to highlight the current point being added"
+        i = self.point_idx.get()
+        if i is None:
+            return
+        self.items['guide'].image('image', self.guide_img)
+
+        label = LABELS[i]
+        point = self.point_locs[LABELS[i]]
+        (x,y) = LABELS_GUIDE[label]
+        x=x//2;
+        y=y//2;
+        self.items['guide'].oval('current', x, y, 5, fill=point.color)
+
+    def draw_images(self,*kargs):
+        """redraw all images. once, when tk is idle, however many times this is called"""
+        self.scheduler.request('cor', 'sag', 'zoom', 'guide')
+
+    def show_cor(self, entry):
+        "put a rendered coronal slice (:py:meth:`StructImg.cor_entry`) on its canvas"
+        # same PhotoImage (no pixel work) when slice is unchanged. see StructImg.render
+        self.slice_cor = self.img.photo(entry)
+        self.items['cor'].image('image', self.slice_cor)
+
+    def show_sag(self, entry):
+        "put a rendered sagittal slice on its canvas"
+        self.slice_sag = self.img.photo(entry)
+        self.items['sag'].image('image', self.slice_sag)
+
+    def update_labels(self):
+        "redraw every row of the label list"
+        for i, _ in enumerate(LABELS):
+            self.update_label(i)
+        self.point_labels.selection_set(0)
+
+    def get_rot(self, h=None, inverse = False):
+        """
+        Wrap :py:func:`cspine.transform.rotation` with  using zoom_rot and crop_size
+        @param inverse get inverse rotation
+        @returns 2D rotation matrix
+        """
+        rot = float(self.zoom_rot.get())
+        #: w,h here; rev of h,w = sag_zoom_matrix().shape[:2]
+        if h is None:
+            h = self.img.crop_size[1]
+        return transform.rotation(rot, h, inverse)
+
+
+    def redraw_zoom_window(self):
+        "update the zoomed area and move any placed points, when tk is next idle"
+        self.scheduler.request('zoom')
+
+    def show_zoom(self, entry):
+        """put a rendered zoom image (:py:meth:`StructImg.zoom_entry`) on the canvas and move points.
+        canvas items are reused (see :py:class:`CanvasItems`);
+        the zoom image is only swapped when the rendered pixels change"""
+        # entry may be from the render thread; view_transform() needs the matching crop
+        self.img.use_zoom(entry)
+        self.zoom_img = self.img.photo(entry)
+        self.items['zoom'].image('image', self.zoom_img)
+
+        # TODO: if rot, make sloped line
+        #rot = float(self.zoom_rot.get())
+        #line_end = np.dot(mat, np.array([0, self.c_sag.winfo_height(), 1]))
+        self.items['sag'].line('center',
+                               self.img.idx_cor, self.c_sag.winfo_height(),
+                               #line_end[0]+self.img.idx_cor,line_end[1],
+                               self.img.idx_cor, 0,
+                               fill=LINE_COLOR, width=LINE_WIDTH)
+
+        self.items['cor'].line('center',
+                               self.img.idx_sag, self.c_cor.winfo_height(),
+                               self.img.idx_sag, 0,
+                               fill=LINE_COLOR, width=LINE_WIDTH)
+
+        # replace all points. placed points mapped to the zoom window in one go
+        placed = np.flatnonzero(self.point_locs.placed())
+        xy = self.view_transform().to_view(self.point_locs.xyz[placed, :2]) if len(placed) else []
+        positions = dict(zip(placed.tolist(), xy))
+        for i in range(len(LABELS)):
+            self.redraw_point(i, positions.get(i))
+
+        # suggestions on this slice for labels not placed yet. a dragged one follows the cursor
+        dragged = self.dragging[0] if self.dragging else None
+        shown = [l for l, s in self.suggested.items() if s['z'] == self.img.idx_sag and l != dragged]
+        xy = self.view_transform().to_view([(self.suggested[l]['x'], self.suggested[l]['y'])
+                                            for l in shown]) if shown else []
+        for label, (x, y) in zip(shown, xy):
+            self.draw_suggestion(label, x, y)
+        for label in LABELS:
+            if label not in shown and label != dragged:
+                self.items['zoom'].hide(f"suggest:{label}")
+
+
+    def __repr__(self):
+        print(f"input={self.img.fname}; ")
+        print(f"sag={self.img.idx_sag}; cor={self.img.idx_cor};")
+        print(f"crop={self.img.crop_size}; zoom={self.img.zoom_fac};\n")
+        print(f"left={self.img.zoom_left}; pixdim = {self.self.pixdim}\n")
+
+
+    def save_full(self, fname:Optional[str] = None):
+        """
+        save all points to a tab delimited text file with header and comment
+        NB. called from button binding. needs return "break" to reset button (otherwise it stays sunken/depressed)
+        """
+        if fname is None:
+            fname = f"_cspine-{os.environ['USER']}_create-{datetime.datetime.now().strftime('%FT%H%M%S')}.tsv"
+
+            # match ncanda id expliclity. in path but all files are t1.nii.gz
+            if m := re.search('NCANDA_S[0-9]+', self.img.fname):
+                logging.info("filename %s matches NCANDA subject, updating output name", self.img.fname)
+                fname = m.group() + "_" + fname
+
+            fname = re.sub('.nii(.gz)$', '', self.img.fname) +  fname
+
+            initdir = self.savedir or os.path.join(os.path.dirname(fname), 'out')
+            fname = asksaveasfilename(initialdir=initdir, initialfile=os.path.basename(fname))
+        if not fname:
+            return "break"
+
+        # text file and db should agree
+        self.flush_db()
+        logging.info("propose saving to %s", fname)
+        if fname == self.img.fname:
+            raise Exception(f"text output {fname} should not be the same as input image {self.img.fname}")
+        #if fname[-3:] == '.tsv':
+        #    raise Exception(f"text output {fname} must be a tsv")
+
+        data = self.point_locs.todicts()
+        export.write_points_tsv(fname, data, self.img.fname,
+                                sag=self.img.idx_sag, cor=self.img.idx_cor,
+                                crop=self.img.crop_size, zoom=self.img.zoom_fac)
+        return "break"
+
+    @profiling.timed()
+    def save_db(self):
+        "queue current point for the database. written in the background by :py:class:`cspine.db.DBWriter`"
+        i = self.point_idx.get()
+        point = self.point_locs[LABELS[i]]
+        self.queue_rows([(self.img.fname,
+                          point.user,point.label,point.timestamp,point.x,point.y,point.z,
+                          point.rating, point.note)])
+
+    def queue_rows(self, rows: list[tuple]):
+        "hand rows to the db writer. tell the rater when the db can't be written"
+        try:
+            self.db_writer.put_many(rows)
+        except Exception as err:
+            logging.error("not saved: %s", rows)
+            showerror("cspine", f"points are not being saved to {self.db_fname}:\n{err}")
+
+    def flush_db(self) -> bool:
+        "wait (at most :py:data:`FLUSH_TIMEOUT`) for queued points. tell the rater if they aren't saved"
+        try:
+            if self.db_writer.flush(timeout=FLUSH_TIMEOUT):
+                return True
+            err = self.db_writer.error or f"still waiting after {FLUSH_TIMEOUT}s"
+        except Exception as open_err:
+            err = open_err
+        logging.error("points not saved to %s: %s", self.db_fname, err)
+        showerror("cspine", f"points are not being saved to {self.db_fname}:\n{err}")
+        return False
+
+    @profiling.timed()
+    def load_from_db(self, fname):
+        """
+        Load a file from the database, update structimg, populate points, and redraw.
+        @param fname: path to the image file to load from database
+        """
+        fname = os.path.abspath(fname)
+        if not os.path.exists(fname):
+            print("WARNING: {fname} doesn't exist!")
+            return
+        self.img = StructImg(fname)
+        self.img.slice_window = self.slice_window.get()
+        self.reset_points()
+        self.load_suggestions()
+
+        # include clicks still waiting to be written
+        self.flush_db()
+        # most recent point for each label for this image
+        latest_points = self.db_writer.latest_points(fname)
+        if not latest_points:
+            print("WARNING: {fname} has no entires in DB!")
+            return
+
+        self.point_locs.load_rows(latest_points.values())
+        for label, placed in zip(LABELS, self.point_locs.placed()):
+            if placed:
+                self.suggested.pop(label, None)
+
+        # coordnates into labels
+        self.scheduler.request('labels')
+
+        # get best center line
+        mean_x, _, mean_z = self.point_locs.mean_xyz()
+        if not np.isnan(mean_z):
+            self.img.idx_sag = int(mean_z)
+            self.img.idx_cor = int(mean_x)
+        print(f"read {len(latest_points)} entires for {fname}. updated z/sag={self.img.idx_cor} x/cor={self.img.idx_sag}")
+        self.draw_images()
+
+    def toggle_slice_window(self):
+        "View menu: switch between whole volume and per slice display window"
+        self.img.slice_window = self.slice_window.get()
+        self.draw_images()
+
+    def load_current_from_db(self):
+        """Load the current file from database via menu command"""
+        self.load_from_db(self.img.fname)
+
+
+def main(argv=None, db_fname: Optional[os.PathLike] = None):
+    "start the GUI. see ``python -m cspine --help``"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine', description='mainually identify cspine points across many files')
+    parser.add_argument('--output_dir', type=str, help='Directory to save files', default=None)
+    parser.add_argument('--list', action='append', default=[],
+                        help='text file with one image per line. can be given more than once')
+    parser.add_argument('--manifest', default=discover.DEFAULT_MANIFEST,
+                        help='cache of directory listings for glob patterns (default: %(default)s)')
+    parser.add_argument('fnames', nargs='*',
+                        help='nifti image files, DICOM series directories, or quoted glob patterns '
+                             '(end a pattern with / to match series directories)')
+
+    args = parser.parse_args(argv)
+    logging.debug(args)
+
+    # start GUI with the first file, keep adding while discovery continues
+    found = discover.stream(args.fnames, args.list, args.manifest)
+    first = found.get()
+    if first is None:
+        print("ERROR: no input images found")
+        raise SystemExit(1)
+
+    root = tk.Tk()
+    app = App(master=root,savedir=args.output_dir, fnames=[first], db_fname=db_fname)
+    app.file_window.follow(found)
+    app.mainloop()
@@ -0,0 +1,300 @@
+"""
+Images for annotation: a volume, its display window, and rendered slices.
+
+Rendering produces uint8 arrays and PIL images (:py:meth:`StructImg.render`).
+Only :py:meth:`StructImg.photo` and :py:meth:`StructImg.npimg` make Tk
+objects, importing ``PIL.ImageTk`` when first used.
+"""
+import datetime
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from cspine import profiling, sliceio, transform, volcache, window
+from cspine.labels import LABEL_COLOR
+
+
+class CSpinePoint:
+    def __init__(self, label, user=None):
+        self.label = label
+        self.color = LABEL_COLOR.get(label, "#ffffff")
+        self.x = None
+        self.y = None
+        self.z = None
+        self.rot = None
+        self.timestamp = None
+        self.rating = "NA"
+        self.note = ""
+        self.user = user or os.environ.get("USER")
+
+    def update(self, x, y, z, rot=0):
+        """update position and change timestamp"""
+        self.rot = rot
+        self.x = x
+        self.y = y
+        self.z = z
+        self.timestamp = datetime.datetime.now()
+
+    def rotate(self, M):
+        """Rotate points
+        @param M affinte transform
+        """
+        return transform.apply(M, (self.x, self.y))
+
+    def todict(self) -> dict:
+        """ convert object to dict for easier seralization """
+        return {'label': self.label,
+                'x': self.x, 'y': self.y, 'sag_i': self.z, 'timestamp': self.timestamp,
+                'rating': self.rating, 'note': self.note,
+                'user': self.user}
+
+class StructImg:
+    def __init__(self, fname, preload=False, cache: Union[volcache.VolumeCache, None, bool] = None,
+                 window_method: Optional[str] = None):
+        """
+        :param fname: nifti file, or DICOM series directory (see :py:mod:`cspine.dicom`)
+        :param preload: read the whole volume into memory now
+                        (for background loading, see :py:mod:`cspine.prefetch`)
+        :param cache: decoded volume cache. default (None) from ``CSPINE_CACHE`` env
+                      (see :py:mod:`cspine.volcache`). False: no cache, even if configured
+        :param window_method: how to estimate the display window. default from ``CSPINE_WINDOW``
+                              (see :py:mod:`cspine.window`)
+        """
+
+        self.zoom_width = 30 # self.pixdim[2]//3
+        self.zoom_fac = 3
+        # 20250428 - SPA slice is big! keep smaller default
+        #  but if see slice is large, update to half instead of 1/3
+        zoom_top_fac=3
+
+        self.fname =  os.path.abspath(fname)
+        self.window_method = window_method or window.method_from_env()
+        #: recompute min_val,max_val from each displayed slice instead of the volume
+        self.slice_window = False
+        if cache is None:
+            cache = volcache.default_cache()
+            if cache is None and os.path.isdir(self.fname):
+                # DICOM: don't decode every slice again next time
+                cache = volcache.series_cache()
+        cached = cache.load(self.fname) if cache else None
+        if cached is not None:
+            self.data, settings = cached
+            self.strategy = 'cache'
+            if settings.get('window_method', 'exact') == self.window_method:
+                self.min_val, self.max_val = settings['window']
+            else:
+                self.rewindow()
+                cache.update(self.fname, window=[self.min_val, self.max_val],
+                             window_method=self.window_method)
+            self.zoom_width = settings['zoom_width']
+            self.zoom_fac = settings['zoom_fac']
+            zoom_top_fac = settings['zoom_top_fac']
+        else:
+            with profiling.span('open_volume'):
+                self.data, self.strategy = sliceio.open_volume(fname)
+            if self.strategy == 'spa2d':
+                # 20250428 - SPA cspine is 2D, faked as two sagittal slices
+                self.zoom_width = 60
+                self.zoom_fac = 2
+                zoom_top_fac = 2
+            if (preload or cache) and not isinstance(self.data, np.ndarray):
+                self.data = np.asanyarray(self.data)
+                self.strategy = 'memory'
+
+            self.rewindow()
+            if cache:
+                cache.store(self.fname, self.data,
+                            {'window': [self.min_val, self.max_val],
+                             'window_method': self.window_method,
+                             'zoom_width': self.zoom_width,
+                             'zoom_fac': self.zoom_fac,
+                             'zoom_top_fac': zoom_top_fac})
+
+        logging.debug("reading slices of %s with %s", self.fname, self.strategy)
+        #: recently read sagittal and coronal slices
+        self.slices = sliceio.SliceCache(self.data)
+        self.pixdim = self.data.shape
+        #: zoom_width, zoom_fac, zoom_top_fac a fresh view starts with. see reset_view()
+        self.view_defaults = (self.zoom_width, self.zoom_fac, zoom_top_fac)
+        self.reset_view()
+
+        #: rendered slices by (axis, index, ..., window). see render()
+        self.render_cache : OrderedDict[tuple, dict] = OrderedDict()
+        self.render_cache_size = 32
+        #: render() may run on the scheduler's worker thread (CSPINE_RENDER_THREAD)
+        self.render_lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        "in memory size of data. 0 when only a proxy to (or memory map of) the file"
+        if isinstance(self.data, np.memmap):
+            return 0
+        return getattr(self.data, 'nbytes', 0)
+
+    @profiling.timed('window')
+    def rewindow(self, method: Optional[str] = None):
+        """
+        recompute display min and max over the whole volume
+        @param method see :py:data:`cspine.window.METHODS`. default to current method
+        """
+        self.window_method = method or self.window_method
+        self.min_val, self.max_val = window.intensity_window(self.data, self.window_method)
+
+    def reset_view(self):
+        """
+        slices and zoom window as when the image was opened, e.g. when a
+        :py:mod:`cspine.prefetch` copy that was shown before is opened again
+        """
+        self.zoom_width, self.zoom_fac, zoom_top_fac = self.view_defaults
+        self.idx_cor = self.pixdim[2]//2
+        self.idx_sag = self.pixdim[0]//2 # 20250428!! this was pixdim[1]
+
+        self.zoom_top = self.pixdim[2]//zoom_top_fac
+        self.zoom_left = max(self.idx_cor - self.zoom_width//2,0)
+        self.crop_size = (0,0) # set in sag_zoom, used by place_point
+
+    def update_zoom(self, fac):
+        """
+        change zoom box
+        @param fac scale factor"""
+        self.zoom_fac = fac
+        self.zoom_top = self.pixdim[2]//fac
+
+    def set_position(self, sag, cor, zoom_fac=None):
+        """
+        start at a precomputed slice and zoom (see :py:mod:`cspine.position`)
+        @param zoom_fac None keeps the current zoom
+        """
+        self.idx_sag = min(max(int(sag), 0), self.pixdim[0] - 1)
+        self.idx_cor = min(max(int(cor), 0), self.pixdim[1] - 1)
+        if zoom_fac:
+            self.update_zoom(int(zoom_fac))
+
+    def to_uint8(self, x) -> np.ndarray:
+        "rescale x from display window (min_val to max_val) onto 0-255"
+        if self.slice_window:
+            minimum, maximum = window.intensity_window(x, self.window_method)
+        else:
+            minimum = self.min_val
+            maximum = self.max_val
+        # rescale so high valued niftis aren't too bright
+        return window.to_uint8(x, minimum, maximum)
+
+    def pil_image(self, x) -> Image.Image:
+        "x in the display window as a grayscale PIL image. no tk needed"
+        return Image.fromarray(self.to_uint8(x))
+
+    def npimg(self, x):
+        from PIL import ImageTk
+        return ImageTk.PhotoImage(image=self.pil_image(x))
+
+    def render(self, key: tuple, make_slice, **info) -> dict:
+        """
+        memoize rendering a slice.
+        @param key what is shown. combined with current display window
+        @param make_slice function returning the 2D array to show. only called on cache miss
+        @param info kept in the entry, e.g. the zoom window it was cropped to
+        @returns dict with 'array' (uint8), 'image' (PIL) and 'photo' (tk, made on first use)
+        """
+        key = (*key, self.min_val, self.max_val, self.slice_window)
+        with self.render_lock:
+            if (entry := self.render_cache.get(key)) is not None:
+                self.render_cache.move_to_end(key)
+                return entry
+            arr = self.to_uint8(make_slice())
+            entry = {'array': arr, 'image': Image.fromarray(arr), 'photo': None, **info}
+            self.render_cache[key] = entry
+            while len(self.render_cache) > self.render_cache_size:
+                self.render_cache.popitem(last=False)
+            return entry
+
+    def photo(self, entry: dict) -> "ImageTk.PhotoImage":
+        """tk image for a :py:meth:`render` entry. reused while entry is cached.
+        the only place rendered slices become tk objects (needs a Tk root)"""
+        if entry['photo'] is None:
+            from PIL import ImageTk
+            entry['photo'] = ImageTk.PhotoImage(image=entry['image'])
+        return entry['photo']
+
+    def sag_scroll(self, change=1):
+        new_pos = self.idx_cor + change
+        if new_pos > self.pixdim[0] or new_pos < 0:
+            return
+        self.idx_cor = new_pos
+
+    def cor_scroll(self, change=1):
+        new_pos = self.idx_sag + change
+        if new_pos > self.pixdim[1] or new_pos < 0:
+            return
+        self.idx_sag = new_pos
+
+    def cor_entry(self) -> dict:
+        "rendered coronal slice, see :py:meth:`render`. no tk, so ok off the main thread"
+        return self.render(('cor', self.idx_cor),
+                           lambda: np.rot90(self.slices.cor(self.idx_cor)))
+
+    def sag_entry(self) -> dict:
+        "rendered sagittal slice, see :py:meth:`render`"
+        return self.render(('sag', self.idx_sag),
+                           lambda: np.rot90(self.slices.sag(self.idx_sag)))
+
+    def slice_cor(self):
+        return self.photo(self.cor_entry())
+
+    def slice_sag(self):
+        return self.photo(self.sag_entry())
+
+    def sag_zoom_matrix(self, rot=0, zoom_left=None):
+        """
+        Zoom in on optionally rotated sagital image.
+        Rotation, crop and resize are one remap of just the zoom window (see :py:func:`cspine.transform.zoom`)
+
+        @param rot how much to rotate
+        @param zoom_left first column of the window. default from idx_cor
+        """
+        full_slice = np.rot90(self.slices.sag(self.idx_sag))
+        if zoom_left is None:
+            zoom_left = max(self.idx_cor - self.zoom_width//2,0)
+        return transform.zoom(full_slice, float(rot or 0), zoom_left, self.zoom_top,
+                              self.zoom_width, self.zoom_fac)
+
+    def zoom_entry(self, rot=0) -> dict:
+        """
+        rendered zoom image (see :py:meth:`sag_zoom_matrix`), cached, with the 'zoom_left' it was cropped at.
+        doesn't change the image, so ok off the main thread: :py:meth:`use_zoom` the entry where it's shown
+        """
+        zoom_left = max(self.idx_cor - self.zoom_width//2,0)
+        key = ('zoom', self.idx_sag, float(rot), self.zoom_fac,
+               zoom_left, self.zoom_top, self.zoom_width)
+        return self.render(key, lambda: self.sag_zoom_matrix(rot, zoom_left), zoom_left=zoom_left)
+
+    def use_zoom(self, entry: dict):
+        "set zoom_left and crop_size (used by place_point) to those of a shown :py:meth:`zoom_entry`"
+        self.zoom_left = entry['zoom_left']
+        self.crop_size = entry['image'].size
+
+    def sag_zoom(self, rot=0):
+        "zoom image as a tk photo. see :py:meth:`zoom_entry`"
+        entry = self.zoom_entry(rot)
+        self.use_zoom(entry)
+        return self.photo(entry)
+
+
+    def point_onto_zoom(self, real_x, real_y):
+        "project sagital points onto zoomed frame"""
+        x = (real_x - self.zoom_left)*self.zoom_fac
+        y = (real_y - self.pixdim[2])*self.zoom_fac + self.crop_size[1]
+        return x, y
+
+    def zoom_onto_full(self, x, y):
+        """zoom x,y coord onto full image"""
+        real_x = x/self.zoom_fac + self.zoom_left
+        #                    256 - (255-56)/3
+        real_y = self.pixdim[2] -  (self.crop_size[1] - y)/self.zoom_fac
+        real_x, real_y = np.round([real_x, real_y], 2)
+        return real_x, real_y
@@ -0,0 +1,80 @@
+"""
+cspine point names, guide image positions, and display colors
+"""
+import colorsys
+
+LABELS_DICT = {
+          "top": [""],
+          "C2": ["p", "m", "a"],
+          "C3": ["up","ua", "lp","m","la"],
+          "C4": ["up","ua", "lp","m","la"]
+}
+LABELS_GUIDE = {
+'top': (174,100),
+'C2p':(84,414),
+'C2m':(174,378),
+'C2a':(264,414),
+'C3up':(90,456),
+'C3ua':(266,458),
+'C3lp':(88,576),
+'C3m':(150,562),
+'C3la':(228,594),
+'C4up':(66,626),
+'C4ua':(214,636),
+'C4lp':(50,756),
+'C4m':(124,732),
+'C4la':(198,760)
+}
+
+LABEL_COLOR = {
+'top': "#F0F0F0",
+#
+'C2p': "#1E2EEA",
+'C2m': "#6DE6F1",
+'C2a': "#1E2EEA",
+#
+'C3up':"#F7FC53",
+'C3ua':"#75FB4C",
+'C3lp':"#F7FC53",
+'C3m': "#75FB4C",
+'C3la':"#F7FC53",
+#
+'C4up':"#F730DF",
+'C4ua':"#FF3726",
+'C4lp':"#F730DF",
+'C4m': "#FF3726",
+'C4la':"#F730DF"
+}
+
+LABELS = [k+x for k in LABELS_DICT.keys() for x in LABELS_DICT[k]]
+
+#: color of the center line on sagital images showing where the slice is taken from
+LINE_COLOR = "lightgreen"
+LINE_WIDTH = 5  #: sagital center line reference width in pixels
+
+
+def set_color(clabel: str) -> str:
+    """
+    derive colors by changing saturation by per-section. fixed colors C4-C2.
+    20250107 - deprecated. using fixed every other color.
+    :param clabel: label from LABELS_GUIDE. 'C4up' split to 'C4' (color) and 'up' (sat)
+    :return: hex color
+    """
+    colors = {'C4': (255,0,0), 'C3': (0,255,0), 'C2': (0,0,255)}
+    base_color =  colors.get(clabel[0:2], (255,255,0))
+    pos = clabel[2:]
+    try:
+        sat = (["up","ua","lp","p", "m","la", "a"].index(pos)+1)/8 * 255
+    except ValueError:
+        sat = 256/2
+
+    h, s, l = colorsys.rgb_to_hls(*base_color)
+    #new_l = min(l+0.5,1) # make everything brighter
+    rgb = colorsys.hls_to_rgb(h, sat, l)
+    rgb_san = [int(abs(min(x,255))) for x in rgb]
+    ashex = "#" + "".join(["%02x"%x for x in rgb_san])
+    #print(f"# {base_color} to {h}, {s}=>{sat}, {l}; {rgb_san} is now {ashex}")
+    return ashex
+
+# using hard coded every-other
+# LABEL_COLOR = {k: set_color(k) for k in LABELS}
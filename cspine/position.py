@@ -0,0 +1,181 @@
+"""
+Where each image should open: mid-sagittal slice and zoom window, estimated ahead of time.
+
+Without this, an image opens on the middle of the volume and the rater clicks
+the coronal and sagittal canvases (``place_line``) and the zoom scale to find
+the spine. :py:func:`estimate` guesses all three from the image:
+
+* ``sag``: the sagittal slice the lower half of the volume is most left-right
+  symmetric about. Downsampled slices are correlated with each other in one
+  matrix product, and each candidate is scored by its mirrored pairs.
+* ``zoom_fac``: on that slice, the skull base is the lowest row where the
+  foreground is much wider than the neck. The zoom window (the bottom
+  ``pixdim[2]//zoom_fac`` rows) is made just tall enough to include it.
+* ``cor``: the spine is :py:data:`SPINE_FRACTION` of the way from the back
+  to the front of the neck below the skull base.
+
+``python -m cspine position 'data/*/t1.nii.gz'`` runs this in a process pool
+and stores results in the db's ``position`` table. The GUI opens images
+there (:py:func:`open_at`), centered on suggested points if there are any
+(see :py:mod:`cspine.suggest`).
+"""
+import datetime
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from cspine import db, discover
+
+STRIDE = 4              #: downsampling of slices compared for symmetry
+SYMMETRY_DEPTH = 8      #: slices up to 1/SYMMETRY_DEPTH of the volume apart are compared
+FOREGROUND = .2         #: of the 99th percentile: brighter is head or neck
+SPINE_FRACTION = .45    #: spine's position from the back (left) to the front of the neck
+WIDEN = 1.4             #: rows wider than the neck by this are skull
+MARGIN = .1             #: extra zoom window height above the skull base
+MAX_ZOOM = 6            #: like the GUI's zoom scale
+
+
+class Position(NamedTuple):
+    sag: int                 #: ``StructImg.idx_sag``
+    cor: int                 #: ``StructImg.idx_cor``
+    zoom_fac: Optional[int]  #: None if no skull base was found: keep the image's default
+    score: float             #: symmetry about sag: mean correlation of mirrored slices
+
+
+def symmetry(data, stride: int = STRIDE) -> np.ndarray:
+    "score of each sagittal slice as the mirror plane of the lower half of data. NaN near the edges"
+    n_x, _, n_z = data.shape
+    sub = np.asarray(data[:, ::stride, :max(n_z // 2, 1):stride], dtype=np.float32).reshape(n_x, -1)
+    sub = sub - sub.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(sub, axis=1, keepdims=True)
+    sub = np.divide(sub, norm, out=np.zeros_like(sub), where=norm > 0)
+    corr = sub @ sub.T
+    depth = max(n_x // SYMMETRY_DEPTH, 1)
+    centers = np.arange(depth, n_x - depth)[:, None]
+    offsets = np.arange(1, depth + 1)
+    scores = np.full(n_x, np.nan)
+    scores[centers[:, 0]] = corr[centers - offsets, centers + offsets].mean(axis=1)
+    return scores
+
+
+def _smooth(x: np.ndarray, k: int = 5) -> np.ndarray:
+    return np.convolve(x, np.ones(k) / k, mode='same')
+
+
+def neck_crop(sag_slice: np.ndarray) -> tuple[int, Optional[int]]:
+    """
+    spine column and skull base row on a sagittal slice as displayed
+    (:py:meth:`cspine.StructImg.sag_entry`: top is superior, right is anterior).
+    :return: (column, row). row is None if no skull base is found
+    """
+    h, w = sag_slice.shape
+    fg = sag_slice > FOREGROUND * np.percentile(sag_slice, 99)
+    widths = _smooth(fg.sum(axis=1).astype(float))
+    lowest = widths[h - max(h // 6, 1):]
+    if not (lowest > 0).any():
+        return w // 2, None
+    neck = np.median(lowest[lowest > 0])
+    wide = np.flatnonzero(widths[:h - max(h // 6, 1)] > WIDEN * neck)
+    top = int(wide.max()) if len(wide) else None
+
+    # neck below the skull base, or the bottom third like the default zoom window
+    neck_rows = fg[h - h // 3 if top is None else top:]
+    rows = neck_rows[neck_rows.any(axis=1)]
+    if not len(rows):
+        return w // 2, top
+    back = np.median(rows.argmax(axis=1))
+    front = np.median(w - 1 - rows[:, ::-1].argmax(axis=1))
+    return int(round(back + SPINE_FRACTION * (front - back))), top
+
+
+def estimate(data) -> Position:
+    "where to look on a RAS+ volume (``StructImg.data``)"
+    n_x, _, n_z = data.shape
+    scores = symmetry(data)
+    if np.isnan(scores).all():  # too few slices, e.g. 2D SPA
+        sag, score = n_x // 2, float('nan')
+    else:
+        sag = int(np.nanargmax(scores))
+        score = float(scores[sag])
+    cor, top = neck_crop(np.rot90(np.asarray(data[sag], dtype=np.float32)))
+    zoom_fac = None
+    if top is not None:
+        rows = (n_z - top) * (1 + MARGIN)
+        zoom_fac = int(np.clip(n_z // max(rows, 1), 1, MAX_ZOOM))
+    return Position(sag, cor, zoom_fac, score)
+
+
+def open_at(img, pos=None, suggestions=()):
+    """
+    move img to where it should open.
+    @param pos :py:func:`cspine.db.position` row, or None
+    @param suggestions :py:func:`cspine.db.suggestions` rows. centers the coronal line on them,
+                       and picks their slice only if there is no estimated mid-sagittal slice
+    """
+    if pos:
+        img.set_position(pos['sag'], pos['cor'], pos['zoom_fac'])
+    suggestions = list(suggestions)
+    if suggestions:
+        img.idx_cor = int(np.mean([s['x'] for s in suggestions]))
+        if not pos:
+            img.idx_sag = int(np.median([s['z'] for s in suggestions]))
+
+
+def position_image(image: str) -> tuple:
+    """
+    estimate for one image. runs in a worker process.
+    :return: row ordered like :py:data:`cspine.db.POSITION_COLUMNS`
+    """
+    from cspine.image import StructImg
+    img = StructImg(image)
+    pos = estimate(img.data)
+    return (img.fname, datetime.datetime.now(), pos.sag, pos.cor, pos.zoom_fac, round(pos.score, 3))
+
+
+def position_study(db_fname: os.PathLike, images: Iterable[str], jobs: Optional[int] = None,
+                   force: bool = False) -> dict[str, int]:
+    """
+    store positions for images without one (or all, if force).
+    :param jobs: processes. default cpu count
+    :return: counts of 'positioned', 'skipped' and 'failed' images
+    """
+    images = list(dict.fromkeys(os.path.abspath(i) for i in images))
+    db.connect(db_fname).close()  # tables for the lookup below
+    done = set() if force else db.positioned_images(db_fname)
+    todo = [i for i in images if i not in done]
+    counts = {'positioned': 0, 'skipped': len(images) - len(todo), 'failed': 0}
+    rows = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = {pool.submit(position_image, image): image for image in todo}
+        for job, image in running.items():
+            try:
+                rows.append(job.result())
+            except Exception as err:
+                logging.warning("no position for %s: %s", image, err)
+                counts['failed'] += 1
+                continue
+            counts['positioned'] += 1
+            if len(rows) >= 100:
+                db.save_positions(db_fname, rows)
+                rows = []
+    db.save_positions(db_fname, rows)
+    return counts
+
+
+def main(argv=None):
+    "precompute where each image opens"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine position',
+                                     description='find the mid-sagittal slice and spine zoom window of images')
+    parser.add_argument('images', nargs='*', help='images, or quoted glob patterns')
+    parser.add_argument('--list', action='append', default=[], help='text file with one image per line')
+    parser.add_argument('--db', default=db.DEFAULT_DB, help='sqlite database (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=None, help='processes (default: cpu count)')
+    parser.add_argument('--force', action='store_true', help='replace existing positions')
+    args = parser.parse_args(argv)
+    images = discover.expand_inputs(args.images, args.list)
+    counts = position_study(args.db, images, jobs=args.jobs, force=args.force)
+    logging.info("positioned %(positioned)d, %(skipped)d already done, %(failed)d failed", counts)
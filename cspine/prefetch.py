@@ -0,0 +1,150 @@
+"""
+Background loading of images near the FileLister cursor.
+
+Loading a volume (``nib.load``, reorienting, intensity window) can take
+seconds on network mounts. :py:class:`Prefetcher` runs the loader for the
+next/previous files on a thread pool so that clicking the next file in the
+list hands back an already built object.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence
+
+
+def _nbytes(obj) -> int:
+    "memory used by a loaded image. 0 if unknown"
+    return int(getattr(obj, 'nbytes', 0) or 0)
+
+
+class Prefetcher:
+    """
+    keep a small window of loaded images around the current file.
+
+    >>> pf = Prefetcher(str.upper, ahead=1, behind=0)
+    >>> pf.around(['a', 'b', 'c'], 0)
+    >>> pf.get('b')
+    'B'
+    >>> pf.shutdown()
+    """
+    def __init__(self, loader: Callable, ahead: int = 2, behind: int = 1,
+                 max_bytes: float = 2e9, workers: int = 2):
+        """
+        :param loader: called with a file name, returns the loaded object (``StructImg``)
+        :param ahead: number of files after the cursor to load
+        :param behind: number of files before the cursor to keep/load
+        :param max_bytes: memory budget for loaded objects (uses ``obj.nbytes``)
+        :param workers: size of the thread pool
+        """
+        self.loader = loader
+        self.ahead = ahead
+        self.behind = behind
+        self.max_bytes = max_bytes
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix="cspine-prefetch")
+        self.jobs: Dict[str, Future] = {}
+        self.order: Dict[str, int] = {}  #: distance from cursor, for eviction
+        self.lock = threading.RLock()  # done callbacks can fire while submitting
+
+    def _submit(self, fname: str) -> Future:
+        "start loading fname if not already loaded or loading. must hold lock"
+        job = self.jobs.get(fname)
+        if job is None:
+            logging.debug("prefetching %s", fname)
+            job = self.pool.submit(self.loader, fname)
+            job.add_done_callback(lambda _: self._enforce_budget())
+            self.jobs[fname] = job
+        return job
+
+    def around(self, fnames: Sequence[str], idx: int):
+        """
+        move the cursor to ``fnames[idx]``: queue neighbors, drop far away files.
+        :param fnames: full file list (``FileLister.fnames``)
+        :param idx: index of the file being annotated
+        """
+        lo = max(idx - self.behind, 0)
+        hi = min(idx + self.ahead, len(fnames) - 1)
+        # load nearest first. current file is (likely) already loaded by get()
+        wanted = sorted(range(lo, hi + 1), key=lambda i: (abs(i - idx), i < idx))
+        with self.lock:
+            self.order = {fnames[i]: abs(i - idx) for i in wanted}
+            for fname in list(self.jobs):
+                if fname not in self.order:
+                    self._drop(fname)
+            for i in wanted:
+                self._submit(fnames[i])
+
+    def _drop(self, fname: str):
+        "forget a job. pending jobs are cancelled. must hold lock"
+        job = self.jobs.pop(fname, None)
+        if job is not None and job.cancel():
+            logging.debug("cancelled prefetch of %s", fname)
+
+    def _enforce_budget(self):
+        "evict loaded images furthest from the cursor until under max_bytes"
+        with self.lock:
+            done = [(f, j) for f, j in self.jobs.items()
+                    if j.done() and not j.cancelled() and j.exception() is None]
+            total = sum(_nbytes(j.result()) for _, j in done)
+            # never evict the cursor itself (distance 0)
+            done.sort(key=lambda fj: self.order.get(fj[0], float('inf')), reverse=True)
+            for fname, job in done:
+                if total <= self.max_bytes or self.order.get(fname) == 0:
+                    break
+                total -= _nbytes(job.result())
+                logging.debug("evicting prefetched %s", fname)
+                del self.jobs[fname]
+
+    def get(self, fname: str):
+        """
+        loaded object for fname. waits on an in progress prefetch,
+        or loads on the calling thread if fname was never queued.
+        Load errors are raised here, not in the worker.
+        """
+        with self.lock:
+            job = self.jobs.get(fname)
+        if job is None or job.cancelled():
+            obj = self.loader(fname)
+            with self.lock:
+                job = Future()
+                job.set_result(obj)
+                self.jobs[fname] = job
+            return obj
+        try:
+            return job.result()
+        except Exception:
+            # dont cache the failure: next get() will retry
+            with self.lock:
+                self.jobs.pop(fname, None)
+            raise
+
+    def loaded(self) -> list[str]:
+        "file names with a finished load"
+        with self.lock:
+            return [f for f, j in self.jobs.items() if j.done() and not j.cancelled()]
+
+    def shutdown(self, wait: bool = False):
+        "stop workers. pending loads are cancelled"
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+        with self.lock:
+            self.jobs.clear()
+
+
+def from_env(loader: Callable, environ: Optional[dict] = None) -> Optional[Prefetcher]:
+    """
+    build a :py:class:`Prefetcher` configured by environment variables.
+    ``CSPINE_PREFETCH`` number of files to load ahead (default 0: off, like the other loading options).
+    ``CSPINE_PREFETCH_MB`` memory budget in megabytes (default 2000).
+
+    >>> from_env(str, {}) is None
+    True
+    >>> from_env(str, {'CSPINE_PREFETCH': '2'}).ahead
+    2
+    """
+    environ = os.environ if environ is None else environ
+    ahead = int(environ.get("CSPINE_PREFETCH", 0))
+    if ahead <= 0:
+        return None
+    max_mb = float(environ.get("CSPINE_PREFETCH_MB", 2000))
+    return Prefetcher(loader, ahead=ahead, behind=1, max_bytes=max_mb * 1e6)
@@ -0,0 +1,168 @@
+"""
+Opt-in timing of the slow steps: opening, windowing, drawing, saving.
+
+``CSPINE_PROFILE=1`` turns it on. Each span (``open_volume``, ``window``,
+``frame``, ``draw:zoom``, ``db_commit``, ``load_image``, ...) is
+aggregated into a histogram. The GUI shows the latest timings in a status
+bar, and a summary is written on exit to
+``~/.cache/cspine/profiles/<host>_<time>.json``, or to ``CSPINE_PROFILE``
+itself when it is a ``.json`` or ``.csv`` path.
+
+Disabled, a span is one attribute check.
+"""
+import atexit
+import bisect
+import contextlib
+import csv
+import datetime
+import functools
+import json
+import logging
+import os
+import platform
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+#: histogram bucket upper edges (ms). last bucket is everything slower
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+PROFILE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                           "cspine", "profiles")
+
+
+class Span:
+    "timings of one named step"
+    def __init__(self, keep: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.hist = [0] * (len(BUCKETS_MS) + 1)
+        self.recent: deque = deque(maxlen=keep)  #: for percentiles
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+        self.hist[bisect.bisect_right(BUCKETS_MS, seconds * 1000)] += 1
+        self.recent.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> dict:
+        "milliseconds"
+        return {'count': self.count,
+                'total_ms': 1000 * self.total,
+                'mean_ms': 1000 * self.total / max(self.count, 1),
+                'p50_ms': 1000 * self.percentile(50),
+                'p95_ms': 1000 * self.percentile(95),
+                'max_ms': 1000 * self.max,
+                'last_ms': 1000 * self.last,
+                'hist': dict(zip([f"<{b}ms" for b in BUCKETS_MS] + [f">={BUCKETS_MS[-1]}ms"], self.hist))}
+
+
+class Profiler:
+    "collects :py:class:`Span` timings from any thread"
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans: dict[str, Span] = {}
+        self.lock = threading.Lock()
+        self.started = datetime.datetime.now()
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            if (span := self.spans.get(name)) is None:
+                span = self.spans[name] = Span()
+            span.add(seconds)
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        "time the with block as name"
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name: Optional[str] = None):
+        "decorator: time each call of the function"
+        def decorator(func):
+            label = name or func.__name__
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(label, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def summary(self) -> dict[str, dict]:
+        with self.lock:
+            return {name: span.summary() for name, span in sorted(self.spans.items())}
+
+    def status(self, names=None) -> str:
+        "one line for a status bar: last (p50) ms of each span"
+        summary = self.summary()
+        names = names or summary.keys()
+        return "  ".join(f"{n} {summary[n]['last_ms']:.0f}ms (p50 {summary[n]['p50_ms']:.0f})"
+                         for n in names if n in summary)
+
+    def dump(self, fname: os.PathLike):
+        "write summary as json, or csv if fname ends in .csv"
+        summary = self.summary()
+        os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+        if str(fname).endswith('.csv'):
+            with open(fname, 'w', newline='') as f:
+                out = csv.writer(f)
+                hist_cols = list(next(iter(summary.values()))['hist']) if summary else []
+                out.writerow(['span', 'count', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', *hist_cols])
+                for name, s in summary.items():
+                    out.writerow([name, s['count'], *["%.3f" % s[k] for k in
+                                  ('total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms')],
+                                  *s['hist'].values()])
+        else:
+            meta = {'host': platform.node(), 'user': os.environ.get("USER"),
+                    'started': self.started.isoformat(timespec='seconds'),
+                    'ended': datetime.datetime.now().isoformat(timespec='seconds')}
+            with open(fname, 'w') as f:
+                json.dump({'meta': meta, 'spans': summary}, f, indent=1)
+        logging.info("wrote profile to %s", fname)
+
+
+#: used by the whole app. see :py:func:`from_env`
+PROFILER = Profiler()
+span = PROFILER.span
+timed = PROFILER.timed
+
+
+def default_output() -> str:
+    stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+    return os.path.join(PROFILE_DIR, f"{platform.node()}_{stamp}.json")
+
+
+def from_env(environ: Optional[dict] = None) -> Profiler:
+    """
+    enable :py:data:`PROFILER` if ``CSPINE_PROFILE`` is set (not 0) and dump it at exit.
+    :return: PROFILER
+    """
+    environ = os.environ if environ is None else environ
+    setting = environ.get("CSPINE_PROFILE", "0")
+    if setting in ("", "0"):
+        return PROFILER
+    PROFILER.enabled = True
+    output = setting if setting.endswith(('.json', '.csv')) else default_output()
+    atexit.register(lambda: PROFILER.dump(output) if PROFILER.spans else None)
+    return PROFILER
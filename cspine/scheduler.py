@@ -0,0 +1,151 @@
+"""
+Coalesce redraws into one frame per trip through the Tk event loop.
+
+Dragging the zoom scale or clicking the rotate buttons quickly fires many
+events. Drawing synchronously in each handler queues up renders of states
+that are already outdated. Instead, handlers mark regions (``cor``, ``sag``,
+``zoom``, ``guide``, ``labels``) dirty with :py:meth:`RenderScheduler.request`
+and every dirty region is drawn once, in ``after_idle``.
+
+Optionally (``CSPINE_RENDER_THREAD=1``) a region's pixels are computed on a
+worker thread and only ``draw`` (e.g. making the ``PhotoImage`` and swapping it
+onto the canvas) runs on the Tk thread. Each request bumps a per region
+generation, so a render finished after a newer request is dropped.
+"""
+import logging
+import os
+import queue
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from cspine import profiling
+
+_STALE = object()
+
+
+class RenderScheduler:
+    """
+    @param widget any tk widget, for ``after_idle``/``after``
+    @param capture called on the Tk thread at the start of each frame. its result is
+                   passed to every ``render``, so renders don't read Tk variables off thread
+    @param worker render on a background thread
+    @param poll_ms how often to check for finished renders while any are running
+    """
+    def __init__(self, widget, capture: Optional[Callable[[], Any]] = None,
+                 worker: bool = False, poll_ms: int = 10):
+        self.widget = widget
+        self.capture = capture or (lambda: None)
+        #: region name -> (draw, render). drawn in the order added
+        self.regions: dict[str, tuple[Callable, Optional[Callable]]] = {}
+        self.dirty: set[str] = set()
+        self.generation: Counter = Counter()
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cspine-render") if worker else None
+        self.done: queue.Queue = queue.Queue()
+        self.in_flight = 0
+        self.poll_ms = poll_ms
+        self._idle_id = None
+        self._poll_id = None
+        self.requests = 0  #: calls to request()
+        self.frames = 0    #: frames drawn. requests - frames were coalesced
+        self.dropped = 0   #: worker renders thrown away because a newer one was requested
+
+    def add(self, region: str, draw: Callable, render: Optional[Callable[[Any], Any]] = None):
+        """
+        register a region.
+        @param draw called on the Tk thread. with render's result if render is given
+        @param render ``render(state)`` computes what draw shows. on the worker thread, if enabled
+        """
+        self.regions[region] = (draw, render)
+
+    def request(self, *regions: str):
+        "mark regions (default all) dirty. they are drawn when Tk is next idle"
+        for region in regions or self.regions:
+            if region not in self.regions:
+                raise KeyError(f"unknown region '{region}', expect one of {list(self.regions)}")
+            self.dirty.add(region)
+            self.generation[region] += 1
+        self.requests += 1
+        if self._idle_id is None:
+            self._idle_id = self.widget.after_idle(self._frame)
+
+    def flush(self):
+        "draw dirty regions now instead of waiting for idle"
+        if self._idle_id is not None:
+            self.widget.after_cancel(self._idle_id)
+        self._frame()
+
+    def _frame(self):
+        self._idle_id = None
+        dirty, self.dirty = self.dirty, set()
+        if not dirty:
+            return
+        self.frames += 1
+        with profiling.span('frame'):
+            state = self.capture()
+            for region, (draw, render) in self.regions.items():
+                if region not in dirty:
+                    continue
+                if render is not None and self.pool is not None:
+                    self._submit(region, render, state)
+                    continue
+                with profiling.span(f'draw:{region}'):
+                    if render is None:
+                        draw()
+                    else:
+                        draw(render(state))
+
+    def _submit(self, region: str, render: Callable, state):
+        gen = self.generation[region]
+        def job():
+            # skip work already replaced by a newer request
+            if gen != self.generation[region]:
+                return _STALE
+            with profiling.span(f'render:{region}'):
+                return render(state)
+        future = self.pool.submit(job)
+        future.add_done_callback(lambda f: self.done.put((region, gen, f)))
+        self.in_flight += 1
+        if self._poll_id is None:
+            self._poll_id = self.widget.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        "on the Tk thread: draw finished renders that are still current"
+        self._poll_id = None
+        while True:
+            try:
+                region, gen, future = self.done.get_nowait()
+            except queue.Empty:
+                break
+            self.in_flight -= 1
+            self._finish(region, gen, future)
+        if self.in_flight:
+            self._poll_id = self.widget.after(self.poll_ms, self._poll)
+
+    def _finish(self, region: str, gen: int, future: Future):
+        if future.exception() is not None:
+            logging.error("rendering %s failed: %s", region, future.exception())
+            return
+        result = future.result()
+        if result is _STALE or gen != self.generation[region]:
+            self.dropped += 1
+            return
+        with profiling.span(f'draw:{region}'):
+            self.regions[region][0](result)
+
+    def shutdown(self):
+        "stop the worker and pending callbacks"
+        for after_id in (self._idle_id, self._poll_id):
+            if after_id is not None:
+                self.widget.after_cancel(after_id)
+        self._idle_id = self._poll_id = None
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def from_env(widget, capture: Optional[Callable[[], Any]] = None,
+             environ: Optional[dict] = None) -> RenderScheduler:
+    "scheduler with a render thread if ``CSPINE_RENDER_THREAD=1``"
+    environ = os.environ if environ is None else environ
+    worker = environ.get("CSPINE_RENDER_THREAD", "0") not in ("", "0")
+    return RenderScheduler(widget, capture, worker=worker)
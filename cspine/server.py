@@ -0,0 +1,377 @@
+"""
+Optional annotation server: one process owns ``cspine.db`` for every rater.
+
+With many GUIs writing the same sqlite file, each commit takes the file
+lock and the others wait (``database is locked``). Instead, run::
+
+    python -m cspine server                  # listens on a socket named after the db
+    CSPINE_SERVER=1 python -m cspine 'pattern/*.nii.gz'
+
+The server inserts every client's clicks through a single
+:py:class:`cspine.db.DBWriter`, so rows from all raters are committed
+together, and answers reads (latest points, label sets, annotated images)
+from its own connections. Clients speak one json object per line.
+
+``CSPINE_SERVER`` is ``1`` (default socket for the db), a unix socket path,
+or ``host:port``. If no server answers, or it goes away, the GUI writes the
+db directly like before.
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+
+from cspine import db
+
+#: bumped when requests or responses change incompatibly (2: suggestions, 3: position)
+PROTOCOL_VERSION = 3
+#: the server groups rows from all clients. bigger than a single GUI's batch
+SERVER_BATCH = 500
+
+Address = Union[str, tuple[str, int]]
+
+
+class ServerError(Exception):
+    "the server answered a request with an error"
+
+
+def default_socket(db_fname: os.PathLike) -> str:
+    "unix socket for db_fname's server. in the temp dir: db paths can be too long for a socket"
+    key = hashlib.sha1(os.path.realpath(db_fname).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"cspine-{key}.sock")
+
+
+def parse_address(address: str, db_fname: os.PathLike) -> Address:
+    """
+    >>> parse_address('localhost:8765', 'cspine.db')
+    ('localhost', 8765)
+    >>> parse_address('/tmp/cspine.sock', 'cspine.db')
+    '/tmp/cspine.sock'
+    """
+    if address == "1":
+        return default_socket(db_fname)
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return (host, int(port))
+    return address
+
+
+def _jsonable(row: tuple) -> list:
+    "point row for json: datetimes as sqlite stores them (str), numpy numbers as python"
+    return [str(v) if isinstance(v, datetime.datetime) else
+            v.item() if hasattr(v, 'item') else v for v in row]
+
+
+class AnnotationServer:
+    """
+    owns db_fname. clients send ``{"id": 1, "op": "put", "rows": [...]}``, one per line,
+    and get ``{"id": 1, ...}`` or ``{"id": 1, "error": "..."}`` back in order.
+
+    ops: ping, put, flush, latest_points, label_sets, annotated_images, suggestions, position, stats
+
+    ``put`` is answered once the rows are queued on the server's writer, not committed.
+    Send ``flush`` to wait for them to be committed (:py:meth:`RemoteWriter.flush` does).
+    """
+    def __init__(self, db_fname: os.PathLike, wal: bool = True, flush_interval: float = .3,
+                 batch_size: int = SERVER_BATCH, readers: int = 4):
+        self.db_fname = os.path.realpath(db_fname)
+        self.writer = db.DBWriter(self.db_fname, flush_interval=flush_interval,
+                                  batch_size=batch_size, wal=wal)
+        self.reads = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="cspine-read")
+        self.requests: Counter = Counter()
+        self.clients = 0
+        self.connections: set[asyncio.StreamWriter] = set()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        "one client connection. requests are answered in order"
+        self.clients += 1
+        self.connections.add(writer)
+        try:
+            while line := await reader.readline():
+                request = {}
+                try:
+                    request = json.loads(line)
+                    response = await self.dispatch(request)
+                except Exception as err:
+                    logging.warning("request failed: %s", err)
+                    response = {'error': f"{type(err).__name__}: {err}"}
+                response['id'] = request.get('id')
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # client went away, or the server is stopping
+        finally:
+            self.clients -= 1
+            self.connections.discard(writer)
+            writer.close()
+
+    async def dispatch(self, request: dict) -> dict:
+        op = request['op']
+        self.requests[op] += 1
+        loop = asyncio.get_running_loop()
+        if op == 'ping':
+            return {'db': self.db_fname, 'version': PROTOCOL_VERSION}
+        if op == 'put':
+            rows = [tuple(r) for r in request['rows']]
+            self.writer.put_many(rows)
+            return {'queued': len(rows)}
+        if op == 'flush':
+            # not on self.reads: flushes from many clients shouldn't hold up reads
+            return {'ok': await loop.run_in_executor(None, self.writer.flush)}
+        if op == 'latest_points':
+            latest = await loop.run_in_executor(self.reads, db.latest_points, self.db_fname,
+                                                request['image'], request.get('user'))
+            return {'rows': [dict(r) for r in latest.values()]}
+        if op == 'label_sets':
+            labels, last = await loop.run_in_executor(self.reads, db.label_sets, self.db_fname,
+                                                      request.get('since_rowid', 0))
+            return {'labels': {image: sorted(l) for image, l in labels.items()}, 'last': last}
+        if op == 'annotated_images':
+            images, last = await loop.run_in_executor(self.reads, db.annotated_images, self.db_fname,
+                                                      request.get('since_rowid', 0))
+            return {'images': sorted(images), 'last': last}
+        if op == 'suggestions':
+            rows = await loop.run_in_executor(self.reads, db.suggestions, self.db_fname, request['image'])
+            return {'rows': [dict(r) for r in rows.values()]}
+        if op == 'position':
+            row = await loop.run_in_executor(self.reads, db.position, self.db_fname, request['image'])
+            return {'row': dict(row) if row else None}
+        if op == 'stats':
+            return {**self.writer.stats(), 'clients': self.clients, 'requests': dict(self.requests)}
+        raise ValueError(f"unknown op '{op}'")
+
+    async def serve(self, address: Address):
+        "listen on address (unix socket path or (host, port)) until :py:meth:`stop`"
+        if isinstance(address, tuple):
+            self.server = await asyncio.start_server(self.handle, *address)
+        else:
+            if os.path.exists(address):
+                os.unlink(address)  # left over from a killed server
+            self.server = await asyncio.start_unix_server(self.handle, address)
+        self.loop = asyncio.get_running_loop()
+        logging.info("serving %s on %s", self.db_fname, address)
+        self.ready.set()
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.server.close()
+            for conn in list(self.connections):
+                conn.close()
+            self.writer.close()
+            self.reads.shutdown()
+            if not isinstance(address, tuple) and os.path.exists(address):
+                os.unlink(address)
+            self.stopped.set()
+
+    def start(self, address: Address, timeout: float = 10) -> 'AnnotationServer':
+        "serve on a background thread (tests, benchmarks)"
+        threading.Thread(target=asyncio.run, args=(self.serve(address),),
+                         name="cspine-server", daemon=True).start()
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"server did not start on {address}")
+        return self
+
+    def stop(self, timeout: float = 10):
+        "stop listening and wait until queued rows are committed"
+        if self.server is not None and not self.stopped.is_set():
+            self.loop.call_soon_threadsafe(self.server.close)
+            self.stopped.wait(timeout)
+
+
+class Connection:
+    "blocking request/response over one socket to an :py:class:`AnnotationServer`"
+    def __init__(self, address: Address, timeout: float = 30):
+        if isinstance(address, tuple):
+            self.sock = socket.create_connection(address, timeout)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(address)
+        self.file = self.sock.makefile('rb')
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def request(self, op: str, **args) -> dict:
+        "send op and wait for its answer. raises OSError if the server is gone"
+        with self.lock:
+            self.next_id += 1
+            self.sock.sendall(json.dumps({'id': self.next_id, 'op': op, **args}).encode() + b"\n")
+            line = self.file.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        response = json.loads(line)
+        if 'error' in response:
+            raise ServerError(response['error'])
+        return response
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class RemoteWriter(db.DBWriter):
+    """
+    :py:class:`cspine.db.DBWriter` that sends rows (and reads) to a server.
+    Rows are still batched on a background thread; ``flush`` returns once the
+    server has committed them. If the server can't be reached, falls back to
+    writing and reading db_fname directly for the rest of the session.
+    """
+    def __init__(self, db_fname: os.PathLike, address: Address, **kwargs):
+        self.address = address
+        self.remote = True
+        self.reader: Optional[Connection] = None
+        self.reader_lock = threading.Lock()
+        self.local: Optional[sqlite3.Connection] = None  #: writer thread's connection after falling back
+        super().__init__(db_fname, **kwargs)
+
+    def _fallback(self, err: Exception):
+        if self.remote:
+            logging.warning("annotation server %s unavailable (%s). using %s directly",
+                            self.address, err, self.db_fname)
+        self.remote = False
+
+    def _open(self):
+        try:
+            return Connection(self.address)
+        except OSError as err:
+            self._fallback(err)
+            return super()._open()
+
+    @staticmethod
+    def retryable(err: Exception) -> bool:
+        "server refusals are retried (like a locked db), as are lock timeouts after falling back"
+        return isinstance(err, ServerError) or db.DBWriter.retryable(err)
+
+    def _commit(self, conn, rows: list[tuple]) -> bool:
+        if isinstance(conn, Connection) and self.remote:
+            start = time.perf_counter()
+            try:
+                conn.request('put', rows=[_jsonable(r) for r in rows])
+            except ServerError as err:
+                # server is there but refused the rows: keep them and retry, like a locked db
+                logging.error("annotation server refused %d points: %s", len(rows), err)
+                self.error = err
+                return False
+            except (OSError, ValueError) as err:
+                self._fallback(err)
+            else:
+                self.error = None
+                self.commit_times.append(time.perf_counter() - start)
+                self.rows_written += len(rows)
+                return True
+        if not isinstance(conn, sqlite3.Connection):
+            if self.local is None:
+                self.local = super()._open()
+            conn = self.local
+        return super()._commit(conn, rows)
+
+    def _request(self, op: str, **args) -> Optional[dict]:
+        "read from the server. None if it's gone (then read directly)"
+        if not self.remote:
+            return None
+        try:
+            with self.reader_lock:
+                if self.reader is None:
+                    self.reader = Connection(self.address)
+            return self.reader.request(op, **args)
+        except (OSError, ValueError) as err:
+            self._fallback(err)
+            return None
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        "wait until queued rows are sent, and the server committed them"
+        if not super().flush(timeout):
+            return False
+        res = self._request('flush')
+        return res['ok'] if res else True
+
+    def latest_points(self, image: str, user: Optional[str] = None) -> dict:
+        if (res := self._request('latest_points', image=image, user=user)) is None:
+            return super().latest_points(image, user)
+        return {row['label']: row for row in res['rows']}
+
+    def label_sets(self, since_rowid: int = 0) -> tuple[dict[str, set[str]], int]:
+        if (res := self._request('label_sets', since_rowid=since_rowid)) is None:
+            return super().label_sets(since_rowid)
+        return {image: set(labels) for image, labels in res['labels'].items()}, res['last']
+
+    def annotated_images(self, since_rowid: int = 0) -> tuple[set[str], int]:
+        if (res := self._request('annotated_images', since_rowid=since_rowid)) is None:
+            return super().annotated_images(since_rowid)
+        return set(res['images']), res['last']
+
+    def suggestions(self, image: str) -> dict:
+        if (res := self._request('suggestions', image=image)) is None:
+            return super().suggestions(image)
+        return {row['label']: row for row in res['rows']}
+
+    def position(self, image: str) -> Optional[dict]:
+        if (res := self._request('position', image=image)) is None:
+            return super().position(image)
+        return res['row']
+
+    def _close(self, conn):
+        conn.close()
+        if self.local is not None:
+            self.local.close()
+            self.local = None
+
+    def close(self, timeout: Optional[float] = None):
+        super().close(timeout)
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+def writer(db_fname: os.PathLike, address: str, **kwargs) -> db.DBWriter:
+    """
+    :py:class:`RemoteWriter` if a server for db_fname answers at address,
+    otherwise a plain :py:class:`cspine.db.DBWriter`
+    """
+    addr = parse_address(address, db_fname)
+    try:
+        conn = Connection(addr, timeout=2)
+        info = conn.request('ping')
+        conn.close()
+    except (OSError, ValueError, ServerError) as err:
+        logging.warning("CSPINE_SERVER=%s: no annotation server at %s (%s). writing %s directly",
+                        address, addr, err, db_fname)
+        return db.DBWriter(db_fname, **kwargs)
+    if info['db'] != os.path.realpath(db_fname) or info['version'] != PROTOCOL_VERSION:
+        logging.warning("CSPINE_SERVER=%s: server at %s serves %s (protocol %s), not %s. writing directly",
+                        address, addr, info['db'], info['version'], os.path.realpath(db_fname))
+        return db.DBWriter(db_fname, **kwargs)
+    return RemoteWriter(db_fname, addr, **kwargs)
+
+
+def main(argv=None):
+    "run the server until interrupted"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine server', description='own cspine.db for many GUI clients')
+    parser.add_argument('--db', default=db.DEFAULT_DB, help='sqlite database (default: %(default)s)')
+    parser.add_argument('--listen', default="1",
+                        help='unix socket path or host:port. clients set CSPINE_SERVER to the same '
+                             '(default: a socket named after the db, CSPINE_SERVER=1)')
+    args = parser.parse_args(argv)
+    wal = os.environ.get("CSPINE_DB_WAL", "1") != "0"
+    server = AnnotationServer(args.db, wal=wal)
+    try:
+        asyncio.run(server.serve(parse_address(args.listen, args.db)))
+    except KeyboardInterrupt:
+        logging.info("stopped")
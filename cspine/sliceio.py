@@ -0,0 +1,200 @@
+"""
+Read single slices from NIfTI files without loading the volume.
+
+How a slice is read depends on the file (see :py:func:`open_volume`):
+
+  * ``mmap``          uncompressed ``.nii``: memory map, a slice touches only its pages
+  * ``indexed_gzip``  ``.nii.gz`` with the optional ``indexed_gzip`` package installed.
+                      nibabel keeps the file open and seeks with the gzip index
+  * ``gzip``          ``.nii.gz`` otherwise: decompressed once, on first read.
+                      (gzip can't seek; nibabel would decompress from the start for every slice)
+  * ``memory``        already an array (volume cache hit, preload)
+  * ``dicom``         a DICOM series directory, decoded into memory by :py:mod:`cspine.dicom`
+
+Non-RAS images are reoriented lazily by :py:class:`Reoriented` instead of
+``nib.as_closest_canonical``, which reads the whole volume.
+:py:class:`SliceCache` keeps the last few slices along each axis.
+"""
+import logging
+import os
+from collections import OrderedDict
+from typing import Optional
+
+import nibabel as nib
+import numpy as np
+
+try:
+    import indexed_gzip  # noqa: F401  used by nibabel when installed
+    HAVE_INDEXED_GZIP = True
+except ImportError:
+    HAVE_INDEXED_GZIP = False
+
+#: how StructImg.strategy reads slices. 'cache' is a memory map of a :py:mod:`cspine.volcache` entry
+STRATEGIES = ('memory', 'cache', 'mmap', 'indexed_gzip', 'gzip', 'dicom')
+
+
+class Decompressed:
+    "array like proxy that reads the whole (compressed) volume on first use and keeps it"
+    def __init__(self, dataobj):
+        self.dataobj = dataobj
+        self.shape = tuple(dataobj.shape)
+        self.ndim = len(self.shape)
+        self._array: Optional[np.ndarray] = None
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = np.asanyarray(self.dataobj)
+        return self._array
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    @property
+    def nbytes(self) -> int:
+        "0 until read"
+        return 0 if self._array is None else self._array.nbytes
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+
+class Reoriented:
+    """
+    closest canonical (RAS+) view of an array like without reading it.
+    indexes are translated onto the source axes, only the requested part is read.
+    @param ornt nibabel orientation, as from ``io_orientation(affine)``
+    """
+    def __init__(self, dataobj, ornt: np.ndarray):
+        self.dataobj = dataobj
+        ornt = np.asarray(ornt)
+        #: source axis for each output axis
+        self.src = [int(a) for a in np.argsort(ornt[:, 0])]
+        self.flip = [f == -1 for f in ornt[:, 1]]  # by source axis
+        self.shape = tuple(dataobj.shape[a] for a in self.src)
+        self.ndim = len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.dataobj.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return getattr(self.dataobj, 'nbytes', 0)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        src_key = [slice(None)] * self.ndim
+        after = []  # slices applied once flipped and transposed, for kept output axes
+        kept = []   # output axes not indexed away
+        for k, kk in enumerate(key):
+            a = self.src[k]
+            n = self.dataobj.shape[a]
+            if isinstance(kk, (int, np.integer)):
+                i = int(kk) + n if kk < 0 else int(kk)
+                if not 0 <= i < n:
+                    raise IndexError(f"index {kk} is out of bounds for axis {k} with size {n}")
+                src_key[a] = n - 1 - i if self.flip[a] else i
+            else:
+                kept.append(k)
+                if self.flip[a]:
+                    after.append(kk)  # read all of a flipped axis, slice after flipping
+                else:
+                    src_key[a] = kk
+                    after.append(slice(None))
+        arr = np.asanyarray(self.dataobj[tuple(src_key)])
+        src_kept = [a for a in range(self.ndim) if isinstance(src_key[a], slice)]
+        for pos, a in enumerate(src_kept):
+            if self.flip[a]:
+                arr = np.flip(arr, axis=pos)
+        arr = arr.transpose([src_kept.index(self.src[k]) for k in kept])
+        return arr[tuple(after)]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[(slice(None),) * self.ndim]
+        return arr if dtype is None else arr.astype(dtype)
+
+
+def open_volume(fname: os.PathLike) -> tuple[object, str]:
+    """
+    RAS+ array like for a nifti file (or DICOM series directory), indexed like a numpy array.
+    2D ``P,S,R`` (SPA) images are faked as two identical sagittal slices.
+    :return: (data, strategy) where strategy is one of :py:data:`STRATEGIES` or ``spa2d``
+    """
+    fname = str(fname)
+    if os.path.isdir(fname):
+        from cspine import dicom  # only needs pydicom when used
+        return dicom.open_series(fname), 'dicom'
+    compressed = fname.endswith('.gz')
+    keep_open = compressed and HAVE_INDEXED_GZIP
+    nii = nib.load(fname, keep_file_open=keep_open)
+    dataobj = nii.dataobj
+    if not compressed:
+        strategy = 'mmap'
+        if dataobj.slope == 1 and dataobj.inter == 0:
+            # unscaled read of an uncompressed image is a np.memmap
+            dataobj = dataobj.get_unscaled()
+    elif keep_open:
+        strategy = 'indexed_gzip'
+    else:
+        strategy = 'gzip'
+        dataobj = Decompressed(dataobj)
+
+    orient = nib.orientations.aff2axcodes(nii.affine)
+    if orient == ('R', 'A', 'S'):  # RAS+, LPI in afni?
+        return dataobj, strategy
+    logging.info("orient of %s (%s) not RAS+, trying to fix", fname, orient)
+    # 20250428: SPA cspine is 2D. fake 3D
+    # access like self.data[self.idx_sag, self.zoom_left:right, bottom:self.zoom_top])
+    if len(nii.shape) == 2 and orient == ('P', 'S', 'R'):
+        slice_2d = np.asanyarray(dataobj)
+        return np.broadcast_to(slice_2d, (2, *slice_2d.shape)), 'spa2d'
+    return Reoriented(dataobj, nib.orientations.io_orientation(nii.affine)), strategy
+
+
+class SliceCache:
+    """
+    last few 2D slices read along each axis of a volume.
+    scrolling back and forth or re-rendering a slice (rotation, zoom, window) doesn't read it again.
+    """
+    def __init__(self, data, size: int = 8):
+        self.data = data
+        self.size = size
+        self.slices: dict[int, OrderedDict] = {0: OrderedDict(), 1: OrderedDict(), 2: OrderedDict()}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, axis: int, i: int) -> np.ndarray:
+        "``data[i,:,:]`` for axis 0, ``data[:,i,:]`` for axis 1, ... as a read only array"
+        cache = self.slices[axis]
+        if (arr := cache.get(i)) is not None:
+            cache.move_to_end(i)
+            self.hits += 1
+            return arr
+        self.misses += 1
+        key = [slice(None)] * 3
+        key[axis] = i
+        arr = np.asanyarray(self.data[tuple(key)])
+        if arr.flags.writeable:
+            arr = arr.view()
+            arr.flags.writeable = False
+        cache[i] = arr
+        while len(cache) > self.size:
+            cache.popitem(last=False)
+        return arr
+
+    def sag(self, i: int) -> np.ndarray:
+        return self.get(0, i)
+
+    def cor(self, i: int) -> np.ndarray:
+        return self.get(1, i)
+
+    def clear(self):
+        for cache in self.slices.values():
+            cache.clear()
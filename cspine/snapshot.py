@@ -0,0 +1,136 @@
+"""
+QC pictures of placed points without opening the GUI.
+
+``python -m cspine snapshot --out qc/`` writes, for every image in the db,
+a png with the sagittal slice and the zoom window, and every label's current
+point drawn in its color, like the GUI after "Load from DB". Images are
+drawn in parallel processes; pictures newer than the image's newest point
+are skipped unless ``--force``.
+
+From python, :py:func:`snapshot` returns a PIL image for any
+:py:class:`cspine.StructImg` and :py:class:`cspine.annotations.AnnotationSet`.
+"""
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from cspine import db, export, transform
+from cspine.annotations import AnnotationSet
+from cspine.labels import LINE_COLOR
+
+ZOOM_RADIUS = 5
+
+
+def _dot(draw: ImageDraw.ImageDraw, x, y, r, **opts):
+    draw.ellipse((x - r, y - r, x + r, y + r), **opts)
+
+
+def snapshot(img, points: AnnotationSet, rot: float = 0, title: Optional[str] = None) -> Image.Image:
+    """
+    sagittal slice and zoom window side by side with points drawn on both.
+    centers img on the points like the GUI's load from db.
+    @param img :py:class:`cspine.StructImg`
+    @param rot zoom window rotation
+    """
+    mean_x, _, mean_z = points.mean_xyz()
+    if not np.isnan(mean_z):
+        img.idx_sag = int(mean_z)
+        img.idx_cor = int(mean_x)
+    placed = np.flatnonzero(points.placed())
+    colors = [points.colors[i] for i in placed]
+
+    sag = img.sag_entry()['image'].convert('RGB')
+    draw = ImageDraw.Draw(sag)
+    draw.line((img.idx_cor, 0, img.idx_cor, sag.height), fill=LINE_COLOR)
+    for (x, y), color in zip(points.xyz[placed, :2], colors):
+        _dot(draw, x, y, 1, fill=color)
+
+    entry = img.zoom_entry(rot)
+    img.use_zoom(entry)
+    zoom = entry['image'].convert('RGB')
+    draw = ImageDraw.Draw(zoom)
+    if len(placed):
+        view = transform.ViewTransform.from_img(img, rot)
+        for (x, y), color in zip(view.to_view(points.xyz[placed, :2]), colors):
+            _dot(draw, x, y, ZOOM_RADIUS, fill=color, outline='white')
+
+    top = 14 if title else 0
+    out = Image.new('RGB', (sag.width + zoom.width, top + max(sag.height, zoom.height)))
+    out.paste(sag, (0, top))
+    out.paste(zoom, (sag.width, top))
+    if title:
+        ImageDraw.Draw(out).text((2, 1), title, fill='white')
+    return out
+
+
+def snapshot_name(image: str, out_dir: os.PathLike) -> str:
+    """
+    >>> snapshot_name('/d/NCANDA_S00033/t1.nii.gz', 'qc')
+    'qc/NCANDA_S00033_t1_cspine-latest.png'
+    """
+    return re.sub(r'\.tsv$', '.png', export.output_name(image, out_dir))
+
+
+def _annotations(rows: list[dict]) -> AnnotationSet:
+    "tsv style rows (:py:func:`cspine.export.iter_latest`) as an AnnotationSet"
+    return AnnotationSet.from_rows({'label': r['label'], 'x': r['x'], 'y': r['y'], 'z': r['sag_i'],
+                                    'created': r['timestamp'], 'rating': r['rating'],
+                                    'note': r['note'], 'user': r['user']} for r in rows)
+
+
+def snapshot_image(image: str, rows: list[dict], out_dir: os.PathLike, rot: float = 0,
+                   force: bool = False) -> Optional[str]:
+    """
+    write one image's png. runs in a worker process.
+    :return: file written, None if skipped (up to date)
+    """
+    from cspine.image import StructImg
+    fname = snapshot_name(image, out_dir)
+    if not force and export.up_to_date(fname, rows):
+        return None
+    img = StructImg(image)
+    snapshot(img, _annotations(rows), rot, title=os.path.basename(fname)).save(fname)
+    return fname
+
+
+def snapshot_study(db_fname: os.PathLike, out_dir: os.PathLike, images: Iterable[str] = (),
+                   jobs: Optional[int] = None, rot: float = 0, force: bool = False) -> dict[str, int]:
+    """
+    png for every image in the db (or only images).
+    :param jobs: processes. default cpu count
+    :return: counts of 'written', 'skipped' and 'failed' images
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    only = {os.path.abspath(i) for i in images}
+    counts = {'written': 0, 'skipped': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = {pool.submit(snapshot_image, image, rows, out_dir, rot, force): image
+                   for image, rows in export.iter_latest(db_fname)
+                   if not only or image in only}
+        for job, image in running.items():
+            try:
+                counts['written' if job.result() else 'skipped'] += 1
+            except Exception as err:
+                logging.warning("no snapshot for %s: %s", image, err)
+                counts['failed'] += 1
+    return counts
+
+
+def main(argv=None):
+    "write qc pngs of current annotations"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine snapshot', description='draw current points on each image')
+    parser.add_argument('images', nargs='*', help='only these images (default: all in db)')
+    parser.add_argument('--db', default=db.DEFAULT_DB, help='sqlite database (default: %(default)s)')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--jobs', type=int, default=None, help='processes (default: cpu count)')
+    parser.add_argument('--rot', type=float, default=0, help='zoom window rotation')
+    parser.add_argument('--force', action='store_true', help='redraw up to date pngs')
+    args = parser.parse_args(argv)
+    counts = snapshot_study(args.db, args.out, args.images, jobs=args.jobs, rot=args.rot, force=args.force)
+    logging.info("wrote %(written)d, %(skipped)d already up to date, %(failed)d failed", counts)
@@ -0,0 +1,279 @@
+"""
+Suggested points for images nobody has clicked yet, so raters only correct them.
+
+Annotated images in the db are templates. For a new image, the region of
+each template's sagittal slice around its points is found in the new
+sagittal slice with normalized cross-correlation
+(:py:func:`cv2.matchTemplate`) near where it was: a shift. The best
+templates' points are moved by their shift, then every label is refined by
+matching a small patch from around the template's point within a few
+pixels. A label's suggestion is the median over those templates.
+
+Matching is on the full resolution, unrotated sagittal slice: the zoom
+window (:py:meth:`cspine.StructImg.sag_zoom_matrix`) is only that slice
+cropped and enlarged, and suggestions are stored in the same brain
+coordinates as clicks so the GUI maps them with the same view transform.
+
+``python -m cspine suggest 'data/*/t1.nii.gz'`` runs ahead of time in a
+process pool, skipping images that already have points or suggestions.
+Images are matched on their estimated mid-sagittal slice (``python -m cspine
+position``, run that first), or on the middle of the volume.
+Results go to the db's ``suggestion`` table, never ``point``: the GUI draws
+them as hollow markers that are dragged into place (or accepted as is from
+the File menu), and only then saved as clicks.
+"""
+import datetime
+import functools
+import logging
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from cspine import db, discover, export
+from cspine.labels import LABELS
+
+#: templates used for each image: the most recently annotated
+DEFAULT_TEMPLATES = 20
+#: templates whose points are combined (median) for a suggestion
+DEFAULT_BEST = 3
+#: images with fewer labels placed aren't used as templates
+MIN_LABELS = len(LABELS) // 2
+MARGIN = 16       #: pixels around a template's points matched against a new image
+MAX_SHIFT = 40    #: furthest (pixels) a template's region is looked for from where it was
+PATCH = 10        #: half size of the patch around each point used to refine it
+REFINE = 6        #: furthest (pixels) a point moves when refined
+
+
+class Template(NamedTuple):
+    "an annotated image's sagittal slice around its points"
+    image: str
+    z: int
+    region: np.ndarray  #: float32 crop of the slice around all points
+    origin: tuple       #: (x, y) of region[0, 0] in the slice
+    xy: np.ndarray      #: (len(LABELS), 2) points, NaN if not placed
+    patches: list       #: per label: (patch, (x, y) of the point in the patch) or None
+
+
+def sagittal(img, z: int) -> np.ndarray:
+    "sagittal slice as shown (rotated like :py:meth:`cspine.StructImg.sag_entry`), float32"
+    return np.ascontiguousarray(np.rot90(img.slices.sag(z)), dtype=np.float32)
+
+
+def _crop(slice_: np.ndarray, x0, y0, x1, y1) -> tuple[np.ndarray, tuple]:
+    "slice_[y0:y1, x0:x1] clipped to the slice. :return: (crop, (x, y) of its corner)"
+    h, w = slice_.shape
+    x0, y0 = max(int(x0), 0), max(int(y0), 0)
+    x1, y1 = min(int(x1), w), min(int(y1), h)
+    return slice_[y0:y1, x0:x1], (x0, y0)
+
+
+def make_template(image: str, rows: list[dict]) -> Optional[Template]:
+    """
+    template from an image's current points (:py:func:`cspine.export.iter_latest` rows).
+    runs in a worker process. None if too few points
+    """
+    from cspine.image import StructImg
+    xy = np.full((len(LABELS), 2), np.nan)
+    zs = []
+    for r in rows:
+        if r['label'] in LABELS and r['x'] and r['y']:
+            xy[LABELS.index(r['label'])] = (r['x'], r['y'])
+            zs.append(r['sag_i'])
+    if len(zs) < MIN_LABELS:
+        return None
+    img = StructImg(image)
+    z = int(np.median(zs))
+    full = sagittal(img, z)
+    lo, hi = np.nanmin(xy, axis=0) - MARGIN, np.nanmax(xy, axis=0) + MARGIN
+    region, origin = _crop(full, *lo, *hi)
+    patches = []
+    for x, y in xy:
+        if np.isnan(x):
+            patches.append(None)
+            continue
+        patch, (px, py) = _crop(full, x - PATCH, y - PATCH, x + PATCH + 1, y + PATCH + 1)
+        patches.append((patch.copy(), (x - px, y - py)))
+    return Template(img.fname, z, region.copy(), origin, xy, patches)
+
+
+def _match(window: np.ndarray, template: np.ndarray) -> tuple[float, tuple[int, int]]:
+    "best normalized cross-correlation of template in window. :return: (score, (x, y) of its corner)"
+    import cv2
+    if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+        return -1.0, (0, 0)
+    res = np.nan_to_num(cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED), nan=-1)
+    _, score, _, corner = cv2.minMaxLoc(res)
+    return float(score), corner
+
+
+def _window(full: np.ndarray, x0: int, y0: int, x1: int, y1: int, fill: float) -> np.ndarray:
+    "full[y0:y1, x0:x1], with fill where that's off the slice (so points near an edge can move past it)"
+    h, w = full.shape
+    out = np.full((y1 - y0, x1 - x0), fill, dtype=full.dtype)
+    sx0, sy0, sx1, sy1 = max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+    if sx1 > sx0 and sy1 > sy0:
+        out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = full[sy0:sy1, sx0:sx1]
+    return out
+
+
+def find_shift(full: np.ndarray, template: Template, max_shift: int = MAX_SHIFT,
+               fill: Optional[float] = None) -> tuple[float, np.ndarray]:
+    """
+    where template's region is in full, at most max_shift from where it was.
+    :param fill: value off the slice. default its median
+    :return: (score, (dx, dy))
+    """
+    fill = np.median(full) if fill is None else fill
+    x0, y0 = template.origin
+    h, w = template.region.shape
+    window = _window(full, x0 - max_shift, y0 - max_shift, x0 + w + max_shift, y0 + h + max_shift, fill)
+    score, (bx, by) = _match(window, template.region)
+    return score, np.array([bx - max_shift, by - max_shift], dtype=float)
+
+
+def refine(full: np.ndarray, template: Template, guess: np.ndarray, radius: int = REFINE,
+           fill: Optional[float] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    move each guessed point to where its template patch matches best, within radius.
+    :return: (points (n, 2), scores (n,)). NaN for labels the template doesn't have
+    """
+    fill = np.median(full) if fill is None else fill
+    xy = np.full_like(guess, np.nan)
+    scores = np.full(len(guess), np.nan)
+    for i, (patch_offset, (gx, gy)) in enumerate(zip(template.patches, guess)):
+        if patch_offset is None:
+            continue
+        patch, (ox, oy) = patch_offset
+        # patch corner where the point lands on the guess, +- radius
+        cx, cy = round(gx - ox) - radius, round(gy - oy) - radius
+        window = _window(full, cx, cy, cx + 2*radius + patch.shape[1], cy + 2*radius + patch.shape[0], fill)
+        score, (bx, by) = _match(window, patch)
+        if score < 0:  # no better than chance: keep the shifted point
+            xy[i] = gx, gy
+            scores[i] = 0
+            continue
+        xy[i] = cx + bx + ox, cy + by + oy
+        scores[i] = score
+    return xy, scores
+
+
+def suggest_points(full: np.ndarray, templates: list[Template],
+                   n_best: int = DEFAULT_BEST) -> tuple[np.ndarray, np.ndarray, list[Template]]:
+    """
+    points for a sagittal slice from the n_best templates matching it.
+    :return: (points (len(LABELS), 2), scores, templates used best first). NaN where no template has a label
+    """
+    if not templates:
+        raise ValueError("no templates")
+    fill = np.median(full)
+    matched = sorted(((find_shift(full, t, fill=fill), t) for t in templates), key=lambda m: -m[0][0])[:n_best]
+    refined = [refine(full, t, t.xy + shift, fill=fill) for (_, shift), t in matched]
+    points = np.stack([xy for xy, _ in refined])
+    scores = np.stack([s for _, s in refined])
+    with warnings.catch_warnings():
+        # all-NaN columns: labels no template has
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(points, axis=0), np.nanmean(scores, axis=0), [t for _, t in matched]
+
+
+def suggest_image(image: str, templates: list[Template], z: Optional[int] = None,
+                  n_best: int = DEFAULT_BEST) -> list[tuple]:
+    """
+    suggestions for one image. runs in a worker process.
+    :param z: sagittal slice, e.g. the :py:mod:`cspine.position` estimate.
+              default the image's initial ``idx_sag`` (middle of the volume)
+    :return: rows ordered like :py:data:`cspine.db.SUGGESTION_COLUMNS`
+    """
+    from cspine.image import StructImg
+    img = StructImg(image)
+    z = img.idx_sag if z is None else z
+    points, scores, used = suggest_points(sagittal(img, z), templates, n_best)
+    now = datetime.datetime.now()
+    return [(img.fname, label, now, round(float(x), 2), round(float(y), 2), int(z),
+             round(float(score), 3), used[0].image)
+            for label, (x, y), score in zip(LABELS, points, scores) if not np.isnan(x)]
+
+
+def load_templates(db_fname: os.PathLike, n: int = DEFAULT_TEMPLATES,
+                   pool: Optional[ProcessPoolExecutor] = None) -> list[Template]:
+    "templates from the n most recently annotated images with enough points"
+    candidates = [(max(str(r['timestamp']) for r in rows), image, rows)
+                  for image, rows in export.iter_latest(db_fname)
+                  if sum(1 for r in rows if r['label'] in LABELS) >= MIN_LABELS]
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    chosen = [(image, functools.partial(make_template, image, rows)) for _, image, rows in candidates[:n]]
+    if pool:
+        chosen = [(image, pool.submit(make).result) for image, make in chosen]
+    templates = []
+    for image, get in chosen:
+        try:
+            template = get()
+        except Exception as err:
+            logging.warning("not using %s as a template: %s", image, err)
+            continue
+        if template is not None:
+            templates.append(template)
+    return templates
+
+
+def suggest_study(db_fname: os.PathLike, images: Iterable[str], jobs: Optional[int] = None,
+                  n_templates: int = DEFAULT_TEMPLATES, n_best: int = DEFAULT_BEST,
+                  force: bool = False) -> dict[str, int]:
+    """
+    store suggestions for images without points (or suggestions, unless force).
+    :param jobs: processes. default cpu count
+    :return: counts of 'suggested', 'skipped' and 'failed' images
+    """
+    images = list(dict.fromkeys(os.path.abspath(i) for i in images))
+    counts = {'suggested': 0, 'skipped': 0, 'failed': 0}
+    db.connect(db_fname).close()  # tables for the lookups below
+    done, _ = db.annotated_images(db_fname)
+    if not force:
+        done |= db.suggested_images(db_fname)
+    todo = [i for i in images if i not in done]
+    counts['skipped'] = len(images) - len(todo)
+    if not todo:
+        return counts
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        templates = load_templates(db_fname, n_templates, pool)
+        if not templates:
+            raise ValueError(f"no image in {db_fname} has {MIN_LABELS} points to use as a template")
+        logging.info("suggesting points for %d images from %d templates", len(todo), len(templates))
+        # match on the estimated mid-sagittal slice where there is one
+        slices = {image: pos['sag'] if (pos := db.position(db_fname, image)) else None for image in todo}
+        running = {pool.submit(suggest_image, image, templates, slices[image], n_best): image
+                   for image in todo}
+        for job, image in running.items():
+            try:
+                rows = job.result()
+            except Exception as err:
+                logging.warning("no suggestions for %s: %s", image, err)
+                counts['failed'] += 1
+                continue
+            db.save_suggestions(db_fname, rows)
+            counts['suggested'] += 1
+    return counts
+
+
+def main(argv=None):
+    "precompute suggested points"
+    import argparse
+    parser = argparse.ArgumentParser(prog='cspine suggest',
+                                     description='place points on new images from annotated ones')
+    parser.add_argument('images', nargs='*', help='images, or quoted glob patterns')
+    parser.add_argument('--list', action='append', default=[], help='text file with one image per line')
+    parser.add_argument('--db', default=db.DEFAULT_DB, help='sqlite database (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=None, help='processes (default: cpu count)')
+    parser.add_argument('--templates', type=int, default=DEFAULT_TEMPLATES,
+                        help='annotated images to match against (default: %(default)s)')
+    parser.add_argument('--best', type=int, default=DEFAULT_BEST,
+                        help='best matching templates combined (default: %(default)s)')
+    parser.add_argument('--force', action='store_true', help='replace existing suggestions')
+    args = parser.parse_args(argv)
+    images = discover.expand_inputs(args.images, args.list)
+    counts = suggest_study(args.db, images, jobs=args.jobs, n_templates=args.templates,
+                           n_best=args.best, force=args.force)
+    logging.info("suggested %(suggested)d, %(skipped)d already done, %(failed)d failed", counts)
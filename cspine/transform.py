@@ -0,0 +1,156 @@
+"""
+Mapping between brain (full sagittal slice) and zoom window coordinates.
+
+A view is the rotation (around ``(0, h)``, like :py:func:`cspine.affine`),
+the crop of the zoom window (``zoom_left``, bottom aligned) and the zoom
+factor. :py:class:`ViewTransform` composes those into one 3x3 matrix,
+cached per view, and maps any number of points with one matrix product.
+:py:func:`zoom` renders the zoom window with lookup tables cached the same way.
+"""
+import functools
+from typing import NamedTuple
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=256)
+def _rotation(rot: float, h: float) -> np.ndarray:
+    "3x3 homogeneous rotation. cached: do not modify"
+    # same as cv2.getRotationMatrix2D((0, h), rot, 1), without importing cv2
+    a, b = np.cos(np.deg2rad(rot)), np.sin(np.deg2rad(rot))
+    M = np.array([[a, b, -b * h],
+                  [-b, a, (1 - a) * h],
+                  [0, 0, 1]])
+    M.flags.writeable = False
+    return M
+
+
+def rotation(rot: float, h: float = 0, inverse: bool = False) -> np.ndarray:
+    """
+    2x3 rotation matrix like ``cv2.getRotationMatrix2D((0, h), rot, 1)``
+    @param inverse rotate the other way
+    """
+    if inverse:
+        rot = -1 * rot
+    return _rotation(float(rot), float(h))[:2].copy()
+
+
+def apply(M: np.ndarray, pts) -> np.ndarray:
+    """
+    transform points.
+    @param M 2x3 or 3x3 affine matrix
+    @param pts Nx2 x,y points (or one x,y pair)
+    @returns Nx2 (or 2) transformed points
+
+    >>> apply(np.eye(3), [[1, 2], [3, 4]]).tolist()
+    [[1.0, 2.0], [3.0, 4.0]]
+    """
+    pts = np.asarray(pts, dtype=float)
+    flat = pts.ndim == 1
+    pts = np.atleast_2d(pts)
+    res = pts @ M[:2, :2].T + M[:2, 2]
+    return res[0] if flat else res
+
+
+class ViewTransform(NamedTuple):
+    """
+    zoom window view state. build with :py:meth:`from_img`.
+    @param rot rotation in degrees (``App.zoom_rot``)
+    @param h rotation center y. ``crop_size[1]`` in the GUI
+    @param zoom_left first column of the full slice in the zoom window
+    @param zoom_fac zoom scale
+    @param depth full slice height (``pixdim[2]``)
+    @param crop_h zoom window height (``crop_size[1]``)
+    """
+    rot: float
+    h: float
+    zoom_left: float
+    zoom_fac: float
+    depth: float
+    crop_h: float
+
+    @classmethod
+    def from_img(cls, img, rot: float) -> "ViewTransform":
+        "view of a :py:class:`cspine.StructImg` after its zoom is rendered"
+        return cls(float(rot), float(img.crop_size[1]), float(img.zoom_left),
+                   float(img.zoom_fac), float(img.pixdim[2]), float(img.crop_size[1]))
+
+    @property
+    def matrix(self) -> np.ndarray:
+        "3x3 brain to zoom window"
+        return _view_matrix(self)
+
+    @property
+    def inverse(self) -> np.ndarray:
+        "3x3 zoom window to brain"
+        return _view_inverse(self)
+
+    def to_view(self, pts) -> np.ndarray:
+        "brain x,y (Nx2) to zoom window pixels"
+        return apply(self.matrix, pts)
+
+    def to_brain(self, pts, decimals: int = 2) -> np.ndarray:
+        "zoom window pixels (Nx2) to brain x,y, rounded like stored points"
+        return np.round(apply(self.inverse, pts), decimals)
+
+
+@functools.lru_cache(maxsize=64)
+def _view_matrix(view: ViewTransform) -> np.ndarray:
+    # point_onto_zoom: x=(x - left)*fac; y=(y - depth)*fac + crop_h
+    f = view.zoom_fac
+    zoom = np.array([[f, 0, -view.zoom_left * f],
+                     [0, f, -view.depth * f + view.crop_h],
+                     [0, 0, 1]])
+    M = zoom @ _rotation(view.rot, view.h)
+    M.flags.writeable = False
+    return M
+
+
+@functools.lru_cache(maxsize=64)
+def _view_inverse(view: ViewTransform) -> np.ndarray:
+    M = np.linalg.inv(_view_matrix(view))
+    M.flags.writeable = False
+    return M
+
+
+@functools.lru_cache(maxsize=32)
+def zoom_maps(rot: float, h: float, left: int, top: int, width: int,
+              fac: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :py:func:`cv2.remap` tables for the zoom window, cached per view.
+    Samples the same positions as rotating the whole slice (around ``(0, h)``),
+    cropping ``width`` columns from ``left`` and the bottom ``top`` rows,
+    then a nearest neighbor resize by ``fac``, but only output pixels are computed.
+    Unrotated, the pixels are identical. Rotated, both cv2 paths interpolate
+    at 1/32 pixel but round positions differently: float slices agree to
+    float precision, integer ones differ on a few percent of pixels by up to
+    1/32 of the step between neighboring voxels (e.g. at most 1 for uint8).
+    :return: x and y float32 maps. cached: do not modify
+    """
+    # output pixel -> crop pixel (nearest resize) -> rotated slice -> unrotated slice
+    cols = np.arange(width * fac) // fac + left
+    rows = np.arange(top * fac) // fac + (h - top)
+    x, y = np.meshgrid(cols.astype(np.float64), rows.astype(np.float64))
+    M = _rotation(-rot, h)
+    map_x = (M[0, 0] * x + M[0, 1] * y + M[0, 2]).astype(np.float32)
+    map_y = (M[1, 0] * x + M[1, 1] * y + M[1, 2]).astype(np.float32)
+    # float maps: fixed point (cv2.convertMaps) is a little faster but off by up to 1/32 pixel
+    map_x.flags.writeable = False
+    map_y.flags.writeable = False
+    return map_x, map_y
+
+
+def zoom(full_slice: np.ndarray, rot: float, left: int, top: int, width: int,
+         fac: int) -> np.ndarray:
+    """
+    rotated, cropped and enlarged zoom window of full_slice in one :py:func:`cv2.remap`.
+    @param left first column. crop is ``width`` columns (fewer at the right edge) of the bottom ``top`` rows
+    """
+    import cv2
+    h, w = full_slice.shape
+    width = min(left + width, w) - left
+    if full_slice.dtype.kind in 'iu' and full_slice.dtype not in (np.uint8, np.int16, np.uint16):
+        full_slice = full_slice.astype(np.float32)  # remap can't read 32/64 bit ints
+    map1, map2 = zoom_maps(float(rot), float(h), int(left), int(top), int(width), int(fac))
+    return cv2.remap(full_slice, map1, map2, cv2.INTER_LINEAR,
+                     borderMode=cv2.BORDER_CONSTANT, borderValue=0)
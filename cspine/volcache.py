@@ -0,0 +1,167 @@
+"""
+On disk cache of decoded volumes.
+
+Gunzipping and reorienting a nifti every time an image is opened is slow.
+:py:class:`VolumeCache` stores the RAS+ array :py:class:`cspine.StructImg` ends up
+with as an uncompressed ``.npy`` (memory mapped when read back) next to a small
+``.json`` of settings (intensity window, zoom defaults).
+
+Entries are keyed on absolute path, modification time and size,
+so an edited or replaced image is never served stale.
+Least recently used entries are removed when the cache grows past ``max_bytes``.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import os.path
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+
+class VolumeCache:
+    def __init__(self, cache_dir: os.PathLike, max_bytes: float = 20e9):
+        """
+        :param cache_dir: where to put .npy/.json pairs. created if missing
+        :param max_bytes: total size of .npy files before old entries are evicted
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, fname: os.PathLike) -> str:
+        """
+        content key for fname: hash of path, mtime and size.
+        for a directory (DICOM series), of every file's name, mtime and size
+        """
+        fname = os.path.abspath(fname)
+        if os.path.isdir(fname):
+            ident = fname + "".join(f":{e.name}:{e.stat().st_mtime_ns}:{e.stat().st_size}"
+                                    for e in sorted(os.scandir(fname), key=lambda e: e.name)
+                                    if e.is_file())
+        else:
+            st = os.stat(fname)
+            ident = f"{fname}:{st.st_mtime_ns}:{st.st_size}"
+        return hashlib.sha1(ident.encode()).hexdigest()
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        base = os.path.join(self.cache_dir, key)
+        return base + ".npy", base + ".json"
+
+    def load(self, fname: os.PathLike) -> Optional[tuple[np.ndarray, dict]]:
+        """
+        read only memory mapped array and settings for fname.
+        :return: None if not cached (or cache entry is broken)
+        """
+        npy, meta = self._paths(self.key(fname))
+        try:
+            with open(meta) as f:
+                settings = json.load(f)
+            data = np.load(npy, mmap_mode='r')
+        except (OSError, ValueError) as err:
+            if not isinstance(err, FileNotFoundError):
+                logging.warning("bad cache entry for %s: %s", fname, err)
+            return None
+        # mark as recently used for eviction. a read-only shared cache is still usable
+        try:
+            os.utime(meta)
+        except OSError:
+            pass
+        logging.debug("volume cache hit for %s", fname)
+        return data, settings
+
+    def store(self, fname: os.PathLike, data: np.ndarray, settings: dict):
+        """
+        save data and settings for fname. replaces any existing entry.
+        written to a temporary file first so readers never see a partial .npy
+        """
+        npy, meta = self._paths(self.key(fname))
+        self._atomic_write(npy, lambda f: np.save(f, np.asanyarray(data)))
+        self.update(fname, **settings)
+        self.evict()
+
+    def update(self, fname: os.PathLike, **settings):
+        "merge settings into the .json for fname (e.g. after recomputing the window)"
+        _, meta = self._paths(self.key(fname))
+        current = {}
+        if os.path.exists(meta):
+            with open(meta) as f:
+                current = json.load(f)
+        current.update(settings)
+        current['fname'] = os.path.abspath(fname)
+        self._atomic_write(meta, lambda f: f.write(json.dumps(current).encode()))
+
+    def _atomic_write(self, dest: str, write):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, dest)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def size(self) -> int:
+        "total bytes of cached arrays"
+        return sum(e[2] for e in self._entries())
+
+    def _entries(self) -> list[tuple[float, str, int]]:
+        "(last used, key, bytes) for each complete entry"
+        entries = []
+        for dirent in os.scandir(self.cache_dir):
+            if not dirent.name.endswith(".npy"):
+                continue
+            key = dirent.name[:-4]
+            _, meta = self._paths(key)
+            try:
+                used = os.stat(meta).st_mtime
+                entries.append((used, key, dirent.stat().st_size))
+            except FileNotFoundError:
+                # orphaned or being written
+                continue
+        return entries
+
+    def evict(self):
+        "remove least recently used entries until under max_bytes"
+        entries = sorted(self._entries())
+        total = sum(e[2] for e in entries)
+        for _, key, nbytes in entries:
+            if total <= self.max_bytes:
+                break
+            logging.debug("evicting %s from volume cache", key)
+            for path in self._paths(key):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= nbytes
+
+
+@functools.lru_cache(maxsize=None)
+def default_cache() -> Optional[VolumeCache]:
+    """
+    cache configured by environment. None (no caching) unless ``CSPINE_CACHE`` is set.
+    ``CSPINE_CACHE`` directory for cached volumes.
+    ``CSPINE_CACHE_GB`` size limit (default 20).
+    """
+    cache_dir = os.environ.get("CSPINE_CACHE")
+    if not cache_dir:
+        return None
+    max_gb = float(os.environ.get("CSPINE_CACHE_GB", 20))
+    return VolumeCache(os.path.expanduser(cache_dir), max_bytes=max_gb * 1e9)
+
+
+@functools.lru_cache(maxsize=None)
+def series_cache() -> VolumeCache:
+    """
+    cache for DICOM series when ``CSPINE_CACHE`` is not set: decoding a series
+    is too slow to repeat on every open. ``~/.cache/cspine/volumes``,
+    ``CSPINE_CACHE_GB`` size limit (default 20).
+    """
+    cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                             "cspine", "volumes")
+    max_gb = float(os.environ.get("CSPINE_CACHE_GB", 20))
+    return VolumeCache(cache_dir, max_bytes=max_gb * 1e9)
@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 # build and cache list so we don't have to wait for slow filesystem access
 # 20250611WF - init
+# 01_run-cspine-habit.bash no longer needs this (pattern given directly), but list is still handy
 cd "$(dirname "$0")" || exit 1
-ls /Volumes/Hera/Projects/Habit/mr/BIDS/sub-*/ses-*/anat/sub-*_ses-*_T1w.nii.gz > habit_filelist.txt
+../main.py discover '/Volumes/Hera/Projects/Habit/mr/BIDS/sub-*/ses-*/anat/sub-*_ses-*_T1w.nii.gz' > habit_filelist.txt
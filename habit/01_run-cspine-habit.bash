@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
 # 20250210WF - init
-#
+# quoted pattern: expanded by cspine (directory listings cached between runs), not the shell
 cd $(dirname "$0")
-../main.py $(cat habit_filelist.txt )
+../main.py '/Volumes/Hera/Projects/Habit/mr/BIDS/sub-*/ses-*/anat/sub-*_ses-*_T1w.nii.gz'
@@ -0,0 +1,12 @@
+"""
+helpers shared by the tests. ``from conftest import write_nii``
+"""
+import nibabel as nib
+import numpy as np
+
+
+def write_nii(fname, data, affine=np.eye(4)) -> str:
+    "save data as a nifti image. :return: fname as a str, like images are given to StructImg and the db"
+    fname = str(fname)
+    nib.save(nib.Nifti1Image(data, affine), fname)
+    return fname
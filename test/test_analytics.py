@@ -0,0 +1,102 @@
+from cspine import analytics, db
+import datetime
+import io
+import numpy as np
+import pytest
+
+T0 = datetime.datetime(2025, 1, 1)
+IMG = '/Volumes/Hera/Projects/Habit/sub-{}/T1w.nii.gz'
+
+
+def add(db_fname, rows):
+    writer = db.DBWriter(db_fname)
+    for i, (image, user, label, x, y, z) in enumerate(rows):
+        writer.put((image, user, label, T0 + datetime.timedelta(seconds=i), x, y, z, 'NA', ''))
+    writer.close()
+
+
+def tsv(rows):
+    out = io.StringIO()
+    analytics.write_tsv(rows, out)
+    return out.getvalue()
+
+
+@pytest.fixture
+def db_fname(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    rows = []
+    for i in range(4):
+        for user, dx in (('a', 0), ('b', 3), ('c', 4)):
+            rows.append((IMG.format(i), user, 'C2m', 10 + dx, 20, 30))
+    # d is far off on one image, a reclicked
+    rows += [(IMG.format(0), 'd', 'C2m', 100, 20, 30),
+             (IMG.format(0), 'a', 'top', 0, 0, 0), (IMG.format(0), 'a', 'top', 0, 6, 8),
+             (IMG.format(0), 'a', 'C2m', None, None, None)]
+    add(db_fname, rows)
+    return db_fname
+
+
+def test_rater_points(db_fname):
+    raters = analytics.rater_points(analytics.read_points(db_fname, chunk_size=5))
+    assert len(raters['image']) == 4 * 3 + 2
+    top = raters['label'] == 'top'
+    assert raters['n_clicks'][top] == [2]
+    assert raters['drift'][top] == [10]
+    assert raters['y'][top] == [6]
+    assert raters['spread'][top] == [5]
+
+
+def test_agreement(db_fname):
+    raters = analytics.Analysis()
+    raters.update(db_fname)
+    pairs = analytics.pairwise(raters.raters)
+    # 3 pairs on 3 images, 6 with d
+    assert len(pairs['distance']) == 3 * 3 + 6
+    assert sorted(set(np.round(pairs['distance'], 3)))[:3] == [1, 3, 4]
+    flagged = analytics.outliers(raters.raters)
+    assert set(flagged['user'][flagged['outlier']]) == {'d'}
+
+    summary = {r['label']: r for r in analytics.summarize(raters.raters)}
+    assert summary['C2m']['images'] == 4
+    assert summary['C2m']['pairs'] == 15
+    assert summary['C2m']['outliers'] == 1
+    assert summary['top']['multi_rater_images'] == 0
+    assert summary['top']['reclicked'] == 1
+    assert summary['top']['mean_drift'] == 10
+    by_dataset = analytics.summarize(raters.raters, by_dataset=True)
+    assert {r['dataset'] for r in by_dataset} == {'habit'}
+
+
+def test_incremental(db_fname, tmp_path):
+    state = tmp_path / "state.npz"
+    first = analytics.Analysis()
+    assert len(first.update(db_fname)) == 4
+    first.save(state)
+    before = analytics.summarize(first.raters)
+
+    again = analytics.Analysis.load(state)
+    assert again.update(db_fname) == set()
+    add(db_fname, [(IMG.format(1), 'b', 'C2m', 50, 20, 30), (IMG.format(9), 'a', 'C2m', 1, 2, 3)])
+    assert again.update(db_fname) == {IMG.format(1), IMG.format(9)}
+
+    full = analytics.Analysis()
+    full.update(db_fname)
+    assert tsv(analytics.summarize(again.raters)) == tsv(analytics.summarize(full.raters)) != tsv(before)
+
+
+def test_main(db_fname, tmp_path):
+    out, flagged = tmp_path / "summary.tsv", tmp_path / "outliers.tsv"
+    analytics.main(['--db', db_fname, '--state', str(tmp_path / "s.npz"),
+                    '--out', str(out), '--outliers', str(flagged)])
+    lines = open(out).read().splitlines()
+    assert lines[0].split("\t")[:3] == ['label', 'images', 'multi_rater_images']
+    assert len(lines) == 3
+    assert len(open(flagged).read().splitlines()) == 2
+
+
+def test_missing_db(tmp_path):
+    "a mistyped --db is an error, not zero rows (or a new empty db)"
+    missing = tmp_path / "typo.db"
+    with pytest.raises(FileNotFoundError):
+        analytics.Analysis().update(missing)
+    assert not missing.exists()
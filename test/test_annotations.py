@@ -0,0 +1,48 @@
+from cspine import db
+from cspine.annotations import AnnotationSet
+from cspine.labels import LABELS
+import numpy as np
+
+
+def test_pointref_like_cspinepoint():
+    aset = AnnotationSet(user='rater')
+    point = aset['C2m']
+    assert point.x is None and point.z is None
+    assert point.rating == "NA"
+    point.update(10, 20, 5)
+    point.rating = 'good'
+    assert (point.x, point.y, point.z) == (10.0, 20.0, 5)
+    assert aset['C2m'].rating == 'good'
+    assert point.timestamp is not None
+    assert point.todict()['sag_i'] == 5
+    assert len(aset.todicts()) == len(LABELS)
+
+
+def test_update_many_and_mean():
+    aset = AnnotationSet()
+    aset.update_many(['C2m', 'top'], [(1, 2, 10), (3, 4, 20)], rating='ok')
+    assert aset.placed().sum() == 2
+    assert aset.mean_xyz().tolist() == [2.0, 3.0, 15.0]
+    assert list(aset.rating[aset.index(['C2m', 'top'])]) == ['ok', 'ok']
+    assert np.isnan(AnnotationSet().mean_xyz()).all()
+
+
+def test_rows_roundtrip(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    aset = AnnotationSet(user='rater')
+    aset['C2m'].update(1.5, 2, 3)
+    aset['top'].update(4, 5, 3)
+    rows = aset.rows('img.nii.gz')
+    assert len(rows) == 2
+    assert len(rows[0]) == len(db.POINT_COLUMNS)
+
+    writer = db.DBWriter(db_fname, flush_interval=60)
+    writer.put_many(rows)
+    assert writer.flush(timeout=5)
+    assert writer.stats()['commits'] == 1
+    writer.close()
+
+    loaded = AnnotationSet.from_rows(db.latest_points(db_fname, 'img.nii.gz').values())
+    assert loaded['C2m'].x == 1.5
+    assert loaded['top'].user == 'rater'
+    assert loaded.placed().sum() == 2
@@ -0,0 +1,33 @@
+from cspine import bench
+import json
+
+
+def test_bench_runs(tmp_path, capsys):
+    out = tmp_path / "bench.json"
+    bench.main(['--shape', '20', '30', '40', '--rows', '200', '--repeat', '1', '--out', str(out)])
+    res = json.load(open(out))
+    assert {'load', 'zoom_rot', 'save_db', 'latest_points_200', 'import_cspine.gui'} <= set(res['results'])
+    assert res['results']['load']['median'] > 0
+    # compare to itself: nothing regressed
+    bench.main(['--shape', '20', '30', '40', '--only', 'image', '--repeat', '1',
+                '--compare', str(out), '--threshold', '1000'])
+    assert 'REGRESSED' not in capsys.readouterr().out
+
+
+def test_compare():
+    base = {'results': {'a': {'median': 1.0}, 'b': {'median': 1.0}}}
+    cur = {'results': {'a': {'median': 1.1}, 'b': {'median': 2.0}, 'new': {'median': 1}}}
+    report = {r['case']: r for r in bench.compare(cur, base, threshold=1.25)}
+    assert set(report) == {'a', 'b'}
+    assert not report['a']['regressed']
+    assert report['b']['regressed']
+
+
+def test_light_imports():
+    "db and export scripts don't load the GUI or OpenCV"
+    import subprocess, sys
+    code = ("import sys, cspine, cspine.db, cspine.export; "
+            "print(' '.join(m for m in ('tkinter', 'cv2', 'nibabel') if m in sys.modules))")
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    assert out.stdout.strip() == ''
+    assert bench.import_time('cspine.db') > 0
@@ -0,0 +1,78 @@
+import cspine
+
+
+class FakeCanvas:
+    "records canvas calls instead of drawing"
+    def __init__(self):
+        self.calls = []
+        self.n = 0
+
+    def _create(self, kind):
+        def create(*coords, **opts):
+            self.n += 1
+            self.calls.append(('create', kind, coords))
+            return self.n
+        return create
+
+    def __getattr__(self, name):
+        if name.startswith('create_'):
+            return self._create(name[7:])
+        return lambda *a, **kw: self.calls.append((name, a, kw))
+
+
+class FakePhoto:
+    def width(self):
+        return 10
+
+    def height(self):
+        return 20
+
+
+def test_oval_reused():
+    canvas = FakeCanvas()
+    items = cspine.CanvasItems(canvas)
+    first = items.oval('C2p', 5, 5, 1, fill='red')
+    canvas.calls.clear()
+    second = items.oval('C2p', 8, 8, 1, fill='red')
+    assert first == second
+    assert canvas.calls == [('coords', (second, 7, 7, 9, 9), {})]
+
+
+def test_recolor_and_hide():
+    canvas = FakeCanvas()
+    items = cspine.CanvasItems(canvas)
+    item = items.oval('top', 5, 5, 1, fill='red')
+    items.hide('top')
+    items.hide('top')  # already hidden: no call
+    assert canvas.calls[-1] == ('itemconfig', (item,), {'state': 'hidden'})
+    n_calls = len(canvas.calls)
+    items.oval('top', 5, 5, 1, fill='blue')
+    assert canvas.calls[n_calls + 1] == ('itemconfig', (item,), {'fill': 'blue', 'state': 'normal'})
+
+
+def test_image_only_swapped_on_change():
+    canvas = FakeCanvas()
+    items = cspine.CanvasItems(canvas)
+    photo = FakePhoto()
+    items.image('image', photo)
+    canvas.calls.clear()
+    items.image('image', photo)
+    assert not [c for c in canvas.calls if c[0] == 'itemconfig']
+    items.image('image', FakePhoto())
+    assert [c for c in canvas.calls if c[0] == 'itemconfig']
+
+
+class OverlapCanvas(FakeCanvas):
+    "every item overlaps every point"
+    def find_overlapping(self, *box):
+        return tuple(range(1, self.n + 1))
+
+
+def test_at_skips_hidden():
+    canvas = OverlapCanvas()
+    items = cspine.CanvasItems(canvas)
+    items.oval('suggest:C2m', 5, 5, 6)
+    items.oval('suggest:top', 5, 5, 6)
+    items.oval('C2p', 5, 5, 6)
+    items.hide('C2p')
+    assert items.at(5, 5) == ['suggest:top', 'suggest:C2m']
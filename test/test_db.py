@@ -0,0 +1,175 @@
+from cspine import db
+import datetime
+import sqlite3
+import threading
+import pytest
+
+
+def row(image='img.nii.gz', label='C2p', x=1):
+    return (image, 'rater', label, datetime.datetime.now(), x, 2, 3, 'NA', '')
+
+
+def count(db_fname):
+    with sqlite3.connect(db_fname) as conn:
+        return conn.execute("select count(*) from point").fetchone()[0]
+
+
+def test_writer_flush(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname, flush_interval=60)
+    for i in range(10):
+        writer.put(row(x=i))
+    assert writer.flush(timeout=5)
+    assert count(db_fname) == 10
+    # one group commit, not one per row
+    assert writer.stats()['commits'] == 1
+    assert writer.stats()['rows'] == 10
+    writer.close()
+
+
+def test_writer_batches(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname, flush_interval=60, batch_size=5)
+    for i in range(12):
+        writer.put(row(x=i))
+    writer.close()
+    assert count(db_fname) == 12
+    assert writer.stats()['commits'] == 3
+
+
+def test_writer_interval(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname, flush_interval=.05)
+    writer.put(row())
+    for _ in range(100):
+        if writer.rows_written:
+            break
+        threading.Event().wait(.02)
+    assert count(db_fname) == 1
+    writer.close()
+
+
+def test_writer_close_twice(tmp_path):
+    writer = db.DBWriter(str(tmp_path / "cspine.db"), wal=False)
+    writer.put(row())
+    writer.close()
+    writer.close()
+    assert not writer.flush()
+
+
+def test_annotated_incremental(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname)
+    writer.put(row('a.nii.gz'))
+    writer.put(row('b.nii.gz'))
+    writer.put(row('a.nii.gz', label='C2m'))
+    writer.flush()
+    images, last = db.annotated_images(db_fname)
+    assert images == {'a.nii.gz', 'b.nii.gz'}
+    assert last == 3
+
+    # nothing new
+    assert db.annotated_images(db_fname, last) == (set(), last)
+
+    writer.put(row('c.nii.gz'))
+    writer.close()
+    assert db.annotated_images(db_fname, last) == ({'c.nii.gz'}, 4)
+
+
+def test_index_used(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    conn = db.connect(db_fname)
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM point WHERE image = ?", ('a',)).fetchall()
+    conn.close()
+    assert 'point_image_label_created' in str(plan)
+
+
+def test_latest_points(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname)
+    writer.put(row('a.nii.gz', label='C2p', x=1))
+    writer.put(row('a.nii.gz', label='C2p', x=2))
+    writer.put(row('a.nii.gz', label='C2m', x=3))
+    writer.put(row('b.nii.gz', label='C2p', x=4))
+    writer.close()
+    latest = db.latest_points(db_fname, 'a.nii.gz')
+    assert sorted(latest) == ['C2m', 'C2p']
+    assert latest['C2p']['x'] == 2
+    assert db.latest_points(db_fname, 'a.nii.gz', user='other') == {}
+
+
+def test_latest_backfill(tmp_path):
+    "db made before latest_point existed gets filled on connect"
+    db_fname = str(tmp_path / "cspine.db")
+    with sqlite3.connect(db_fname) as conn:
+        conn.execute("""create table point (image text, user text, label text,
+                        created timestamp, x int, y int, z int, rating int, note text)""")
+        conn.executemany(db.INSERT_POINT, [row(x=1), row(x=5), row(label='top', x=9)])
+    conn.close()
+    db.connect(db_fname).close()
+    latest = db.latest_points(db_fname, 'img.nii.gz')
+    assert latest['C2p']['x'] == 5
+    assert latest['top']['x'] == 9
+
+
+def test_label_sets(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname)
+    writer.put(row('a.nii.gz', label='top'))
+    writer.put(row('a.nii.gz', label='C2m'))
+    writer.put(row('a.nii.gz', label='C2m'))
+    writer.flush()
+    labels, last = db.label_sets(db_fname)
+    assert labels == {'a.nii.gz': {'top', 'C2m'}}
+    writer.put(row('b.nii.gz', label='top'))
+    writer.close()
+    assert db.label_sets(db_fname, last) == ({'b.nii.gz': {'top'}}, 4)
+
+
+def test_writer_open_error(tmp_path):
+    "a db that can't be opened is reported on put and flush, not dropped silently"
+    writer = db.DBWriter(str(tmp_path / "missing" / "cspine.db"))
+    assert isinstance(writer.open_error, sqlite3.Error)
+    with pytest.raises(sqlite3.Error):
+        writer.put(row())
+    with pytest.raises(sqlite3.Error):
+        writer.flush()
+    writer.close()
+
+
+def test_writer_drops_bad_rows(tmp_path):
+    "a commit error other than a lock isn't retried: the batch is dropped, later rows are saved"
+    db_fname = str(tmp_path / "cspine.db")
+    with sqlite3.connect(db_fname) as conn:
+        conn.execute("""create table point (image text, user text, label text, created timestamp,
+                        x int check (x < 100), y int, z int, rating int, note text)""")
+    conn.close()
+    writer = db.DBWriter(db_fname, flush_interval=.01)
+    writer.put(row(x=1000))
+    assert not writer.flush(timeout=5)
+    assert isinstance(writer.error, sqlite3.IntegrityError)
+    assert writer.dropped == 1
+    writer.put(row(x=1))
+    assert writer.flush(timeout=5)
+    assert writer.error is None
+    assert count(db_fname) == 1
+    writer.close()
+
+
+class LockedWriter(db.DBWriter):
+    "every commit times out on a lock"
+    attempts = 0
+
+    def _commit(self, conn, rows):
+        self.attempts += 1
+        self.error = sqlite3.OperationalError("database is locked")
+        return False
+
+
+def test_writer_lock_retries_limited(tmp_path):
+    writer = LockedWriter(str(tmp_path / "cspine.db"), flush_interval=.01, max_retries=2)
+    writer.put(row())
+    assert not writer.flush(timeout=5)
+    assert writer.attempts == 3
+    assert writer.dropped == 1
+    writer.close()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+pydicom = pytest.importorskip("pydicom")
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from cspine import dicom, sliceio, volcache
+from cspine.image import StructImg
+
+
+def write_series(dirname, slices, spacing=(0.5, 0.8), thickness=1.2, series=None, prefix="IM"):
+    """
+    axial slices, rows toward posterior and columns toward patient left (LPS +x, +y)
+    like a standard axial acquisition. files written in shuffled order
+    """
+    series = series or generate_uid()
+    dirname.mkdir(exist_ok=True)
+    order = np.random.default_rng(0).permutation(len(slices))
+    for k in order:
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'  # MR
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID = series
+        ds.InstanceNumber = int(len(slices) - k)  # not in slice order
+        ds.ImagePositionPatient = [10.0, 20.0, 30.0 + k * thickness]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = list(spacing)
+        ds.Rows, ds.Columns = slices[k].shape
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.PixelData = slices[k].astype(np.int16).tobytes()
+        ds.save_as(dirname / f"{prefix}{k:04d}.dcm", enforce_file_format=True)
+    (dirname / "notes.txt").write_text("not dicom")
+    return dirname
+
+
+@pytest.fixture
+def slices():
+    return np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6)  # (slice, row, column)
+
+
+def test_read_series(tmp_path, slices):
+    series = write_series(tmp_path / "t1", slices)
+    volume, affine = dicom.read_series(series, workers=3)
+    # column, row, slice
+    assert volume.shape == (6, 5, 4)
+    assert volume[2, 1, 3] == slices[3, 1, 2]
+    # +column is patient left (-R), +row posterior (-A), +slice superior
+    np.testing.assert_allclose(np.diag(affine)[:3], [-0.8, -0.5, 1.2])
+    np.testing.assert_allclose(affine[:3, 3], [-10, -20, 30])
+
+    data, strategy = sliceio.open_volume(series)
+    assert strategy == 'dicom'
+    # RAS+: right to left columns and anterior to posterior rows are flipped
+    assert data.shape == (6, 5, 4)
+    for i, j, k in [(0, 0, 0), (5, 4, 3), (1, 2, 3)]:
+        assert data[i, j, k] == slices[k, 4 - j, 5 - i]
+
+
+def test_largest_series(tmp_path, slices, caplog):
+    series = write_series(tmp_path / "mixed", slices)
+    write_series(series, slices[:2], series=generate_uid(), prefix="LOC")
+    volume, _ = dicom.read_series(series)
+    assert volume.shape[2] == 4
+    assert "2 series" in caplog.text
+
+
+def test_structimg_cache(tmp_path, slices):
+    series = write_series(tmp_path / "t1", slices)
+    cache = volcache.VolumeCache(tmp_path / "cache")
+    first = StructImg(str(series), cache=cache)
+    second = StructImg(str(series), cache=cache)
+    assert isinstance(second.data, np.memmap)
+    np.testing.assert_array_equal(first.data, second.data)
+    # a changed slice is a new cache entry
+    key = cache.key(series)
+    (series / "notes.txt").write_text("changed")
+    assert cache.key(series) != key
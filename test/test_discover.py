@@ -0,0 +1,63 @@
+from cspine import discover
+import os
+
+
+def make_tree(root):
+    for sub in ('sub-1', 'sub-2'):
+        for ses in ('ses-1', 'ses-2'):
+            anat = root / sub / ses / 'anat'
+            anat.mkdir(parents=True)
+            (anat / f'{sub}_{ses}_T1w.nii.gz').write_text('')
+            (anat / f'{sub}_{ses}_T2w.nii.gz').write_text('')
+    return str(root / 'sub-*' / 'ses-*' / 'anat' / '*_T1w.nii.gz')
+
+
+def test_discover_matches_glob(tmp_path):
+    import glob
+    pattern = make_tree(tmp_path)
+    assert list(discover.discover(pattern)) == sorted(glob.glob(pattern))
+    assert len(list(discover.discover(pattern))) == 4
+
+
+def test_manifest_reused(tmp_path):
+    pattern = make_tree(tmp_path / "data")
+    manifest_fname = str(tmp_path / "manifest.json")
+    manifest = discover.Manifest(manifest_fname)
+    first = list(discover.discover(pattern, manifest))
+    manifest.save()
+
+    # listings come from manifest: a file added without changing the
+    # directory mtime is not seen
+    anat = tmp_path / "data" / "sub-1" / "ses-1" / "anat"
+    mtime = os.stat(anat).st_mtime_ns
+    (anat / "extra_T1w.nii.gz").write_text('')
+    os.utime(anat, ns=(mtime, mtime))
+    manifest = discover.Manifest(manifest_fname)
+    assert list(discover.discover(pattern, manifest)) == first
+    assert not manifest.changed
+
+    # changed directory is listed again
+    os.utime(anat, ns=(mtime + 10**9, mtime + 10**9))
+    assert len(list(discover.discover(pattern, manifest))) == 5
+
+
+def test_stream_inputs(tmp_path):
+    pattern = make_tree(tmp_path / "data")
+    flist = tmp_path / "list.txt"
+    flist.write_text("# comment\na.nii.gz\n\nb.nii.gz\n")
+    found = discover.stream([pattern, 'c.nii.gz'], [str(flist)], manifest_fname=None)
+    res = []
+    while (fname := found.get(timeout=5)) is not None:
+        res.append(fname)
+    assert res[:2] == ['a.nii.gz', 'b.nii.gz']
+    assert res[-1] == 'c.nii.gz'
+    assert len(res) == 7
+
+
+def test_discover_dirs(tmp_path):
+    "trailing / matches directories, e.g. DICOM series"
+    import glob
+    pattern = os.path.dirname(make_tree(tmp_path)) + os.sep
+    found = list(discover.discover(pattern))
+    assert found == sorted(d.rstrip(os.sep) for d in glob.glob(pattern))
+    assert len(found) == 4
@@ -0,0 +1,82 @@
+from cspine import db, export
+from cspine.labels import LABELS
+import datetime
+import os
+import pytest
+
+
+@pytest.fixture
+def db_fname(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname)
+    now = datetime.datetime.now() - datetime.timedelta(minutes=5)
+    for image in ('/d/sub-1_T1w.nii.gz', '/d/NCANDA_S001/t1.nii.gz'):
+        for i, label in enumerate(['C2m', 'top', 'C2m']):
+            writer.put((image, 'rater', label, now + datetime.timedelta(seconds=i),
+                        i, 10, 20, 'NA', ''))
+    writer.close()
+    return db_fname
+
+
+def test_iter_latest(db_fname):
+    res = dict(export.iter_latest(db_fname, chunk_size=1))
+    assert len(res) == 2
+    rows = res['/d/sub-1_T1w.nii.gz']
+    # ordered like LABELS, newest C2m
+    assert [r['label'] for r in rows] == ['top', 'C2m']
+    assert rows[1]['x'] == 2
+    assert tuple(rows[0].keys()) == export.TSV_COLUMNS
+
+
+def test_export_tsvs(db_fname, tmp_path):
+    out = tmp_path / "out"
+    assert export.export_tsvs(db_fname, out) == {'written': 2, 'skipped': 0}
+    fname = out / "NCANDA_S001_t1_cspine-latest.tsv"
+    lines = open(fname).read().splitlines()
+    assert lines[0].startswith("# timestamp=")
+    assert "input=/d/NCANDA_S001/t1.nii.gz" in lines[0]
+    assert lines[1].split("\t") == list(export.TSV_COLUMNS)
+    # every label, like the GUI save. unplaced ones empty
+    assert [line.split("\t")[0] for line in lines[2:]] == LABELS
+    c2m = lines[2 + LABELS.index('C2m')].split("\t")
+    assert c2m[1:4] == ['2', '10', '20']
+    unplaced = lines[2 + LABELS.index('C3m')].split("\t")
+    assert unplaced[1:4] == ['None'] * 3 and unplaced[5] == 'NA'
+
+    # nothing changed: skip
+    assert export.export_tsvs(db_fname, out) == {'written': 0, 'skipped': 2}
+    assert export.export_tsvs(db_fname, out, force=True)['written'] == 2
+    assert export.export_tsvs(db_fname, out, jobs=1, force=True)['written'] == 2
+
+    # new point makes one stale
+    os.utime(fname, (0, 0))
+    assert export.export_tsvs(db_fname, out) == {'written': 1, 'skipped': 1}
+
+
+def test_export_long(db_fname, tmp_path):
+    fname = tmp_path / "all.tsv"
+    assert export.export_long(db_fname, fname) == 4
+    lines = open(fname).read().splitlines()
+    assert lines[0].split("\t")[0] == 'image'
+    assert len(lines) == 5
+
+
+def test_export_same_basename(tmp_path):
+    "images named alike in different directories don't overwrite each other"
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname)
+    images = [f'/d/sub-{i}/anat/T1w.nii.gz' for i in (1, 2)]
+    for i, image in enumerate(images):
+        writer.put((image, 'rater', 'C2m', datetime.datetime.now(), i, 10, 20, 'NA', ''))
+    writer.close()
+    out = tmp_path / "out"
+    assert export.export_tsvs(db_fname, out) == {'written': 2, 'skipped': 0}
+    assert sorted(os.listdir(out)) == ['sub-1_anat_T1w_cspine-latest.tsv', 'sub-2_anat_T1w_cspine-latest.tsv']
+
+
+def test_export_missing_db(tmp_path):
+    "a mistyped --db is an error, not an empty export (or a new empty db)"
+    missing = tmp_path / "typo.db"
+    with pytest.raises(FileNotFoundError):
+        export.export_long(missing, tmp_path / "all.tsv")
+    assert not missing.exists()
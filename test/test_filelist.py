@@ -0,0 +1,86 @@
+from cspine.filelist import FileIndex
+from cspine.labels import LABELS
+import os
+
+
+def fnames(n=1000):
+    return [f"/BIDS/sub-{i:05d}/ses-1/anat/sub-{i:05d}_ses-1_T1w.nii.gz" for i in range(n)]
+
+
+def test_filter_query():
+    index = FileIndex(fnames())
+    assert len(index.view) == 1000
+    assert len(index.filter("sub-0001")) == 10
+    # narrowing only looks at previous view
+    index.view = index.view[:3]
+    assert len(index.filter("sub-00012")) == 1
+    # widening rescans everything
+    assert len(index.filter("SUB-0001")) == 10
+    assert index.filter("") == list(range(1000))
+
+
+def test_status():
+    names = fnames(3)
+    index = FileIndex(names)
+    index.update_labels({os.path.abspath(names[0]): set(LABELS),
+                         os.path.abspath(names[1]): {'top'}})
+    assert [index.status_of(i) for i in range(3)] == ['annotated', 'partial', 'untouched']
+    assert index.filter(status='partial') == [1]
+    assert index.row_text(0).startswith('*')
+
+    # new db rows change what passes the status filter
+    index.update_labels({os.path.abspath(names[1]): set(LABELS)})
+    assert index.view == []
+
+
+def test_add_shares_list():
+    names = fnames(2)
+    index = FileIndex(names)
+    index.filter("sub-00003")
+    index.add(fnames(5)[2:])
+    assert len(names) == 5
+    assert index.view == [3]
+
+
+class FakeWidget:
+    "records listbox and scrollbar calls instead of drawing"
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *a, **kw: self.calls.append((name, a))
+
+
+def test_virtual_list_keys():
+    "keys move the selection through the whole view, scrolling it into sight"
+    import cspine
+    vlist = cspine.VirtualList.__new__(cspine.VirtualList)
+    vlist.index = FileIndex(fnames(100))
+    vlist.listbox, vlist.scroll = FakeWidget(), FakeWidget()
+    opened = []
+    vlist.on_select = opened.append
+    vlist.top, vlist.rows, vlist.current = 0, 10, None
+
+    assert vlist.move(1) == "break"
+    assert opened == [0]
+    for _ in range(10):
+        vlist.move(1)
+    # one row past the bottom scrolls one row
+    assert (vlist.current, vlist.top) == (10, 1)
+    assert ('selection_set', (9,)) in vlist.listbox.calls
+    vlist.move(vlist.rows)
+    assert (vlist.current, vlist.top) == (20, 11)
+    vlist.select(len(vlist.index.view) - 1)
+    assert (vlist.current, vlist.top) == (99, 90)
+    vlist.move(1)
+    assert vlist.current == 99
+    vlist.select(0)
+    assert (vlist.current, vlist.top) == (0, 0)
+    vlist.move(-1)
+    assert opened[-1] == 0
+
+    # position is kept through a filter
+    vlist.select(15)
+    vlist.index.filter("sub-0001")
+    vlist.move(1)
+    assert vlist.current == 16
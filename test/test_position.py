@@ -0,0 +1,61 @@
+from cspine import db, position
+import datetime
+import cspine
+import numpy as np
+from conftest import write_nii
+
+SHAPE = (64, 96, 96)
+MID = 36    #: mirror plane, off the volume's middle
+SPINE = 36  #: spine's y (display column)
+
+
+def phantom(seed=0):
+    "head above a neck with a bright spine, symmetric about x=MID"
+    x, y, z = np.meshgrid(*[np.arange(n) for n in SHAPE], indexing='ij')
+    head = ((x - MID) / 20)**2 + ((y - 48) / 40)**2 + ((z - 65) / 30)**2 < 1
+    neck = (((x - MID) / 10)**2 + ((y - 40) / 16)**2 < 1) & (z < 50)
+    spine = (abs(x - MID) < 3) & (abs(y - SPINE) < 3) & (z < 50)
+    data = 300. * (head | neck) + 300 * spine
+    return data + np.random.default_rng(seed).normal(0, 10, SHAPE)
+
+
+def test_estimate():
+    pos = position.estimate(phantom())
+    assert pos.sag == MID
+    assert pos.score > .9
+    # within the default zoom window width of the spine
+    assert abs(pos.cor - SPINE) < 15 // 2
+    # window (bottom rows) reaches the skull base: head is 1.4x wider than the neck from z=40
+    assert pos.zoom_fac == 2
+    assert SHAPE[2] - SHAPE[2] // pos.zoom_fac <= SHAPE[2] - 1 - 40
+
+
+def test_study(tmp_path):
+    fname = write_nii(tmp_path / "img.nii.gz", phantom().astype(np.int16))
+    db_fname = str(tmp_path / "cspine.db")
+    counts = position.position_study(db_fname, [fname, str(tmp_path / "missing.nii.gz")], jobs=1)
+    assert counts == {'positioned': 1, 'skipped': 0, 'failed': 1}
+    assert position.position_study(db_fname, [fname], jobs=1)['skipped'] == 1
+
+    row = db.DBWriter(db_fname).position(fname)
+    img = cspine.StructImg(fname)
+    img.set_position(row['sag'], row['cor'], row['zoom_fac'])
+    assert (img.idx_sag, img.zoom_fac, img.zoom_top) == (MID, 2, 48)
+
+
+def test_open_at_keeps_estimated_slice(tmp_path):
+    "suggestions center the coronal line but don't move off the estimated mid-sagittal slice"
+    fname = write_nii(tmp_path / "img.nii.gz", phantom().astype(np.int16))
+    db_fname = str(tmp_path / "cspine.db")
+    now = datetime.datetime.now()
+    db.save_positions(db_fname, [(fname, now, MID, 30, 2, .99)])
+    db.save_suggestions(db_fname, [(fname, label, now, 40 + i, 50, 20, .9, '/d/t.nii.gz')
+                                   for i, label in enumerate(['C2m', 'C3m', 'C4m'])])
+    img = cspine.StructImg(fname)
+    position.open_at(img, db.position(db_fname, fname), db.suggestions(db_fname, fname).values())
+    assert (img.idx_sag, img.idx_cor, img.zoom_fac) == (MID, 41, 2)
+
+    # no position: open on the suggestions' slice
+    img = cspine.StructImg(fname)
+    position.open_at(img, None, db.suggestions(db_fname, fname).values())
+    assert (img.idx_sag, img.idx_cor) == (20, 41)
@@ -0,0 +1,76 @@
+from cspine.image import StructImg
+from cspine.prefetch import Prefetcher
+import numpy as np
+from conftest import write_nii
+
+
+class FakeImg:
+    def __init__(self, fname, nbytes=10):
+        self.fname = fname
+        self.nbytes = nbytes
+
+
+def test_prefetch_neighbors():
+    loaded = []
+    def loader(fname):
+        loaded.append(fname)
+        return FakeImg(fname)
+
+    pf = Prefetcher(loader, ahead=2, behind=1)
+    fnames = ['a', 'b', 'c', 'd', 'e']
+    pf.around(fnames, 1)
+    assert pf.get('c').fname == 'c'
+    pf.pool.shutdown(wait=True)
+    assert set(loaded) == {'a', 'b', 'c', 'd'}
+
+
+def test_prefetch_evicts_far():
+    pf = Prefetcher(FakeImg, ahead=1, behind=0)
+    fnames = ['a', 'b', 'c', 'd']
+    pf.around(fnames, 0)
+    pf.get('b')
+    pf.around(fnames, 2)
+    pf.get('d')
+    assert set(pf.loaded()) <= {'c', 'd'}
+    pf.shutdown()
+
+
+def test_prefetch_budget():
+    "only the cursor survives when budget is tiny"
+    pf = Prefetcher(lambda f: FakeImg(f, nbytes=100), ahead=3, behind=0, max_bytes=150)
+    fnames = ['a', 'b', 'c', 'd']
+    pf.around(fnames, 0)
+    pf.pool.shutdown(wait=True)
+    pf._enforce_budget()
+    assert len(pf.loaded()) == 1
+
+
+def test_prefetch_error_raised_on_get():
+    def loader(fname):
+        raise FileNotFoundError(fname)
+    pf = Prefetcher(loader, ahead=1, behind=0)
+    pf.around(['a', 'b'], 0)
+    try:
+        pf.get('b')
+        assert False, "should raise"
+    except FileNotFoundError:
+        pass
+    assert 'b' not in pf.loaded()
+    pf.shutdown()
+
+
+def test_prefetched_view_reset(tmp_path):
+    "an image opened again from the prefetcher starts at the default view"
+    fname = write_nii(tmp_path / "img.nii.gz", np.ones((20, 30, 40), dtype=np.int16))
+    pf = Prefetcher(StructImg, ahead=1, behind=0)
+    img = pf.get(fname)
+    fresh = (img.idx_sag, img.idx_cor, img.zoom_fac, img.zoom_top, img.zoom_left)
+    img.idx_sag, img.idx_cor = 3, 4
+    img.update_zoom(5)
+    img.crop_size = (10, 10)
+    again = pf.get(fname)
+    assert again is img
+    again.reset_view()
+    assert (again.idx_sag, again.idx_cor, again.zoom_fac, again.zoom_top, again.zoom_left) == fresh
+    assert again.crop_size == (0, 0)
+    pf.shutdown()
@@ -0,0 +1,36 @@
+from cspine.profiling import Profiler
+import csv
+import json
+
+
+def test_disabled_records_nothing():
+    prof = Profiler()
+    with prof.span('x'):
+        pass
+    assert prof.timed('y')(lambda: 3)() == 3
+    assert prof.spans == {}
+
+
+def test_spans_and_dump(tmp_path):
+    prof = Profiler(enabled=True)
+    for ms in (0.5, 3, 3, 40):
+        prof.record('draw:zoom', ms / 1000)
+    @prof.timed()
+    def load_image():
+        return 'img'
+    assert load_image() == 'img'
+
+    summary = prof.summary()
+    zoom = summary['draw:zoom']
+    assert zoom['count'] == 4
+    assert round(zoom['p50_ms']) == 3 and round(zoom['max_ms']) == 40
+    assert zoom['hist']['<1ms'] == 1 and zoom['hist']['<5ms'] == 2 and zoom['hist']['<50ms'] == 1
+    assert summary['load_image']['count'] == 1
+    assert prof.status(['draw:zoom', 'missing']).startswith('draw:zoom 40ms (p50 3)')
+
+    prof.dump(tmp_path / "p.json")
+    assert json.load(open(tmp_path / "p.json"))['spans']['draw:zoom']['count'] == 4
+    prof.dump(tmp_path / "p.csv")
+    rows = list(csv.DictReader(open(tmp_path / "p.csv")))
+    assert [r['span'] for r in rows] == ['draw:zoom', 'load_image']
+    assert rows[0]['<5ms'] == '2'
@@ -0,0 +1,48 @@
+import cspine
+import numpy as np
+import pytest
+from conftest import write_nii
+
+
+@pytest.fixture
+def img(tmp_path):
+    rng = np.random.default_rng(2)
+    data = rng.integers(0, 1000, size=(40, 50, 60)).astype(np.int16)
+    return cspine.StructImg(write_nii(tmp_path / "img.nii.gz", data))
+
+
+def test_render_memoized(img):
+    calls = []
+    def make():
+        calls.append(1)
+        return np.rot90(img.data[img.idx_sag, :, :])
+    first = img.render(('sag', img.idx_sag), make)
+    again = img.render(('sag', img.idx_sag), make)
+    assert first is again
+    assert len(calls) == 1
+    assert first['array'].dtype == np.uint8
+
+    # new window is a new render
+    img.min_val += 1
+    img.render(('sag', img.idx_sag), make)
+    assert len(calls) == 2
+
+
+def test_render_evicts(img):
+    img.render_cache_size = 3
+    for i in range(5):
+        img.render(('sag', i), lambda: np.zeros((2, 2)))
+    assert len(img.render_cache) == 3
+    assert [k[1] for k in img.render_cache] == [2, 3, 4]
+
+
+def test_zoom_cache_matches(img):
+    "zoom entry is sag_zoom_matrix, and use_zoom sets the crop it was made with"
+    mat = img.sag_zoom_matrix(rot=5)
+    img.crop_size, img.zoom_left = (0, 0), -1
+    entry = img.zoom_entry(5)
+    assert img.crop_size == (0, 0) and img.zoom_left == -1
+    assert np.array_equal(entry['array'], img.to_uint8(mat))
+    img.use_zoom(entry)
+    assert img.crop_size == mat.shape[::-1]
+    assert img.zoom_left == max(img.idx_cor - img.zoom_width//2, 0)
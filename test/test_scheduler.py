@@ -0,0 +1,89 @@
+from cspine.scheduler import RenderScheduler, from_env
+import threading
+import time
+
+
+class FakeWidget:
+    "after_idle/after that run when told to, like a tk event loop"
+    def __init__(self):
+        self.pending = {}
+        self.n = 0
+
+    def after_idle(self, func):
+        return self.after(0, func)
+
+    def after(self, ms, func):
+        self.n += 1
+        self.pending[self.n] = func
+        return self.n
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+    def run(self):
+        "one trip through the event loop"
+        pending, self.pending = self.pending, {}
+        for func in pending.values():
+            func()
+
+
+def test_coalesce():
+    widget = FakeWidget()
+    drawn = []
+    sched = RenderScheduler(widget)
+    sched.add('sag', lambda: drawn.append('sag'))
+    sched.add('zoom', lambda x: drawn.append(x), render=lambda state: 'zoom')
+    for _ in range(10):
+        sched.request('zoom')
+    sched.request('sag')
+    assert drawn == []
+    widget.run()
+    # one frame, regions in the order they were added
+    assert drawn == ['sag', 'zoom']
+    assert (sched.requests, sched.frames) == (11, 1)
+    widget.run()
+    assert drawn == ['sag', 'zoom']
+
+
+def test_flush():
+    widget = FakeWidget()
+    drawn = []
+    sched = RenderScheduler(widget)
+    sched.add('guide', lambda: drawn.append('guide'))
+    sched.request()
+    sched.flush()
+    assert drawn == ['guide']
+    assert not widget.pending
+
+
+def test_worker_drops_stale():
+    widget = FakeWidget()
+    state = {'rot': 0}
+    drawn = []
+    release = threading.Event()
+    def render(rot):
+        release.wait(5)
+        return rot
+    sched = RenderScheduler(widget, capture=lambda: state['rot'], worker=True, poll_ms=1)
+    sched.add('zoom', drawn.append, render)
+
+    sched.request('zoom')
+    widget.run()  # frame: render 0 submitted
+    state['rot'] = 1
+    sched.request('zoom')  # newer request while 0 is rendering
+    release.set()
+    deadline = time.time() + 5
+    while sched.in_flight or sched.dirty:
+        widget.run()
+        assert time.time() < deadline
+        time.sleep(.01)
+    assert drawn == [1]
+    assert sched.dropped == 1
+    sched.shutdown()
+
+
+def test_from_env():
+    assert from_env(FakeWidget(), environ={}).pool is None
+    sched = from_env(FakeWidget(), environ={'CSPINE_RENDER_THREAD': '1'})
+    assert sched.pool is not None
+    sched.shutdown()
@@ -0,0 +1,116 @@
+from cspine import db, server
+import datetime
+import sqlite3
+import threading
+import time
+import pytest
+
+
+def row(image, user, label='C2p', x=1):
+    return (image, user, label, datetime.datetime.now(), x, 2, 3, 'NA', '')
+
+
+def count(db_fname):
+    with sqlite3.connect(db_fname) as conn:
+        return conn.execute("select count(*) from point").fetchone()[0]
+
+
+@pytest.fixture
+def running(tmp_path):
+    db_fname = str(tmp_path / "cspine.db")
+    sock = str(tmp_path / "cspine.sock")
+    srv = server.AnnotationServer(db_fname, flush_interval=.05).start(sock)
+    yield db_fname, sock, srv
+    srv.stop()
+
+
+def test_remote_writer(running):
+    db_fname, sock, srv = running
+    client = server.writer(db_fname, sock, flush_interval=60)
+    assert isinstance(client, server.RemoteWriter)
+    client.put(row('/d/a.nii.gz', 'rater', 'C2p', x=1))
+    client.put_many([row('/d/a.nii.gz', 'rater', 'C2p', x=5), row('/d/b.nii.gz', 'rater', 'top')])
+    assert client.flush(timeout=5)
+    assert count(db_fname) == 3
+    # reads go through the server and match the direct ones
+    assert client.latest_points('/d/a.nii.gz')['C2p']['x'] == 5
+    assert client.label_sets() == db.label_sets(db_fname)
+    assert client.annotated_images(1) == ({'/d/a.nii.gz', '/d/b.nii.gz'}, 3)
+    assert srv.requests['put'] == 1
+    db.save_suggestions(db_fname, [('/d/c.nii.gz', 'top', datetime.datetime.now(), 1.5, 2, 3, .9, '/d/a.nii.gz')])
+    assert client.suggestions('/d/c.nii.gz')['top']['x'] == 1.5
+    assert srv.requests['suggestions'] == 1
+    client.close()
+
+
+class RefusingServer(server.AnnotationServer):
+    "answers the first put with an error"
+    refused = 0
+
+    async def dispatch(self, request):
+        if request['op'] == 'put' and not self.refused:
+            self.refused += 1
+            raise sqlite3.IntegrityError("constraint failed")
+        return await super().dispatch(request)
+
+
+def test_put_refused(tmp_path):
+    "an error reply to put is retried, the writer keeps going"
+    db_fname = str(tmp_path / "cspine.db")
+    srv = RefusingServer(db_fname, flush_interval=.05).start(str(tmp_path / "cspine.sock"))
+    client = server.writer(db_fname, str(tmp_path / "cspine.sock"), flush_interval=.05)
+    client.put(row('/d/a.nii.gz', 'rater'))
+    assert client.flush(timeout=5)
+    client.put(row('/d/a.nii.gz', 'rater', 'top'))
+    assert client.flush(timeout=5)
+    assert srv.refused == 1 and client.remote and client.thread.is_alive()
+    assert count(db_fname) == 2
+    client.close()
+    srv.stop()
+
+
+def test_fallback(tmp_path, running, caplog):
+    db_fname, sock, srv = running
+    # no server there: plain writer
+    other = str(tmp_path / "other.db")
+    assert type(server.writer(other, str(tmp_path / "none.sock"))) is db.DBWriter
+    # server for another db
+    assert type(server.writer(other, sock)) is db.DBWriter
+    warnings = [r.getMessage() for r in caplog.records if r.levelname == 'WARNING']
+    assert "no annotation server" in warnings[0] and f"serves {db_fname}" in warnings[1]
+
+    client = server.writer(db_fname, sock, flush_interval=.05)
+    client.put(row('/d/a.nii.gz', 'rater'))
+    assert client.flush(timeout=5)
+    srv.stop()
+    # server went away: keep saving and reading directly
+    client.put(row('/d/a.nii.gz', 'rater', x=9))
+    assert client.flush(timeout=5)
+    assert not client.remote
+    assert client.latest_points('/d/a.nii.gz')['C2p']['x'] == 9
+    assert count(db_fname) == 2
+    client.close()
+
+
+def test_concurrent_clients(running):
+    "throughput with many raters clicking at once. all rows land, none lost to locking"
+    db_fname, sock, srv = running
+    n_clients, n_rows = 8, 200
+    clients = [server.writer(db_fname, sock, flush_interval=.01, batch_size=10) for _ in range(n_clients)]
+    def click(i, client):
+        for j in range(n_rows):
+            client.put(row(f'/d/{i}.nii.gz', f'rater{i}', x=j))
+        client.flush(timeout=30)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=click, args=(i, c)) for i, c in enumerate(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    assert count(db_fname) == n_clients * n_rows
+    # rows from all clients share server commits
+    assert srv.writer.stats()['commits'] < n_clients * n_rows / 10
+    print(f"{n_clients * n_rows / elapsed:.0f} rows/s from {n_clients} clients")
+    for c in clients:
+        c.close()
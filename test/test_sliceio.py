@@ -0,0 +1,50 @@
+from cspine import sliceio
+import nibabel as nib
+import numpy as np
+import pytest
+from conftest import write_nii
+
+
+def ramp(shape=(6, 7, 8)):
+    return np.arange(np.prod(shape), dtype=np.int16).reshape(shape)
+
+
+# L,S,P: flipped x and swapped y/z
+LSP = np.array([[-1, 0, 0, 0], [0, 0, -1, 0], [0, 1, 0, 0], [0, 0, 0, 1]])
+
+
+def test_reoriented_matches_canonical(tmp_path):
+    fname = write_nii(tmp_path / "lsp.nii", ramp(), LSP)
+    canonical = np.asanyarray(nib.as_closest_canonical(nib.load(fname)).dataobj)
+    data, strategy = sliceio.open_volume(fname)
+    assert isinstance(data, sliceio.Reoriented)
+    assert data.shape == canonical.shape
+    assert np.array_equal(np.asanyarray(data), canonical)
+    for key in [(2,), (slice(None), 3), (slice(1, 4), -1, slice(None, None, 2)), (0, 0, 0)]:
+        assert np.array_equal(data[key], canonical[key]), key
+    with pytest.raises(IndexError):
+        data[100]
+
+
+@pytest.mark.parametrize("ext,strategy", [(".nii", "mmap"), (".nii.gz", None)])
+def test_open_volume(tmp_path, ext, strategy):
+    fname = write_nii(tmp_path / ("img" + ext), ramp())
+    data, used = sliceio.open_volume(fname)
+    if strategy is None:
+        strategy = 'indexed_gzip' if sliceio.HAVE_INDEXED_GZIP else 'gzip'
+    assert used == strategy
+    assert np.array_equal(data[3], nib.load(fname).get_fdata()[3])
+    if used == 'mmap':
+        assert isinstance(data, np.memmap)
+
+
+def test_slice_cache():
+    data = np.arange(4*5*6).reshape(4, 5, 6)
+    slices = sliceio.SliceCache(data, size=2)
+    assert np.array_equal(slices.sag(1), data[1])
+    assert np.array_equal(slices.cor(2), data[:, 2, :])
+    assert slices.sag(1) is slices.sag(1)
+    assert (slices.hits, slices.misses) == (2, 2)
+    assert not slices.sag(1).flags.writeable
+    slices.sag(2), slices.sag(3)
+    assert 1 not in slices.slices[0]
@@ -0,0 +1,42 @@
+from cspine import db, snapshot
+from cspine.annotations import AnnotationSet
+import cspine
+import datetime
+import numpy as np
+from PIL import Image
+from conftest import write_nii
+
+
+def noise(shape=(20, 60, 70)):
+    return np.random.default_rng(0).integers(0, 1000, shape).astype(np.int16)
+
+
+def test_snapshot_headless(tmp_path):
+    "no tk root needed"
+    img = cspine.StructImg(write_nii(tmp_path / "img.nii.gz", noise()))
+    points = AnnotationSet()
+    points['C2m'].update(30, 60, 8)
+    points['top'].update(32, 50, 8)
+    res = snapshot.snapshot(img, points, rot=5, title='img')
+    assert isinstance(res, Image.Image)
+    assert img.idx_sag == 8 and img.idx_cor == 31
+    sag = img.sag_entry()['image']
+    assert res.width == sag.width + img.crop_size[0]
+    # C2m drawn in its color on the sagittal slice
+    assert res.getpixel((30, 14 + 60)) == Image.new('RGB', (1, 1), points['C2m'].color).getpixel((0, 0))
+
+
+def test_snapshot_study(tmp_path):
+    fnames = [write_nii(tmp_path / f"sub-{i}_T1w.nii.gz", noise()) for i in range(2)]
+    db_fname = str(tmp_path / "cspine.db")
+    writer = db.DBWriter(db_fname)
+    past = datetime.datetime.now() - datetime.timedelta(minutes=5)
+    for fname in fnames + [str(tmp_path / "missing.nii.gz")]:
+        writer.put((fname, 'rater', 'C2m', past, 30, 60, 8, 'NA', ''))
+    writer.close()
+
+    out = tmp_path / "qc"
+    counts = snapshot.snapshot_study(db_fname, out, jobs=2)
+    assert counts == {'written': 2, 'skipped': 0, 'failed': 1}
+    assert (out / "sub-0_T1w_cspine-latest.png").exists()
+    assert snapshot.snapshot_study(db_fname, out, images=fnames[:1], jobs=1)['skipped'] == 1
@@ -0,0 +1,74 @@
+from cspine import db, suggest
+from cspine.labels import LABELS
+import datetime
+import numpy as np
+from conftest import write_nii
+
+SHAPE = (64, 128, 128)
+#: display x, y of each label's bright blob
+POINTS = [(40 + 6*(i % 4), 10 + 8*i) for i in range(len(LABELS))]
+
+
+def write_blobs(fname, shift=(0, 0), seed=0):
+    "noise with a blob at each point, moved by shift (display x, y) on sagittal slices 28-35"
+    data = np.random.default_rng(seed).normal(100, 10, SHAPE).astype(np.float32)
+    for x, y in POINTS:
+        x, y = x + shift[0], y + shift[1]
+        k = SHAPE[2] - 1 - y  # displayed slices are rotated: rows count down from the top
+        data[28:36, x-2:x+3, k-1:k+2] += 400
+    return write_nii(fname, data)
+
+
+def annotate(db_fname, image):
+    conn = db.connect(db_fname)
+    with conn:
+        conn.executemany(db.INSERT_POINT, [(image, 'rater', label, datetime.datetime.now(), x, y, 32, 'NA', '')
+                                           for label, (x, y) in zip(LABELS, POINTS)])
+    conn.close()
+
+
+def test_follows_shift(tmp_path):
+    template = write_blobs(str(tmp_path / "a.nii.gz"))
+    moved = write_blobs(str(tmp_path / "b.nii.gz"), shift=(5, -3), seed=1)
+    db_fname = str(tmp_path / "cspine.db")
+    annotate(db_fname, template)
+    templates = suggest.load_templates(db_fname)
+    assert len(templates) == 1 and templates[0].z == 32
+    rows = suggest.suggest_image(moved, templates)
+    assert [r[1] for r in rows] == LABELS
+    xy = np.array([r[3:5] for r in rows])
+    assert np.allclose(xy, np.array(POINTS) + (5, -3))
+    assert min(r[6] for r in rows) > .9
+
+
+def test_study(tmp_path):
+    template = write_blobs(str(tmp_path / "a.nii.gz"))
+    new = [write_blobs(str(tmp_path / f"n{i}.nii.gz"), shift=(i, i), seed=i) for i in range(2)]
+    db_fname = str(tmp_path / "cspine.db")
+    annotate(db_fname, template)
+    missing = str(tmp_path / "missing.nii.gz")
+    counts = suggest.suggest_study(db_fname, [template, *new, missing], jobs=2)
+    assert counts == {'suggested': 2, 'skipped': 1, 'failed': 1}
+    # stored apart from clicks
+    assert db.annotated_images(db_fname)[0] == {template}
+    assert db.suggested_images(db_fname) == set(new)
+    got = db.DBWriter(db_fname).suggestions(new[1])
+    assert (got['C2m']['x'], got['C2m']['y']) == (POINTS[2][0] + 1, POINTS[2][1] + 1)
+    assert got['C2m']['source'] == template
+    assert {r['z'] for r in got.values()} == {32}  # middle of the volume: no position
+    # done already, unless forced
+    assert suggest.suggest_study(db_fname, new, jobs=1)['skipped'] == 2
+    assert suggest.suggest_study(db_fname, new, jobs=1, force=True)['suggested'] == 2
+
+
+def test_study_on_position(tmp_path):
+    "images are matched on the estimated mid-sagittal slice, not the middle of the volume"
+    template = write_blobs(str(tmp_path / "a.nii.gz"))
+    new = write_blobs(str(tmp_path / "n.nii.gz"), shift=(2, 2), seed=1)
+    db_fname = str(tmp_path / "cspine.db")
+    annotate(db_fname, template)
+    db.save_positions(db_fname, [(new, datetime.datetime.now(), 29, 60, 2, .9)])
+    assert suggest.suggest_study(db_fname, [new], jobs=1)['suggested'] == 1
+    got = db.suggestions(db_fname, new)
+    assert {r['z'] for r in got.values()} == {29}
+    assert (got['C2m']['x'], got['C2m']['y']) == (POINTS[2][0] + 2, POINTS[2][1] + 2)
@@ -0,0 +1,64 @@
+from cspine import transform
+import cspine
+import cv2
+import numpy as np
+import pytest
+
+
+def test_rotation_matches_cv2():
+    M = transform.rotation(10, 90)
+    assert np.allclose(M, cv2.getRotationMatrix2D((0, 90), 10, 1))
+    # cached matrix is not handed out
+    M[0, 0] = 100
+    assert transform.rotation(10, 90)[0, 0] != 100
+
+
+def test_view_matches_per_point():
+    "composed matrix agrees with rotate-then-point_onto_zoom"
+    img = cspine.StructImg.__new__(cspine.StructImg)
+    img.zoom_left, img.zoom_fac, img.pixdim, img.crop_size = 80, 3, (100, 256, 256), (90, 255)
+    view = transform.ViewTransform.from_img(img, rot=7.5)
+    pts = np.array([[100, 200], [110, 180.5], [95, 230]])
+
+    M = cspine.affine(7.5, img.crop_size[1])
+    expect = [img.point_onto_zoom(*np.dot(M, [x, y, 1])) for x, y in pts]
+    assert np.allclose(view.to_view(pts), expect)
+
+    # round trip
+    assert np.allclose(view.to_brain(view.to_view(pts)), pts)
+    # single point
+    assert view.to_view(pts[0]).shape == (2,)
+
+
+@pytest.mark.parametrize("rot", [0, 5, -12.5])
+def test_zoom_matches_warp_crop_resize(rot):
+    "one remap of the zoom window == rotating the whole slice, cropping, resizing"
+    full = np.random.default_rng(0).random((120, 160)).astype(np.float32) * 1000
+    h, w = full.shape
+    left, top, width, fac = 140, 40, 30, 3  # crop runs off the right edge
+    rotated = cv2.warpAffine(full, cv2.getRotationMatrix2D((0, h), rot, 1), (w, h)) if rot else full
+    crop = rotated[h-top:h, left:min(left+width, w)]
+    expect = cv2.resize(crop, (crop.shape[1]*fac, crop.shape[0]*fac), interpolation=cv2.INTER_NEAREST)
+    res = transform.zoom(full, rot, left, top, width, fac)
+    assert res.shape == (top*fac, 20*fac)
+    assert np.allclose(res, expect, atol=.1)
+    # maps reused for the same view
+    assert transform.zoom_maps(float(rot), float(h), left, top, 20, fac) is \
+        transform.zoom_maps(float(rot), float(h), left, top, 20, fac)
+
+
+@pytest.mark.parametrize("rot", [5, -12.5])
+def test_zoom_int16_tolerance(rot):
+    "integer slices differ from warp, crop, resize only by 1/32 pixel position rounding"
+    full = (np.random.default_rng(1).random((120, 160)) * 3000).astype(np.int16)
+    h, w = full.shape
+    left, top, width, fac = 100, 60, 50, 3
+    rotated = cv2.warpAffine(full, cv2.getRotationMatrix2D((0, h), rot, 1), (w, h))
+    crop = rotated[h-top:h, left:left+width]
+    expect = cv2.resize(crop, (crop.shape[1]*fac, crop.shape[0]*fac), interpolation=cv2.INTER_NEAREST)
+    res = transform.zoom(full, rot, left, top, width, fac)
+    assert res.dtype == np.int16
+    diff = np.abs(res.astype(int) - expect)
+    step = max(np.abs(np.diff(full.astype(int), axis=a)).max() for a in (0, 1))
+    assert diff.max() <= step / 16 + 1
+    assert (diff > 1).mean() < .05
@@ -0,0 +1,74 @@
+import cspine
+from cspine import volcache
+from cspine.volcache import VolumeCache
+import numpy as np
+import os
+from conftest import write_nii
+
+
+def ramp(shape=(20, 30, 40)):
+    return np.arange(np.prod(shape), dtype=np.int16).reshape(shape)
+
+
+def test_cache_roundtrip(tmp_path):
+    fname = write_nii(tmp_path / "img.nii.gz", ramp())
+    cache = VolumeCache(tmp_path / "cache")
+    assert cache.load(fname) is None
+
+    first = cspine.StructImg(fname, cache=cache)
+    data, settings = cache.load(fname)
+    assert isinstance(data, np.memmap)
+    assert settings['window'] == [first.min_val, first.max_val]
+
+    second = cspine.StructImg(fname, cache=cache)
+    assert isinstance(second.data, np.memmap)
+    assert (first.strategy, second.strategy) == ('memory', 'cache')
+    assert second.pixdim == first.pixdim
+    assert second.min_val == first.min_val
+    assert np.array_equal(second.data[5], np.asanyarray(first.data)[5])
+
+
+def test_cache_read_only(tmp_path, monkeypatch):
+    "a hit still loads when the entry's mtime can't be bumped"
+    fname = write_nii(tmp_path / "img.nii.gz", ramp())
+    cache = VolumeCache(tmp_path / "cache")
+    cspine.StructImg(fname, cache=cache)
+
+    def refuse(*args, **kwargs):
+        raise PermissionError("read-only")
+    monkeypatch.setattr(os, 'utime', refuse)
+    assert cache.load(fname) is not None
+
+
+def test_cache_key_changes(tmp_path):
+    "rewriting the image invalidates the entry"
+    fname = write_nii(tmp_path / "img.nii.gz", ramp())
+    cache = VolumeCache(tmp_path / "cache")
+    cspine.StructImg(fname, cache=cache)
+    write_nii(fname, ramp((10, 10, 10)))
+    os.utime(fname, ns=(1, 1))
+    assert cache.load(fname) is None
+    assert cspine.StructImg(fname, cache=cache).pixdim == (10, 10, 10)
+
+
+def test_cache_evict(tmp_path):
+    cache = VolumeCache(tmp_path / "cache", max_bytes=9000)
+    fnames = [write_nii(tmp_path / f"{i}.nii.gz", ramp((10, 10, 5)))
+              for i in range(3)]
+    for i, fname in enumerate(fnames):
+        cache.store(fname, np.zeros((10, 10, 5)), {'window': [0, 1]})
+        # make sure ordering is not left to timestamp resolution
+        os.utime(cache._paths(cache.key(fname))[1], (i, i))
+    assert cache.size() <= 9000
+    assert cache.load(fnames[0]) is None
+    assert cache.load(fnames[2]) is not None
+
+
+def test_cache_off(tmp_path, monkeypatch):
+    "cache=False decodes even when a cache is configured (CSPINE_CACHE)"
+    cache = VolumeCache(tmp_path / "cache")
+    monkeypatch.setattr(volcache, 'default_cache', lambda: cache)
+    fname = write_nii(tmp_path / "img.nii.gz", ramp())
+    cspine.StructImg(fname)
+    assert cspine.StructImg(fname).strategy == 'cache'
+    assert cspine.StructImg(fname, cache=False).strategy != 'cache'
@@ -0,0 +1,52 @@
+from cspine.window import intensity_window, to_uint8, window_error, METHODS
+import cspine
+import nibabel as nib
+import numpy as np
+import pytest
+from conftest import write_nii
+
+
+@pytest.fixture
+def vol():
+    rng = np.random.default_rng(1)
+    return rng.gamma(2, 100, size=(60, 70, 80)).astype(np.float32)
+
+
+def test_exact_matches_percentile(vol):
+    assert intensity_window(vol) == tuple(np.percentile(vol, [2, 98]))
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_methods_close(vol, method):
+    report = window_error(vol, methods=[method], max_samples=50_000)
+    assert report[method]['err_pct'] < 2
+
+
+def test_proxy_stride(tmp_path, vol):
+    "strided reads work through nibabel's proxy"
+    fname = write_nii(tmp_path / "img.nii", vol)
+    proxy = nib.load(fname).dataobj
+    lo, hi = intensity_window(proxy, 'stride', max_samples=10_000)
+    assert lo < hi
+
+
+def test_bad_method(vol):
+    with pytest.raises(ValueError):
+        intensity_window(vol, 'median')
+
+
+def test_structimg_method(tmp_path, vol):
+    fname = write_nii(tmp_path / "img.nii.gz", vol)
+    img = cspine.StructImg(fname, window_method='hist')
+    exact = np.percentile(vol, [2, 98])
+    assert img.min_val == pytest.approx(exact[0], rel=.05)
+    img.rewindow('exact')
+    assert img.max_val == pytest.approx(exact[1])
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.uint16, np.float32])
+def test_to_uint8_lut_matches_float(dtype):
+    x = np.random.default_rng(1).integers(0, 250, (30, 40)).astype(dtype)
+    x = np.rot90(x)  # views from slices aren't contiguous
+    expect = np.clip(np.round((x.astype(float) - 20) / (200 - 20) * 255), 0, 255).astype(np.uint8)
+    assert np.array_equal(to_uint8(x, 20, 200), expect)